@@ -0,0 +1,186 @@
+import argparse
+import html
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from plotly.offline import get_plotlyjs
+
+from data_store import store
+from explore_patterns import patterns, pattern_charts
+from inividual_variations import individual_charts
+from key_findings import create_pattern_plot, associations_in_tau_range, predictable_ids, icon_array_html, \
+    people_string, tested_people, demographic_factors, temporal_units, selectable_patterns, available_lags, \
+    derivatives, predict_glucose_columns, format_with_arrow
+from plot_cluster_interval import plot_cluster_confidence_intervals_for_df, daily_ts_graph_description_text, \
+    chart_types
+
+content_title = "Beyond Expected Patterns in Type 1 Diabetes"
+# written once per report directory and referenced by every page instead of inlining plotly into each file
+plotly_bundle = "plotly.min.js"
+# associations with at least this strength achieved statistical power >= 80%
+powered_tau = 0.36
+
+page_template = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{plotly_bundle}"></script>
+<style>
+body {{ font-family: sans-serif; margin: 2rem auto; max-width: 1100px; }}
+table {{ border-collapse: collapse; }}
+td, th {{ border: 1px solid #ddd; padding: 4px 10px; text-align: right; }}
+.powered {{ font-weight: bold; }}
+</style>
+</head>
+<body>
+<p><a href="index.html">{content_title}</a></p>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def slug(text):
+    return "".join(c if c.isalnum() else "-" for c in text.lower()).strip("-")
+
+
+def report_jobs():
+    """All pages of the report as (file name, page kind, parameters) tuples"""
+    jobs = []
+    for pattern_key, (dataset, fix_y) in pattern_charts.items():
+        for plot_type in chart_types:
+            jobs.append((f"pattern-{slug(pattern_key)}-{slug(plot_type)}.html", 'pattern',
+                         (patterns[pattern_key], dataset, fix_y, plot_type)))
+    for title, dataset in individual_charts.items():
+        for plot_type in chart_types:
+            jobs.append((f"individual-{slug(dataset)}-{slug(plot_type)}.html", 'individual',
+                         (title, dataset, plot_type)))
+    for pattern_number in selectable_patterns.values():
+        jobs.append((f"frequency-pattern-{pattern_number}.html", 'frequency', (pattern_number,)))
+        for temporal_unit, timeframe in temporal_units.items():
+            jobs.append((f"associations-pattern-{pattern_number}-{slug(timeframe)}.html", 'associations',
+                         (pattern_number, temporal_unit, timeframe)))
+    for lag_name, lag in available_lags().items():
+        for derivative_name, no_derivatives in derivatives.items():
+            jobs.append((f"predictability-lag-{lag}-derivatives-{no_derivatives}.html", 'predictability',
+                         (lag_name, lag, derivative_name, no_derivatives)))
+    return jobs
+
+
+def figure_html(fig):
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def pattern_page(name, dataset, fix_y, plot_type):
+    fig = plot_cluster_confidence_intervals_for_df(store.get(dataset), fix_y=fix_y, plot_type=plot_type)
+    return f"{name} ({plot_type})", figure_html(fig) + f"<p>{daily_ts_graph_description_text}</p>"
+
+
+def individual_page(title, dataset, plot_type):
+    fig = plot_cluster_confidence_intervals_for_df(store.get(dataset), fix_y=6, plot_type=plot_type)
+    return f"{title} ({plot_type})", figure_html(fig) + f"<p>{daily_ts_graph_description_text}</p>"
+
+
+def frequency_page(pattern_number):
+    fig = create_pattern_plot(store.get('pattern_frequency'), [pattern_number])
+    return f"Pattern {pattern_number} frequency", figure_html(fig)
+
+
+def associations_page(pattern_number, temporal_unit, timeframe):
+    demographics = list(demographic_factors.values())
+    rows = ""
+    taus_by_type = {pattern_type: associations_in_tau_range(pattern_number, timeframe, pattern_type, demographics,
+                                                            0.0, 1.0)
+                    for pattern_type in ['Expected', 'Unexpected']}
+    for name, dem in demographic_factors.items():
+        cells = ""
+        for taus in taus_by_type.values():
+            tau = taus[dem]
+            css_class = ' class="powered"' if abs(tau) >= powered_tau else ''
+            cells += f"<td{css_class}>{html.escape(format_with_arrow(tau))}</td>"
+        rows += f"<tr><th>{html.escape(name)}</th>{cells}</tr>"
+    body = (f"<table><tr><th>Demographic</th><th>Expected</th><th>Unexpected</th></tr>{rows}</table>"
+            f"<p>Note: Only associations where τ ≥ {powered_tau} (bold) achieved statistical power ≥80%</p>")
+    return f"Pattern {pattern_number} associations with demographics: {temporal_unit}", body
+
+
+def predictability_page(lag_name, lag, derivative_name, no_derivatives):
+    all_predictable_ids, one_cluster_only_ids, both_clusters_ids = predictable_ids(lag, no_derivatives)
+    body = (f"<h2>Unique people who show predictability from Insulin or Carbs: "
+            f"{people_string(len(all_predictable_ids))} of {len(tested_people())}</h2>"
+            + icon_array_html(indices_group1=all_predictable_ids, indices_group2=[], color_group1="#212121"))
+    for col_name in predict_glucose_columns.keys():
+        body += (f"<h3>People for which we can predict glucose from {col_name}</h3>"
+                 f"<p>Some days: {len(one_cluster_only_ids[col_name])}, "
+                 f"Most days: {len(both_clusters_ids[col_name])}</p>"
+                 + icon_array_html(indices_group1=one_cluster_only_ids[col_name],
+                                   indices_group2=both_clusters_ids[col_name]))
+    body += "<p>Note: Granger causality was used to determine forecastability</p>"
+    return f"Predictability, {lag_name} back, {derivative_name}", body
+
+
+page_renderers = {
+    'pattern': pattern_page,
+    'individual': individual_page,
+    'frequency': frequency_page,
+    'associations': associations_page,
+    'predictability': predictability_page,
+}
+
+
+def render_page(out_dir, job):
+    """Renders and writes one page, runs in a worker process. Returns (file name, title, seconds)"""
+    start = time.perf_counter()
+    file_name, kind, params = job
+    title, body = page_renderers[kind](*params)
+    page = page_template.format(title=html.escape(title), plotly_bundle=plotly_bundle, content_title=content_title,
+                                body=body)
+    with open(os.path.join(out_dir, file_name), 'w', encoding='utf-8') as f:
+        f.write(page)
+    return file_name, title, time.perf_counter() - start
+
+
+def write_index(out_dir, pages):
+    items = "".join(f'<li><a href="{file_name}">{html.escape(title)}</a></li>' for file_name, title, _ in pages)
+    page = page_template.format(title=content_title, plotly_bundle=plotly_bundle, content_title=content_title,
+                                body=f"<ul>{items}</ul>")
+    with open(os.path.join(out_dir, "index.html"), 'w', encoding='utf-8') as f:
+        f.write(page)
+
+
+def generate_reports(out_dir, workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, plotly_bundle), 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+
+    jobs = report_jobs()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        pages = [render_page(out_dir, job) for job in jobs]
+    else:
+        # a few chunks per worker balances load without paying process round trips per page
+        chunk_size = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pages = list(executor.map(render_page, [out_dir] * len(jobs), jobs, chunksize=chunk_size))
+    write_index(out_dir, pages)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render static HTML reports of all patterns, individuals, "
+                                                 "demographic associations and predictability results.")
+    parser.add_argument("--out-dir", default="reports", help="directory to write the html files to")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, default all cores")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pages = generate_reports(args.out_dir, args.workers)
+    print(f"Rendered {len(pages)} pages to {args.out_dir} in {time.perf_counter() - start:.1f}s "
+          f"({sum(seconds for _, _, seconds in pages):.1f}s of rendering)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from cluster_stats import confidence, normal_interval_from_sufficient_stats, stats_frame_from_intervals
+from data_store import clusters, variates, hours
+
+# key = ci method, value = description
+ci_methods = {
+    'normal': 'normal approximation, mean +- 1.96 standard errors',
+    'percentile': 'bootstrap percentile interval',
+    'bca': 'bias corrected and accelerated bootstrap interval',
+}
+default_resamples = 2000
+# resamples per task of the process pool, every chunk has its own seed so results do not depend on the worker count
+chunk_resamples = 250
+cache_dir = os.path.join('.cache', 'bootstrap')
+# part of the cache key, bumped when the cached frames change
+cache_version = 2
+
+_normal = NormalDist()
+_ppf = np.frompyfunc(_normal.inv_cdf, 1, 1)
+_cdf = np.frompyfunc(_normal.cdf, 1, 1)
+
+
+def bootstrap_means(member_days, seed_sequence, n_resamples):
+    """
+    Means of n_resamples bootstrap resamples of member_days [day, cell]. Each resample is drawn as a row of an index
+    matrix and turned into day counts, so all resample means are one matrix product [resample, day] @ [day, cell].
+    """
+    n_days = len(member_days)
+    rng = np.random.default_rng(seed_sequence)
+    index_matrix = rng.integers(0, n_days, size=(n_resamples, n_days))
+    offsets = np.arange(n_resamples)[:, None] * n_days
+    counts = np.bincount((index_matrix + offsets).ravel(), minlength=n_resamples * n_days)
+    counts = counts.reshape(n_resamples, n_days)
+    present = ~np.isnan(member_days)
+    sums = counts @ np.where(present, member_days, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / (counts @ present)
+
+
+def _chunk_means(args):
+    return bootstrap_means(*args)
+
+
+def bootstrap_distribution(member_days, n_resamples=default_resamples, seed=0, executor=None):
+    """Bootstrap means [resample, cell], chunks are computed in the executor's worker processes when given"""
+    n_chunks = max(1, int(np.ceil(n_resamples / chunk_resamples)))
+    sizes = [chunk_resamples] * (n_chunks - 1) + [n_resamples - chunk_resamples * (n_chunks - 1)]
+    tasks = [(member_days, seed_sequence, size)
+             for seed_sequence, size in zip(np.random.SeedSequence(seed).spawn(n_chunks), sizes)]
+    results = executor.map(_chunk_means, tasks) if executor is not None else map(_chunk_means, tasks)
+    return np.vstack(list(results))
+
+
+def normal_interval(member_days):
+    present = ~np.isnan(member_days)
+    filled = np.where(present, member_days, 0)
+    _, lo, hi = normal_interval_from_sufficient_stats(present.sum(axis=0), filled.sum(axis=0),
+                                                      (filled ** 2).sum(axis=0))
+    return lo, hi
+
+
+def percentile_interval(boot):
+    alpha = (1 - confidence) / 2
+    return np.nanquantile(boot, alpha, axis=0), np.nanquantile(boot, 1 - alpha, axis=0)
+
+
+def bca_interval(member_days, boot):
+    """BCa interval per cell: bias correction from the bootstrap distribution, acceleration from the jackknife"""
+    n_resamples = len(boot)
+    theta = np.nanmean(member_days, axis=0)
+    proportion = ((boot < theta).sum(axis=0) + 0.5 * (boot == theta).sum(axis=0)) / n_resamples
+    proportion = np.clip(proportion, 1 / (n_resamples + 1), n_resamples / (n_resamples + 1))
+    z0 = _ppf(proportion).astype(float)
+
+    # leave one day out means, vectorised over all days and cells
+    present = ~np.isnan(member_days)
+    totals = np.nansum(member_days, axis=0)
+    counts = present.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jackknife = (totals - np.where(present, member_days, 0)) / (counts - present)
+    deviation = np.nanmean(jackknife, axis=0) - jackknife
+    numerator = np.nansum(deviation ** 3, axis=0)
+    denominator = 6 * np.nansum(deviation ** 2, axis=0) ** 1.5
+    acceleration = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+    bounds = []
+    sorted_boot = np.sort(boot, axis=0)
+    for alpha in [(1 - confidence) / 2, (1 + confidence) / 2]:
+        z_alpha = _normal.inv_cdf(alpha)
+        adjusted = _cdf(z0 + (z0 + z_alpha) / (1 - acceleration * (z0 + z_alpha))).astype(float)
+        positions = np.clip(np.round(adjusted * (n_resamples - 1)).astype(int), 0, n_resamples - 1)
+        bounds.append(np.take_along_axis(sorted_boot, positions[None, :], axis=0)[0])
+    # constant cells have no spread, the interval is the value itself
+    constant = np.nanmax(boot, axis=0) == np.nanmin(boot, axis=0)
+    return np.where(constant, theta, bounds[0]), np.where(constant, theta, bounds[1])
+
+
+def data_hash(days, labels, ci_method, n_resamples, seed):
+    digest = hashlib.sha256()
+    for array in [np.ascontiguousarray(days, dtype=np.float64), np.ascontiguousarray(labels, dtype=np.int64)]:
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(f"{ci_method}-{n_resamples}-{seed}-{confidence}-{cache_version}".encode())
+    return digest.hexdigest()
+
+
+def stats_frame(days, labels, ci_method='normal', n_resamples=default_resamples, seed=0, workers=None,
+                use_cache=True):
+    """
+    Cluster stats in the format of the data/*-stats-results.csv files from member days [day, hour, variate] and
+    their cluster labels, with 95% intervals computed by ci_method. Bootstrap results are cached by a hash of the
+    input data and parameters.
+    """
+    if ci_method not in ci_methods:
+        raise ValueError(f"Unknown ci method '{ci_method}', choose from {list(ci_methods.keys())}")
+    days = np.asarray(days, dtype=np.float64)
+    labels = np.asarray(labels)
+    cache_path = os.path.join(cache_dir, data_hash(days, labels, ci_method, n_resamples, seed) + '.pkl')
+    if use_cache and ci_method != 'normal' and os.path.exists(cache_path):
+        return pd.read_pickle(cache_path)
+
+    intervals = {stat: np.empty((len(clusters), len(hours), len(variates))) for stat in ['mean', 'lo', 'hi', 'count']}
+    executor = ProcessPoolExecutor(max_workers=workers) if ci_method != 'normal' and workers != 1 else None
+    try:
+        for c in range(len(clusters)):
+            member_days = days[labels == c].reshape(-1, len(hours) * len(variates))
+            mean = np.nanmean(member_days, axis=0)
+            if ci_method == 'normal':
+                lo, hi = normal_interval(member_days)
+            else:
+                boot = bootstrap_distribution(member_days, n_resamples, seed + c, executor)
+                lo, hi = percentile_interval(boot) if ci_method == 'percentile' else bca_interval(member_days, boot)
+            count = (~np.isnan(member_days)).sum(axis=0)
+            for stat, values in [('mean', mean), ('lo', lo), ('hi', hi), ('count', count)]:
+                intervals[stat][c] = values.reshape(len(hours), len(variates))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    df = stats_frame_from_intervals(intervals['mean'], intervals['lo'], intervals['hi'], intervals['count'])
+    if use_cache and ci_method != 'normal':
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_pickle(cache_path)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate a cluster stats file with the chosen ci method.")
+    parser.add_argument("days", help="npz file with 'days' [day, hour, variate] and cluster 'labels' [day]")
+    parser.add_argument("out", help="stats csv file to write, e.g. data/figure-2a-stats-results.csv")
+    parser.add_argument("--ci-method", choices=list(ci_methods.keys()), default='normal')
+    parser.add_argument("--resamples", type=int, default=default_resamples)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with np.load(args.days) as data:
+        df = stats_frame(data['days'], data['labels'], args.ci_method, args.resamples, args.seed, args.workers,
+                         use_cache=not args.no_cache)
+    df.to_csv(args.out)
+    print(f"Wrote {args.out} with {ci_methods[args.ci_method]} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from data_store import clusters, variates, hours, sufficient_stats
+
+confidence = 0.95
+# two sided normal quantile of the confidence level, 1.96
+z_95 = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def person_sufficient_stats(days, labels):
+    """
+    Count, sum and sum of squares [cluster, hour, variate] of one person's member days [day, hour, variate] with
+    cluster labels [day]. Summing them over people gives the cluster stats of any group of people.
+    """
+    result = {stat: np.zeros((len(clusters), len(hours), len(variates))) for stat in sufficient_stats}
+    days = np.asarray(days, dtype=np.float64)
+    present = ~np.isnan(days)
+    filled = np.where(present, days, 0)
+    for c in range(len(clusters)):
+        member = np.asarray(labels) == c
+        result['count'][c] = present[member].sum(axis=0)
+        result['sum'][c] = filled[member].sum(axis=0)
+        result['sumsq'][c] = (filled[member] ** 2).sum(axis=0)
+    return result
+
+
+def normal_interval_from_sufficient_stats(count, total, total_sq):
+    """Mean, lower and upper bound of the normal approximation interval per cell from counts of non-missing values"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        variance = (total_sq - count * mean ** 2) / (count - 1)
+        half_width = z_95 * np.sqrt(np.clip(variance, 0, None) / count)
+    return mean, mean - half_width, mean + half_width
+
+
+def stats_frame_from_intervals(mean, lo, hi, count):
+    """Cluster stats in the format of the data/*-stats-results.csv files from arrays [cluster, hour, variate]"""
+    columns = {}
+    for c, cluster in enumerate(clusters):
+        for stat, values in [('ci96_lo', lo), ('ci96_hi', hi), ('mean', mean), ('count', count)]:
+            for v, variate in enumerate(variates):
+                columns[(cluster, stat, f'xtrain {variate} mean')] = values[c, :, v]
+    df = pd.DataFrame(columns, index=pd.Index(hours, name='hours'))
+    df.columns = pd.MultiIndex.from_tuples(df.columns)
+    return df
+
+
+def stats_frame_from_sufficient_stats(count, total, total_sq):
+    """Cluster stats with normal approximation intervals from summed sufficient statistics"""
+    mean, lo, hi = normal_interval_from_sufficient_stats(count, total, total_sq)
+    return stats_frame_from_intervals(mean, lo, hi, count)
@@ -0,0 +1,542 @@
+import os
+import threading
+import time
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+data_dir = 'data'
+# string columns that only take a handful of values and are stored as categoricals
+categorical_columns = ['timeframe', 'pattern_type']
+stats_read_args = dict(header=[0, 1, 2], index_col=0)
+
+# key = dataset name, value = (file name in data_dir, pd.read_csv keyword arguments)
+dataset_files = {
+    'meal_rise_stats': ('figure-2a-stats-results.csv', stats_read_args),
+    'night_high_1_stats': ('figure-3a-stats-results.csv', stats_read_args),
+    'night_high_2_stats': ('figure-3b-stats-results.csv', stats_read_args),
+    'iob_higher_cob_not_stats': ('iob_higher_cob_is_not.csv', stats_read_args),
+    'flatline_stats': ('flatline-stats-results.csv', stats_read_args),
+    'different_days_stats': ('different_days-stats-results.csv', stats_read_args),
+    'granger_causality': ('granger_causality.csv', dict(index_col=0)),
+    'pattern_associations': ('demographic_associations.csv', dict()),
+    'pattern_frequency': ('pattern_frequency.csv', dict(index_col=0)),
+}
+# outputs of offline steps that may not have been run yet, the store returns None while their file is missing
+optional_dataset_files = {
+    'pattern_candidates': ('pattern_candidates.csv', dict(index_col=0)),
+    'person_demographics': ('person_demographics.csv', dict()),
+    'person_pattern_frequency': ('person_pattern_frequency.csv', dict()),
+}
+# key = dataset name, value = npz file in data_dir, loaded as a dict of arrays; all are optional
+optional_array_files = {
+    'person_sufficient_stats': 'person_sufficient_stats.npz',
+}
+# key = dataset name, value = file written by an offline update step, read instead of the file in data_dir when it
+# exists so that the shipped file stays unchanged
+updated_dataset_files = {
+    'granger_causality': os.path.join('.cache', 'granger', 'granger_causality.csv'),
+}
+stats_datasets = [name for name, (_, read_args) in dataset_files.items() if read_args is stats_read_args]
+
+clusters = ['0', '1']
+stats = ['ci96_lo', 'ci96_hi', 'mean', 'count']
+variates = ['iob', 'cob', 'bg']
+granger_relations = ['COB->IOB', 'IG->IOB', 'IOB->COB', 'IG->COB', 'IOB->IG', 'COB->IG']
+hours = list(range(24))
+# days with fewer observed hours are not assigned to a cluster
+min_hours_per_day = 20
+timeframes = ['Hours of the day', 'Clusters', 'Days of the week', 'Months of the year']
+pattern_types = ['Expected', 'Unexpected']
+pattern_numbers = [1, 2, 3]
+derivative_orders = [0, 1, 2, 3]
+# absolute tolerance for ci96_lo <= mean <= ci96_hi to allow for rounding in the stats files
+ci_tolerance = 1e-9
+# per person sufficient statistics of the cluster stats, see cluster_stats.person_sufficient_stats
+sufficient_stats = ['count', 'sum', 'sumsq']
+# key = display name, value = dataframe column names
+demographic_factors = {
+    "Age": "Age",
+    "Duration of T1D": "Duration of T1D",
+    "A1C": "A1C",
+    "Avg. Carbs": "Avg. Carbs",
+    "Avg. Insulin": "Avg. Insulin",
+    "Avg. Basal Insulin": "Avg. Basal Insulin",
+    "Pumping since": "Pumping since",
+    "CGM since": "CGM since",
+    "AID since": "AID since"
+}
+
+
+class DataValidationError(ValueError):
+    pass
+
+
+def nbytes(value):
+    """Approximate memory footprint in bytes of a stored value (frames, arrays and containers of them)."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(nbytes(k) + nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+def freeze(value):
+    """Marks numpy arrays (also nested in containers) as read-only so sessions cannot mutate shared state."""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for v in value.values():
+            freeze(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            freeze(v)
+    return value
+
+
+class _Entry:
+    def __init__(self, loader, pinned, depends):
+        self.loader = loader
+        self.pinned = pinned
+        self.depends = depends
+        self.value = None
+        self.nbytes = 0
+        self.loaded = False
+        self.loads = 0
+        self.hits = 0
+        self.last_access = 0.0
+
+
+def _file_signature(path):
+    file_stat = os.stat(path)
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+class DataStore:
+    """
+    Process wide, read-only store for the datasets in data/ and indexes derived from them.
+
+    Values are loaded lazily on first access and shared by all sessions. Every value is accounted for in bytes and
+    when the total exceeds memory_budget_bytes the least recently used, unpinned values are evicted; they are
+    transparently reloaded on the next access. Callers must treat returned frames as read-only, derived numpy arrays
+    are flagged non-writeable.
+    """
+
+    def __init__(self, memory_budget_bytes=None, downcast_floats=False, encode_categoricals=True):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.downcast_floats = downcast_floats
+        self.encode_categoricals = encode_categoricals
+        self.evictions = 0
+        # key = file path, value = (mtime, size) of the file when it last passed validation
+        self.validated_files = {}
+        # key = dataset name, value = (file name in data_dir, whether the file may be missing, updated file or None)
+        self.files = {}
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, loader, pinned=False, depends=()):
+        """Registers a lazily loaded value, depends names the values it is derived from"""
+        with self._lock:
+            self._entries[name] = _Entry(loader, pinned, tuple(depends))
+
+    def register_csv(self, name, file_name, pinned=False, validator=None, optional=False, updated_file=None,
+                     **read_args):
+        self.files[name] = (file_name, optional, updated_file)
+        self.register(name, lambda: self._read_csv(name, read_args, validator), pinned=pinned)
+
+    def register_npz(self, name, file_name, pinned=False, validator=None, optional=False):
+        self.files[name] = (file_name, optional, None)
+        self.register(name, lambda: self._read_npz(name, validator), pinned=pinned)
+
+    def file_path(self, name):
+        """Path of a dataset's file and its name in messages, an existing updated file replaces the one in data_dir"""
+        file_name, _, updated_file = self.files[name]
+        if updated_file is not None and os.path.exists(updated_file):
+            return updated_file, updated_file
+        return os.path.join(data_dir, file_name), file_name
+
+    def names(self):
+        return list(self._entries.keys())
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries[name]
+            if not entry.loaded:
+                entry.value = freeze(entry.loader())
+                entry.nbytes = nbytes(entry.value)
+                entry.loaded = True
+                entry.loads += 1
+                self._enforce_budget(keep=name)
+            entry.hits += 1
+            entry.last_access = time.monotonic()
+            return entry.value
+
+    def evict(self, name):
+        with self._lock:
+            entry = self._entries[name]
+            if entry.loaded:
+                entry.value = None
+                entry.nbytes = 0
+                entry.loaded = False
+                self.evictions += 1
+
+    def invalidate(self, name):
+        """Evicts name and every value derived from it, e.g. when its file changed"""
+        with self._lock:
+            self.evict(name)
+            for other, entry in self._entries.items():
+                if name in entry.depends:
+                    self.invalidate(other)
+
+    def clear(self):
+        for name in self.names():
+            self.evict(name)
+
+    def generation(self, *names):
+        """
+        Load counts of names, loading them first. Values derived from them are stale once the generation changes,
+        i.e. when one of them was evicted and reloaded.
+        """
+        with self._lock:
+            for name in names:
+                self.get(name)
+            return tuple(self._entries[name].loads for name in names)
+
+    def total_bytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def memory_report(self):
+        """One row per registered value with its size, access count, load count and whether it is resident."""
+        with self._lock:
+            rows = [{'name': name,
+                     'loaded': entry.loaded,
+                     'pinned': entry.pinned,
+                     'bytes': entry.nbytes,
+                     'hits': entry.hits,
+                     'loads': entry.loads}
+                    for name, entry in self._entries.items()]
+        return pd.DataFrame(rows, columns=['name', 'loaded', 'pinned', 'bytes', 'hits', 'loads']).set_index('name')
+
+    def _enforce_budget(self, keep):
+        if self.memory_budget_bytes is None:
+            return
+        candidates = sorted(
+            (entry.last_access, name) for name, entry in self._entries.items()
+            if entry.loaded and not entry.pinned and name != keep)
+        for _, name in candidates:
+            if self.total_bytes() <= self.memory_budget_bytes:
+                break
+            self.evict(name)
+
+    def _read_csv(self, name, read_args, validator):
+        path, file_name = self.file_path(name)
+        if self.files[name][1] and not os.path.exists(path):
+            return None
+        try:
+            df = pd.read_csv(path, **read_args)
+        except (pd.errors.ParserError, ValueError, UnicodeDecodeError) as e:
+            raise DataValidationError(f"{file_name}: cannot be read ({e})") from e
+        self._validate(path, df, validator, file_name)
+        return self._compact(df)
+
+    def _read_npz(self, name, validator):
+        path, file_name = self.file_path(name)
+        if self.files[name][1] and not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as npz:
+                arrays = {key: npz[key] for key in npz.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            raise DataValidationError(f"{file_name}: cannot be read ({e})") from e
+        self._validate(path, arrays, validator, file_name)
+        return arrays
+
+    def needs_validation(self, name):
+        """
+        Whether the file of a dataset changed since it last passed validation, from its mtime and size without loading
+        it. Missing optional files have nothing to validate.
+        """
+        path, _ = self.file_path(name)
+        if not os.path.exists(path):
+            return not self.files[name][1]
+        return self.validated_files.get(path) != _file_signature(path)
+
+    def _validate(self, path, value, validator, file_name):
+        if validator is None:
+            return
+        signature = _file_signature(path)
+        # evicted datasets that are reloaded from an unchanged file are not validated again
+        if self.validated_files.get(path) != signature:
+            validator(value, file_name)
+            self.validated_files[path] = signature
+
+    def _compact(self, df):
+        if self.downcast_floats:
+            float_cols = df.select_dtypes(include='float64').columns
+            if len(float_cols) > 0:
+                df[float_cols] = df[float_cols].astype(np.float32)
+        if self.encode_categoricals:
+            for col in categorical_columns:
+                if col in df.columns:
+                    df[col] = df[col].astype('category')
+        return df
+
+
+def _fail(file_name, message, labels=None):
+    if labels is not None and len(labels) > 0:
+        shown = ', '.join(str(label) for label in list(labels)[:5])
+        message += f" (first: {shown}{', ...' if len(labels) > 5 else ''})"
+    raise DataValidationError(f"{file_name}: {message}")
+
+
+def _require_columns(df, required, file_name):
+    missing = [col for col in required if col not in df.columns]
+    if missing:
+        _fail(file_name, f"{len(missing)} missing column(s)", missing)
+
+
+def _require_values(df, column, allowed, file_name):
+    invalid = ~df[column].isin(allowed).to_numpy()
+    if invalid.any():
+        _fail(file_name, f"{invalid.sum()} row(s) with {column} not in {allowed}",
+              df[column].to_numpy()[invalid])
+
+
+def validate_stats(df, file_name):
+    """Cluster stats: every cluster/stat/variate column, 24 hourly rows, ci96_lo <= mean <= ci96_hi, counts >= 0"""
+    _require_columns(df, [(c, s, f'xtrain {v} mean') for c in clusters for s in stats for v in variates], file_name)
+    if df.index.tolist() != hours:
+        _fail(file_name, f"expected hourly rows 0-23 but found {len(df.index)} row(s)", df.index)
+    values = build_stats_array(df)
+    lo, hi, mean, count = (values[:, stats.index(stat)] for stat in stats)
+    if np.isnan(values).any():
+        _fail(file_name, f"{np.isnan(values).sum()} missing value(s)")
+    for name, bad in [('ci96_lo > mean', lo > mean + ci_tolerance),
+                      ('mean > ci96_hi', mean > hi + ci_tolerance),
+                      ('negative count', count < 0),
+                      ('non integer count', count != np.round(count))]:
+        if bad.any():
+            cluster_idx, variate_idx, hour = np.nonzero(bad)
+            _fail(file_name, f"{bad.sum()} value(s) with {name}",
+                  [f"cluster {clusters[c]} {variates[v]} hour {h}" for c, v, h in zip(cluster_idx, variate_idx, hour)])
+
+
+def validate_pattern_table(df, file_name, value_columns):
+    """Pattern frequency and demographic associations: known timeframes, pattern types and pattern numbers"""
+    _require_columns(df, ['pattern_number', 'pattern_type', 'timeframe'] + value_columns, file_name)
+    _require_values(df, 'timeframe', timeframes, file_name)
+    _require_values(df, 'pattern_type', pattern_types, file_name)
+    _require_values(df, 'pattern_number', pattern_numbers, file_name)
+    duplicated = df.duplicated(['pattern_number', 'pattern_type', 'timeframe']).to_numpy()
+    if duplicated.any():
+        _fail(file_name, f"{duplicated.sum()} duplicated pattern row(s)", df.index[duplicated])
+    values = df[value_columns].to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        _fail(file_name, f"{np.isnan(values).sum()} missing value(s)")
+    return values
+
+
+def validate_pattern_frequency(df, file_name):
+    values = validate_pattern_table(df, file_name, ['mean'])
+    if (values < 0).any():
+        _fail(file_name, f"{(values < 0).sum()} negative frequency value(s)")
+
+
+def validate_associations(df, file_name):
+    demographic_columns = [col for col in df.columns if col not in ['pattern_number', 'pattern_type', 'timeframe']]
+    if not demographic_columns:
+        _fail(file_name, "no demographic columns")
+    values = validate_pattern_table(df, file_name, demographic_columns)
+    if (np.abs(values) > 1).any():
+        _fail(file_name, f"{(np.abs(values) > 1).sum()} tau value(s) outside [-1, 1]")
+
+
+def validate_granger(df, file_name):
+    """Granger results: positive integer lags, known derivative orders and clusters, boolean test results"""
+    _require_columns(df, ['id', 'Cluster', 'lag', 'no_derivatives'] + granger_relations, file_name)
+    for col in ['id', 'Cluster', 'lag', 'no_derivatives']:
+        if not pd.api.types.is_integer_dtype(df[col]):
+            _fail(file_name, f"{col} must be integers but is {df[col].dtype}")
+    if (df['lag'] < 1).any():
+        _fail(file_name, f"{(df['lag'] < 1).sum()} row(s) with lag < 1", df.index[df['lag'] < 1])
+    _require_values(df, 'no_derivatives', derivative_orders, file_name)
+    _require_values(df, 'Cluster', [int(c) for c in clusters], file_name)
+    not_bool = [col for col in granger_relations if not pd.api.types.is_bool_dtype(df[col])]
+    if not_bool:
+        _fail(file_name, "granger results must be TRUE/FALSE", not_bool)
+    duplicated = df.duplicated(['id', 'Cluster', 'lag', 'no_derivatives']).to_numpy()
+    if duplicated.any():
+        _fail(file_name, f"{duplicated.sum()} duplicated test row(s)", df.index[duplicated])
+
+
+def validate_pattern_candidates(df, file_name):
+    _require_columns(df, ['kind', 'time_of_day', 'iob', 'cob', 'bg', 'people', 'occurrences'], file_name)
+    _require_values(df, 'kind', ['motif', 'discord'], file_name)
+    for col in ['iob', 'cob', 'bg']:
+        _require_values(df, col, ['↑', '↓', '→'], file_name)
+
+
+def validate_person_demographics(df, file_name):
+    _require_columns(df, ['id'], file_name)
+    duplicated = df['id'].duplicated().to_numpy()
+    if duplicated.any():
+        _fail(file_name, f"{duplicated.sum()} duplicated id(s)", df['id'].to_numpy()[duplicated])
+
+
+def validate_person_pattern_frequency(df, file_name):
+    validate_pattern_table(df.drop_duplicates(['pattern_number', 'pattern_type', 'timeframe']), file_name,
+                           ['has_pattern'])
+    _require_columns(df, ['id'], file_name)
+    if not df['has_pattern'].isin([0, 1]).all():
+        _fail(file_name, "has_pattern must be 0 or 1")
+
+
+def validate_sufficient_stats(arrays, file_name):
+    """Per person count/sum/sumsq arrays [person, cluster, hour, variate] per stats dataset"""
+    if 'ids' not in arrays:
+        _fail(file_name, "missing array 'ids'")
+    expected_shape = (len(arrays['ids']), len(clusters), len(hours), len(variates))
+    for key, array in arrays.items():
+        if key == 'ids':
+            continue
+        if key.rsplit('/', 1)[-1] not in sufficient_stats:
+            _fail(file_name, f"unknown array '{key}', expected <stats dataset>/{'|'.join(sufficient_stats)}")
+        if array.shape != expected_shape:
+            _fail(file_name, f"array '{key}' has shape {array.shape} but expected {expected_shape}")
+        if key.endswith('/count') and (array < 0).any():
+            _fail(file_name, f"array '{key}' has negative counts")
+
+
+# key = dataset name, value = validation run once when the file is loaded
+dataset_validators = {name: validate_stats for name in stats_datasets}
+dataset_validators.update({
+    'granger_causality': validate_granger,
+    'pattern_associations': validate_associations,
+    'pattern_frequency': validate_pattern_frequency,
+    'pattern_candidates': validate_pattern_candidates,
+    'person_demographics': validate_person_demographics,
+    'person_pattern_frequency': validate_person_pattern_frequency,
+    'person_sufficient_stats': validate_sufficient_stats,
+})
+
+
+def build_stats_array(df):
+    """Stats frame as a float array indexed [cluster, stat, variate, hour], see clusters, stats and variates."""
+    columns = pd.MultiIndex.from_tuples(
+        [(c, s, f'xtrain {v} mean') for c in clusters for s in stats for v in variates])
+    values = df[columns].to_numpy(dtype=np.float64).T
+    return values.reshape(len(clusters), len(stats), len(variates), len(df.index))
+
+
+def build_granger_bitmasks(df):
+    """
+    Granger results as boolean matrices. Key = (lag, no_derivatives), value = dict of relation name to bool array
+    indexed [person, cluster]; person ids are returned under key 'ids'.
+    """
+    ids = np.sort(df['id'].unique())
+    n_clusters = int(df['Cluster'].max()) + 1 if len(df) else len(clusters)
+    id_pos = np.searchsorted(ids, df['id'].to_numpy())
+    cluster_pos = df['Cluster'].to_numpy()
+    result = {'ids': ids}
+    for key, group_idx in df.groupby(['lag', 'no_derivatives']).indices.items():
+        masks = {}
+        for relation in granger_relations:
+            mask = np.zeros((len(ids), n_clusters), dtype=bool)
+            true_rows = group_idx[df[relation].to_numpy(dtype=bool)[group_idx]]
+            mask[id_pos[true_rows], cluster_pos[true_rows]] = True
+            masks[relation] = mask
+        result[(int(key[0]), int(key[1]))] = masks
+    return result
+
+
+# demographics and their absolute taus sorted by absolute tau, and a dict of demographic to signed tau
+TauIndex = namedtuple('TauIndex', ['demographics', 'abs_taus', 'taus'])
+
+
+def build_association_table(df):
+    """
+    Demographic taus indexed for range queries on the association strength. Key = (pattern_number, timeframe,
+    pattern_type), value = TauIndex.
+    """
+    key_columns = ['pattern_number', 'timeframe', 'pattern_type']
+    demographic_columns = np.array([col for col in df.columns if col not in key_columns], dtype=object)
+    keys = df[key_columns].itertuples(index=False, name=None)
+    taus = df[demographic_columns.tolist()].to_numpy(dtype=np.float64)
+    abs_taus = np.abs(taus)
+    order = np.argsort(abs_taus, axis=1, kind='stable')
+    return {(int(key[0]), str(key[1]), str(key[2])): TauIndex(demographic_columns[order[i]], abs_taus[i, order[i]],
+                                                             dict(zip(demographic_columns.tolist(), taus[i].tolist())))
+            for i, key in enumerate(keys)}
+
+
+def query_tau_range(tau_index, lower_tau, upper_tau):
+    """Demographics with lower_tau <= |tau| <= upper_tau by binary search, ordered by |tau|"""
+    start = np.searchsorted(tau_index.abs_taus, lower_tau, side='left')
+    end = np.searchsorted(tau_index.abs_taus, upper_tau, side='right')
+    return tau_index.demographics[start:end]
+
+
+def validate_all(data_store):
+    """
+    Loads and validates every dataset whose file changed since it last passed validation, returns a dict of dataset
+    name to error message for the invalid ones. Unchanged files are only stat'ed, so calling this on every rerun
+    neither reloads datasets nor evicts the ones in use.
+    """
+    errors = {}
+    for name in list(dataset_files.keys()) + list(optional_dataset_files.keys()) + list(optional_array_files.keys()):
+        if not data_store.needs_validation(name):
+            continue
+        # a changed file is read again instead of keeping the loaded value and the values derived from it
+        data_store.invalidate(name)
+        try:
+            data_store.get(name)
+        except DataValidationError as e:
+            errors[name] = str(e)
+    return errors
+
+
+def create_store():
+    budget_mb = os.environ.get('DATA_STORE_BUDGET_MB')
+    new_store = DataStore(
+        memory_budget_bytes=int(float(budget_mb) * 1024 * 1024) if budget_mb else None,
+        downcast_floats=os.environ.get('DATA_STORE_FLOAT32', '0') == '1',
+    )
+    for name, (file_name, read_args) in dataset_files.items():
+        new_store.register_csv(name, file_name, validator=dataset_validators.get(name),
+                               updated_file=updated_dataset_files.get(name), **read_args)
+    for name, (file_name, read_args) in optional_dataset_files.items():
+        new_store.register_csv(name, file_name, validator=dataset_validators.get(name), optional=True, **read_args)
+    for name, file_name in optional_array_files.items():
+        new_store.register_npz(name, file_name, validator=dataset_validators.get(name), optional=True)
+    for name in stats_datasets:
+        new_store.register(name + '_array', lambda n=name: build_stats_array(new_store.get(n)), depends=[name])
+    new_store.register('granger_bitmasks', lambda: build_granger_bitmasks(new_store.get('granger_causality')),
+                       depends=['granger_causality'])
+    new_store.register('association_table', lambda: build_association_table(new_store.get('pattern_associations')),
+                       depends=['pattern_associations'])
+    return new_store
+
+
+# shared by all sessions of a server process
+store = create_store()
+
+
+if __name__ == "__main__":
+    validation_errors = validate_all(store)
+    if validation_errors:
+        for error in validation_errors.values():
+            print(f"Invalid data: {error}")
+        raise SystemExit(1)
+    print(f"All {len(dataset_files)} data files are valid")
+    for dataset in store.names():
+        store.get(dataset)
+    report = store.memory_report()
+    print(report)
+    print(f"Total: {report['bytes'].sum() / 1024:.1f} KiB")
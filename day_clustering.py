@@ -0,0 +1,86 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_store import clusters, min_hours_per_day
+from day_distance import nearest_centroid, distances
+from feature_store import load_features
+from person_series import default_series_dir, person_ids, save_day_clusters
+
+max_iterations = 100
+
+
+def kmeans_days(days, n_clusters=len(clusters), distance='euclidean', seed=0):
+    """
+    K-means of day profiles [day, hour, variate] with NaN hours skipped, assignment with the chosen day distance and
+    k-means++ initialisation. Returns labels [day], cluster 0 being the larger one.
+    """
+    rng = np.random.default_rng(seed)
+    filled = np.nan_to_num(days)
+    centroids = [filled[rng.integers(len(days))]]
+    for _ in range(1, n_clusters):
+        _, nearest_distances = nearest_centroid(days, np.stack(centroids), 'euclidean')
+        weights = nearest_distances ** 2
+        probabilities = weights / weights.sum() if weights.sum() > 0 else None
+        centroids.append(filled[rng.choice(len(days), p=probabilities)])
+    centroids = np.stack(centroids)
+
+    labels = None
+    for _ in range(max_iterations):
+        new_labels, nearest_distances = nearest_centroid(days, centroids, distance)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for c in range(n_clusters):
+            members = days[labels == c]
+            # an empty cluster restarts at the day furthest from its centroid
+            centroids[c] = np.nanmean(members, axis=0) if len(members) else filled[nearest_distances.argmax()]
+        centroids = np.nan_to_num(centroids)
+    order = np.argsort(-np.bincount(labels, minlength=n_clusters), kind='stable')
+    return np.argsort(order)[labels]
+
+
+def cluster_person(series_dir, person_id, distance='euclidean', seed=0):
+    """
+    Clusters one person's days from the hourly profiles of the feature store and saves the labels, days with fewer
+    than min_hours_per_day observed hours get label -1. Each variate is scaled by its standard deviation so all three
+    weigh the same. Returns the number of clustered days.
+    """
+    day_numbers, profiles = load_features(series_dir, person_id, 0)
+    profiles = np.asarray(profiles)
+    observed = (~np.isnan(profiles).any(axis=2)).sum(axis=1) >= min_hours_per_day
+    labels = np.full(len(day_numbers), -1)
+    if observed.sum() >= len(clusters):
+        scale = np.nanstd(profiles[observed], axis=(0, 1))
+        scaled = profiles[observed] / np.where(scale > 0, scale, 1)
+        labels[observed] = kmeans_days(scaled, distance=distance, seed=seed)
+    save_day_clusters(series_dir, person_id, day_numbers, labels)
+    return int(observed.sum())
+
+
+def cluster_all(series_dir=default_series_dir, distance='euclidean', workers=None):
+    ids = person_ids(series_dir)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(ids, executor.map(cluster_person, [series_dir] * len(ids), ids, [distance] * len(ids))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster every person's days into two clusters from the hourly "
+                                                 "profiles of the feature store.")
+    parser.add_argument("--series-dir", default=default_series_dir)
+    parser.add_argument("--distance", choices=list(distances.keys()), default='euclidean')
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    clustered = cluster_all(args.series_dir, args.distance, args.workers)
+    print(f"Clustered {sum(clustered.values())} days of {len(clustered)} people in "
+          f"{time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import time
+
+import numpy as np
+
+# key = distance option, value = description
+distances = {
+    'euclidean': 'euclidean distance between the hourly means',
+    'dtw': 'dynamic time warping constrained to a window of hours, tolerates shifted meals',
+}
+# Sakoe-Chiba window in hours, a day may be warped by at most this many hours
+default_window = 2
+
+
+def euclidean_nearest(days, centroids):
+    """Nearest centroid per day. days [day, hour, variate], centroids [centroid, hour, variate], NaN hours skipped"""
+    diff = np.nan_to_num(days[:, None, :, :] - centroids[None, :, :, :])
+    distances = np.sqrt((diff ** 2).sum(axis=(2, 3)))
+    return distances.argmin(axis=1), distances.min(axis=1)
+
+
+def envelopes(centroids, window=default_window):
+    """Upper and lower LB_Keogh envelopes [centroid, hour, variate]: running max/min within +-window hours"""
+    n_hours = centroids.shape[1]
+    upper = np.full_like(centroids, -np.inf)
+    lower = np.full_like(centroids, np.inf)
+    for shift in range(-window, window + 1):
+        src = slice(max(0, shift), n_hours + min(0, shift))
+        dst = slice(max(0, -shift), n_hours + min(0, -shift))
+        upper[:, dst] = np.maximum(upper[:, dst], centroids[:, src])
+        lower[:, dst] = np.minimum(lower[:, dst], centroids[:, src])
+    return upper, lower
+
+
+def lb_keogh(days, upper, lower):
+    """Lower bounds of the dtw distance of every day to every centroid [day, centroid], computed in one pass"""
+    above = np.nan_to_num(days[:, None] - upper[None]).clip(min=0)
+    below = np.nan_to_num(lower[None] - days[:, None]).clip(min=0)
+    return np.sqrt((above ** 2 + below ** 2).sum(axis=(2, 3)))
+
+
+def dtw_distance(a, b, window=default_window, abandon_above=np.inf):
+    """
+    Multivariate dtw distance between two days [hour, variate] constrained to +-window hours. Returns inf as soon as
+    every path of a row exceeds abandon_above (early abandoning).
+    """
+    n_hours = len(a)
+    cost = np.nansum((a[:, None, :] - b[None, :, :]) ** 2, axis=2).tolist()
+    limit = abandon_above ** 2
+    inf = float('inf')
+    previous = [inf] * n_hours
+    for i in range(n_hours):
+        current = [inf] * n_hours
+        row = cost[i]
+        row_min = inf
+        for j in range(max(0, i - window), min(n_hours, i + window + 1)):
+            if i == 0 and j == 0:
+                best = 0.0
+            else:
+                best = previous[j]
+                if j > 0:
+                    best = min(best, previous[j - 1], current[j - 1])
+            value = row[j] + best
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return inf
+        previous = current
+    return previous[-1] ** 0.5
+
+
+def dtw_nearest(days, centroids, window=default_window, prune=True):
+    """
+    Nearest centroid per day by dtw distance. With prune the centroids of a day are visited in order of their
+    LB_Keogh bound and the search stops once the bound exceeds the best distance found; full dtw computations are
+    early abandoned at the best distance so far. Returns (nearest, distances, number of full dtw computations).
+    """
+    nearest = np.zeros(len(days), dtype=int)
+    best_distances = np.full(len(days), np.inf)
+    n_computed = 0
+    if prune:
+        upper, lower = envelopes(centroids, window)
+        bounds = lb_keogh(days, upper, lower)
+        orders = bounds.argsort(axis=1)
+    for d, day in enumerate(days):
+        best = np.inf
+        for c in (orders[d] if prune else range(len(centroids))):
+            if prune and bounds[d, c] >= best:
+                break
+            distance = dtw_distance(day, centroids[c], window, abandon_above=best if prune else np.inf)
+            n_computed += 1
+            if distance < best:
+                best = distance
+                nearest[d] = c
+        best_distances[d] = best
+    return nearest, best_distances, n_computed
+
+
+def nearest_centroid(days, centroids, distance='euclidean', window=default_window):
+    """Index of and distance to the nearest centroid for every day with the chosen distance option"""
+    if distance == 'euclidean':
+        return euclidean_nearest(days, centroids)
+    if distance == 'dtw':
+        nearest, best_distances, _ = dtw_nearest(days, centroids, window)
+        return nearest, best_distances
+    raise ValueError(f"Unknown distance '{distance}', choose from {list(distances.keys())}")
+
+
+def shifted_days(centroids, n_days, max_shift=2, noise=0.3, seed=0):
+    """Days drawn from random centroids, shifted by up to max_shift hours and with gaussian noise"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(len(centroids), size=n_days)
+    shifts = rng.integers(-max_shift, max_shift + 1, size=n_days)
+    hour_idx = np.clip(np.arange(centroids.shape[1])[None, :] - shifts[:, None], 0, centroids.shape[1] - 1)
+    days = centroids[picks[:, None], hour_idx]
+    return days + rng.normal(0, noise, days.shape), picks
+
+
+def benchmark(n_days=2000, n_centroids=16, window=default_window, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = np.abs(rng.normal(2, 1, (n_centroids, 24, 3)).cumsum(axis=1) / np.arange(1, 25)[None, :, None])
+    days, _ = shifted_days(centroids, n_days, max_shift=window, seed=seed)
+    results = {}
+    start = time.perf_counter()
+    euclidean_nearest(days, centroids)
+    results['euclidean'] = (time.perf_counter() - start, 0)
+    for name, prune in [('dtw naive', False), ('dtw pruned', True)]:
+        start = time.perf_counter()
+        nearest, _, n_computed = dtw_nearest(days, centroids, window, prune=prune)
+        results[name] = (time.perf_counter() - start, n_computed)
+        results[name + ' nearest'] = nearest
+    assert (results['dtw naive nearest'] == results['dtw pruned nearest']).all()
+    return {name: value for name, value in results.items() if not name.endswith('nearest')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare euclidean and pruned dtw nearest centroid assignment.")
+    parser.add_argument("--days", type=int, default=2000)
+    parser.add_argument("--centroids", type=int, default=16)
+    parser.add_argument("--window", type=int, default=default_window)
+    args = parser.parse_args()
+
+    n_pairs = args.days * args.centroids
+    for name, (seconds, n_computed) in benchmark(args.days, args.centroids, args.window).items():
+        computed = f", {n_computed} of {n_pairs} full dtw computations" if n_computed else ""
+        print(f"{name}: {seconds:.3f}s{computed}")
+
+
+if __name__ == "__main__":
+    main()
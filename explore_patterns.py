@@ -1,23 +1,26 @@
-import pandas as pd
 import streamlit as st
 
-from inividual_variations import different_days_stats_df
+from data_store import store
 from key_findings import display_unexpected_reason, patterns_by_number
 from plot_cluster_interval import plot_cluster_confidence_intervals_for_df, daily_ts_graph_description_text, \
     select_chart_type, colored_text
 
-meal_rise_stats_df = pd.read_csv('data/figure-2a-stats-results.csv', header=[0, 1, 2], index_col=0)
-# night_high_1_stats_df = pd.read_csv('data/figure-3a-stats-results.csv', header=[0, 1, 2], index_col=0)
-night_high_2_stats_df = pd.read_csv('data/figure-3b-stats-results.csv', header=[0, 1, 2], index_col=0)
-iob_higher_cob_not_df = pd.read_csv('data/iob_higher_cob_is_not.csv', header=[0, 1, 2], index_col=0)
+patterns = {'iob_higher_cob_not': "Unexpected Pattern 1: Insulin significantly higher while carbs are similar",
+    'night_high_2': "Unexpected Pattern 2: Significantly higher glucose during night",
+    'post_meal_rise': "Unexpected Pattern 2: Post meal rise",
+    'more_carbs': "Unexpected Pattern 3: Eating more carbs without needing more insulin",
+}
+# key = pattern, value = (data store stats dataset, fix_y)
+pattern_charts = {
+    'iob_higher_cob_not': ('iob_higher_cob_not_stats', 7),
+    # 'night_high_1': ('night_high_1_stats', 7),
+    'night_high_2': ('night_high_2_stats', 7),
+    'more_carbs': ('different_days_stats', 7),
+    'post_meal_rise': ('meal_rise_stats', 6),
+}
 
 
 def display_explore_patterns():
-    patterns = {'iob_higher_cob_not': "Unexpected Pattern 1: Insulin significantly higher while carbs are similar",
-        'night_high_2': "Unexpected Pattern 2: Significantly higher glucose during night",
-        'post_meal_rise': "Unexpected Pattern 2: Post meal rise",
-        'more_carbs': "Unexpected Pattern 3: Eating more carbs without needing more insulin",
-    }
     highlighted_patterns = {
         patterns[
             'iob_higher_cob_not']: f"More {colored_text('insulin', 'iob')} was not due to more {colored_text('carbs', 'cob')}",
@@ -78,19 +81,34 @@ def display_explore_patterns():
     with col2:  # plot
         # Select chart type
         graph_layout = select_chart_type(key="explore_patterns_graph_layout")
-        if pattern_select == patterns['iob_higher_cob_not']:
-            fig = plot_cluster_confidence_intervals_for_df(iob_higher_cob_not_df, fix_y=7, plot_type=graph_layout)
-            st.plotly_chart(fig, use_container_width=True)
-        # if pattern_select == patterns['night_high_1']:
-        #     fig = plot_cluster_confidence_intervals_for_df(night_high_1_stats_df, fix_y=7, plot_type=graph_layout)
-        #     st.plotly_chart(fig, use_container_width=True)
-        if pattern_select == patterns['night_high_2']:
-            fig = plot_cluster_confidence_intervals_for_df(night_high_2_stats_df, fix_y=7, plot_type=graph_layout)
-            st.plotly_chart(fig, use_container_width=True)
-        if pattern_select == patterns['more_carbs']:
-            fig = plot_cluster_confidence_intervals_for_df(different_days_stats_df, fix_y=7, plot_type=graph_layout)
-            st.plotly_chart(fig, use_container_width=True)
-        if pattern_select == patterns['post_meal_rise']:
-            fig = plot_cluster_confidence_intervals_for_df(meal_rise_stats_df, fix_y=6, plot_type=graph_layout)
-            st.plotly_chart(fig, use_container_width=True)
+        pattern_key = next(key for key, name in patterns.items() if name == pattern_select)
+        dataset, fix_y = pattern_charts[pattern_key]
+        fig = plot_cluster_confidence_intervals_for_df(store.get(dataset), fix_y=fix_y, plot_type=graph_layout)
+        st.plotly_chart(fig, use_container_width=True)
         st.caption(daily_ts_graph_description_text)
+
+    display_candidate_patterns()
+
+
+def display_candidate_patterns():
+    with st.expander("Explore candidate patterns discovered automatically"):
+        candidates = store.get('pattern_candidates')
+        if candidates is None or candidates.empty:
+            st.caption("No candidate patterns yet. Run `python pattern_discovery.py` to search every person's "
+                       "insulin, carbs and glucose series for recurring motifs and anomalous discords.")
+            return
+        kinds = {
+            "Recurring motifs": 'motif',
+            "Anomalous discords": 'discord',
+        }
+        selected_kind = st.radio("Show:", list(kinds.keys()), index=0, horizontal=True,
+                                 key="candidate_patterns_kind")
+        kind_df = candidates[candidates['kind'] == kinds[selected_kind]]
+        st.markdown(f"""Trends of {colored_text('insulin', 'iob')}, {colored_text('carbs', 'cob')} and {colored_text('blood glucose', 'bg')} within the pattern, ranked by the number of people that show them.""", unsafe_allow_html=True)
+        st.dataframe(
+            kind_df.drop(columns=['kind']).fillna({'resembles': ''}).rename(columns={
+                'time_of_day': 'Time of day', 'iob': 'Insulin', 'cob': 'Carbs', 'bg': 'Blood glucose',
+                'people': 'People', 'occurrences': 'Occurrences', 'mean_distance': 'Mean distance',
+                'resembles': 'Resembles unexpected pattern'}),
+            hide_index=True, use_container_width=True)
+        st.caption("Note: Candidates were found with a multivariate matrix profile and are not yet validated")
@@ -0,0 +1,88 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_store import derivative_orders
+from person_series import default_series_dir, person_ids, person_dir, load_person, daily_profiles, save_array, \
+    load_array, timestamps_file, values_file
+
+# hourly day profiles and their differences along the hours are stored next to each person's raw series as
+# <series_dir>/<person id>/derivative_<n>.npy [day, hour - n, variate], the days of all of them in feature_days.npy
+feature_days_file = 'feature_days'  # int64 UTC day numbers since epoch [day]
+source_files = [timestamps_file, values_file]
+
+
+def feature_file(no_derivatives):
+    return f'derivative_{no_derivatives}'
+
+
+def compute_features(timestamps, values):
+    """
+    Hourly day profiles and all their derivatives in one vectorised pass. Returns (day numbers,
+    {no_derivatives: array [day, hour - no_derivatives, variate]}), differences never cross days.
+    """
+    day_numbers, profiles = daily_profiles(timestamps, values)
+    features = {0: profiles}
+    for no_derivatives in derivative_orders[1:]:
+        features[no_derivatives] = np.diff(features[no_derivatives - 1], axis=1)
+    return day_numbers, features
+
+
+def is_stale(series_dir, person_id):
+    """Whether the features are missing or older than the person's raw series"""
+    directory = person_dir(series_dir, person_id)
+    feature_paths = [os.path.join(directory, name + '.npy')
+                     for name in [feature_days_file] + [feature_file(n) for n in derivative_orders]]
+    if not all(os.path.isfile(path) for path in feature_paths):
+        return True
+    built = min(os.stat(path).st_mtime_ns for path in feature_paths)
+    return any(os.stat(os.path.join(directory, name + '.npy')).st_mtime_ns > built for name in source_files)
+
+
+def build_person(series_dir, person_id, force=False):
+    """Computes and writes the features of one person unless they are up to date. Returns whether they were built"""
+    if not force and not is_stale(series_dir, person_id):
+        return False
+    day_numbers, features = compute_features(*load_person(series_dir, person_id))
+    for no_derivatives, feature in features.items():
+        save_array(series_dir, person_id, feature_file(no_derivatives), feature)
+    # written last so that an interrupted build stays stale
+    save_array(series_dir, person_id, feature_days_file, day_numbers)
+    return True
+
+
+def load_features(series_dir, person_id, no_derivatives):
+    """Memory-mapped (day numbers, derivative [day, hour - no_derivatives, variate]) of one person, built if stale"""
+    build_person(series_dir, person_id)
+    return (load_array(series_dir, person_id, feature_days_file),
+            load_array(series_dir, person_id, feature_file(no_derivatives)))
+
+
+def build_all(series_dir=default_series_dir, workers=None, force=False):
+    """Builds the features of every person with stale features in parallel, returns the number built"""
+    ids = person_ids(series_dir)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        built = list(executor.map(build_person, [series_dir] * len(ids), ids, [force] * len(ids)))
+    return sum(built)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the hourly day profiles and their derivatives of every "
+                                                 "person next to the raw series.")
+    parser.add_argument("--series-dir", default=default_series_dir)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild up to date features too")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    built = build_all(args.series_dir, args.workers, args.force)
+    print(f"Built features of {built} of {len(person_ids(args.series_dir))} people in "
+          f"{time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
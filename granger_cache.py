@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import math
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_store import data_dir, dataset_files, updated_dataset_files, granger_relations, clusters, derivative_orders
+from feature_store import load_features
+from person_series import default_series_dir, person_ids, person_dir, load_day_clusters, timestamps_file, \
+    values_file, day_clusters_file, series_variates
+
+granger_file = os.path.join(data_dir, dataset_files['granger_causality'][0])
+cache_dir = os.path.join('.cache', 'granger')
+# updated tables are written here by default, starting from the study's table, and the app reads them instead of the
+# study's table
+updated_granger_file = updated_dataset_files['granger_causality']
+# a relation is predictive when the test's p value is below this
+significance = 0.05
+# key = variate name in granger_relations, value = variate in the person series
+relation_variates = {
+    'IOB': 'iob',
+    'COB': 'cob',
+    'IG': 'bg',
+}
+input_files = [timestamps_file, values_file, day_clusters_file]
+table_columns = ['id', 'Cluster', 'lag', 'no_derivatives'] + granger_relations
+
+
+def chi2_sf(x, df):
+    """Survival function of the chi-square distribution for integer degrees of freedom, in closed form"""
+    if x <= 0:
+        return 1.0
+    half = x / 2
+    if df % 2 == 0:
+        return math.exp(-half) * sum(half ** i / math.factorial(i) for i in range(df // 2))
+    return math.erfc(math.sqrt(half)) + math.exp(-half) * sum(half ** (i - 0.5) / math.gamma(i + 0.5)
+                                                              for i in range(1, (df + 1) // 2))
+
+
+def lagged_windows(features, lag):
+    """
+    Rows of lag + 1 consecutive hours [row, variate, hour] of day features [day, hour, variate]. Windows never cross
+    days and windows with missing hours are dropped.
+    """
+    if features.shape[1] <= lag:
+        return np.empty((0, features.shape[2], lag + 1))
+    windows = np.lib.stride_tricks.sliding_window_view(features, lag + 1, axis=1)
+    windows = windows.reshape(-1, features.shape[2], lag + 1)
+    return windows[~np.isnan(windows).any(axis=(1, 2))]
+
+
+def residual_sum_of_squares(x, y):
+    beta = np.linalg.lstsq(x, y, rcond=None)[0]
+    return float(((y - x @ beta) ** 2).sum())
+
+
+def granger_causes(windows, cause, effect, lag):
+    """
+    Whether the lagged cause variate improves the prediction of the effect variate beyond its own lags, with the
+    sum of squared residuals chi-square test (ssr_chi2test of statsmodels' grangercausalitytests)
+    """
+    n = len(windows)
+    if n <= 2 * lag + 1:
+        return False
+    y = windows[:, effect, -1]
+    restricted = np.column_stack([np.ones(n), windows[:, effect, :-1]])
+    unrestricted = np.column_stack([restricted, windows[:, cause, :-1]])
+    rss_restricted = residual_sum_of_squares(restricted, y)
+    rss_unrestricted = residual_sum_of_squares(unrestricted, y)
+    if rss_unrestricted <= 0 or rss_restricted <= rss_unrestricted:
+        return False
+    statistic = n * (rss_restricted - rss_unrestricted) / rss_unrestricted
+    return chi2_sf(statistic, lag) < significance
+
+
+def cluster_features(series_dir, person_id, no_derivatives):
+    """
+    Day features [day, hour, variate] of one person from the feature store per cluster index, None when the days
+    are not clustered
+    """
+    day_clusters = load_day_clusters(series_dir, person_id)
+    if day_clusters is None:
+        return None
+    day_numbers, features = load_features(series_dir, person_id, no_derivatives)
+    labels = pd.Series(np.asarray(day_clusters[1]), index=np.asarray(day_clusters[0]))
+    day_labels = labels.reindex(np.asarray(day_numbers)).to_numpy()
+    return {c: np.asarray(features[day_labels == c]) for c in range(len(clusters))}
+
+
+def test_cell(features_by_cluster, lag):
+    """Granger results of one (person, lag, derivative) cell as {cluster index: {relation: bool}}"""
+    results = {}
+    for c, features in features_by_cluster.items():
+        windows = lagged_windows(features, lag)
+        results[c] = {}
+        for relation in granger_relations:
+            cause, effect = relation.split('->')
+            results[c][relation] = granger_causes(windows, series_variates.index(relation_variates[cause]),
+                                                  series_variates.index(relation_variates[effect]), lag)
+    return results
+
+
+def input_stamps(series_dir, person_id):
+    stamps = []
+    for name in input_files:
+        path = os.path.join(person_dir(series_dir, person_id), name + '.npy')
+        stat = os.stat(path) if os.path.isfile(path) else None
+        stamps.append((name, stat.st_mtime_ns, stat.st_size) if stat else (name, None, None))
+    return stamps
+
+
+def input_hash(series_dir, person_id):
+    digest = hashlib.sha256()
+    for name in input_files:
+        path = os.path.join(person_dir(series_dir, person_id), name + '.npy')
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        digest.update(name.encode())
+    return digest.hexdigest()
+
+
+def cache_path(person_id):
+    return os.path.join(cache_dir, f"{person_id}.pkl")
+
+
+def load_person_cache(person_id):
+    if not os.path.exists(cache_path(person_id)):
+        return {'stamps': None, 'input_hash': None, 'cells': {}}
+    with open(cache_path(person_id), 'rb') as f:
+        return pickle.load(f)
+
+
+def save_person_cache(person_id, person_cache):
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = cache_path(person_id) + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(person_cache, f)
+    os.replace(temporary_path, cache_path(person_id))
+
+
+def update_person(series_dir, person_id, cells):
+    """
+    Granger results of the requested (lag, no_derivatives) cells of one person. Cached cells are keyed on the hash
+    of the person's input series and the test parameters; only cells missing for the current input are tested, and
+    cells of earlier versions of the input are dropped. Returns (person id, {cell: results}, number of tested cells).
+    """
+    person_cache = load_person_cache(person_id)
+    stamps = input_stamps(series_dir, person_id)
+    if stamps != person_cache['stamps']:
+        # files were written since the last run, only rehash them, the content may still be the same
+        person_cache['stamps'] = stamps
+        person_cache['input_hash'] = input_hash(series_dir, person_id)
+    current_hash = person_cache['input_hash']
+    keys = {cell: (current_hash, cell[0], cell[1], significance) for cell in cells}
+    missing = [cell for cell in cells if keys[cell] not in person_cache['cells']]
+
+    if missing and load_day_clusters(series_dir, person_id) is None:
+        return person_id, {}, 0
+    for no_derivatives in sorted({cell[1] for cell in missing}):
+        features_by_cluster = cluster_features(series_dir, person_id, no_derivatives)
+        for lag, _ in [cell for cell in missing if cell[1] == no_derivatives]:
+            person_cache['cells'][keys[(lag, no_derivatives)]] = test_cell(features_by_cluster, lag)
+    person_cache['cells'] = {key: results for key, results in person_cache['cells'].items()
+                             if key[0] == current_hash}
+    save_person_cache(person_id, person_cache)
+    return person_id, {cell: person_cache['cells'][keys[cell]] for cell in cells}, len(missing)
+
+
+def _update_person(args):
+    return update_person(*args)
+
+
+def result_rows(person_id, cell_results):
+    rows = []
+    for (lag, no_derivatives), results in cell_results.items():
+        for c, relations in results.items():
+            rows.append({'id': int(person_id), 'Cluster': c, 'lag': lag, 'no_derivatives': no_derivatives,
+                         **relations})
+    return rows
+
+
+def merge_table(table, rows, updated_ids, cells):
+    """Replaces the rows of the updated (person, lag, derivative) cells of table with rows"""
+    cell_index = pd.MultiIndex.from_frame(table[['id', 'lag', 'no_derivatives']])
+    replaced = cell_index.isin([(person, lag, no_derivatives) for person in updated_ids
+                                for lag, no_derivatives in cells])
+    merged = pd.concat([table[~replaced], pd.DataFrame(rows, columns=table_columns)], ignore_index=True)
+    merged[['id', 'Cluster', 'lag', 'no_derivatives']] = merged[['id', 'Cluster', 'lag', 'no_derivatives']].astype(int)
+    merged[granger_relations] = merged[granger_relations].astype(bool)
+    return merged.sort_values(['id', 'Cluster', 'lag', 'no_derivatives'], ignore_index=True)
+
+
+def read_table(table_file):
+    if not os.path.exists(table_file):
+        return pd.DataFrame(columns=table_columns)
+    return pd.read_csv(table_file, index_col=0)[table_columns]
+
+
+def write_table(table, table_file):
+    """Writes table with TRUE/FALSE relations, keeping the line endings of an existing table_file"""
+    crlf = False
+    if os.path.exists(table_file):
+        with open(table_file, 'rb') as f:
+            crlf = f.readline().endswith(b'\r\n')
+    table = table.copy()
+    for relation in granger_relations:
+        table[relation] = np.where(table[relation], 'TRUE', 'FALSE')
+    os.makedirs(os.path.dirname(table_file) or '.', exist_ok=True)
+    table.to_csv(table_file, lineterminator='\r\n' if crlf else '\n')
+
+
+def update_table(series_dir=default_series_dir, lags=(1, 2, 3), derivatives=tuple(derivative_orders),
+                 table_file=updated_granger_file, workers=None, study_file=granger_file, force=False):
+    """
+    Tests every person in series_dir for the requested lags and derivatives, reusing cached cells, and merges the
+    results into table_file, which starts as a copy of study_file (None for an empty table). People without
+    clustered days and rows of other people are kept unchanged. Raises ValueError for people that have rows in
+    study_file unless force. table_file is only written when its rows change. Returns (merged table, number of
+    tested cells, number of people updated, whether table_file was written).
+    """
+    cells = [(lag, no_derivatives) for lag in lags for no_derivatives in derivatives]
+    ids = [person_id for person_id in person_ids(series_dir) if person_id.isdigit()]
+    study_ids = set(read_table(study_file)['id'].astype(int)) if study_file else set()
+    conflicting = sorted(study_ids.intersection(int(person_id) for person_id in ids))
+    if conflicting and not force:
+        raise ValueError(f"People {', '.join(map(str, conflicting))} already have rows in {study_file}, "
+                         f"see --force")
+    tasks = [(series_dir, person_id, cells) for person_id in ids]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [update_person(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_update_person, tasks))
+
+    rows = []
+    updated_ids = []
+    for person_id, cell_results, _ in results:
+        if cell_results:
+            updated_ids.append(int(person_id))
+            rows.extend(result_rows(person_id, cell_results))
+    exists = os.path.exists(table_file)
+    previous = read_table(table_file if exists or not study_file else study_file)
+    table = merge_table(previous, rows, updated_ids, cells)
+    changed = not exists or not table.equals(merge_table(previous, [], [], cells))
+    if changed:
+        write_table(table, table_file)
+    return table, sum(tested for _, _, tested in results), len(updated_ids), changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally update the granger causality table from the per "
+                                                 "person series, testing only cells whose input or parameters are "
+                                                 "not cached yet.")
+    parser.add_argument("--series-dir", default=default_series_dir)
+    parser.add_argument("--table", default=updated_granger_file,
+                        help="table to update, a copy of --study-table when it does not exist yet; the app reads the "
+                             "default table instead of the study's when it exists")
+    parser.add_argument("--study-table", default=granger_file,
+                        help="the study's table, its people are only replaced with --force")
+    parser.add_argument("--force", action="store_true", help="replace the rows of people in --study-table")
+    parser.add_argument("--lags", type=int, nargs='+', default=[1, 2, 3], help="lags in hours")
+    parser.add_argument("--derivatives", type=int, nargs='+', default=derivative_orders, choices=derivative_orders)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        table, tested, updated, changed = update_table(args.series_dir, args.lags, args.derivatives, args.table,
+                                                       args.workers, args.study_table, args.force)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Tested {tested} new (person, lag, derivative) cells of {updated} people, {len(table)} rows in "
+          f"{args.table}{'' if changed else ' (unchanged)'} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
-import pandas as pd
 import streamlit as st
 
+from data_store import store
 from plot_cluster_interval import plot_cluster_confidence_intervals_for_df, daily_ts_graph_description_text, \
     select_chart_type
+from subgroups import display_subgroup_comparison
 
-flatline_stats_df = pd.read_csv('data/flatline-stats-results.csv', header=[0, 1, 2], index_col=0)
-different_days_stats_df = pd.read_csv('data/different_days-stats-results.csv', header=[0, 1, 2], index_col=0)
+# key = chart title, value = data store stats dataset
+individual_charts = {
+    'A person with almost flat lines': 'flatline_stats',
+    'A person with more variation between the days': 'different_days_stats',
+}
 
 
 def display_individual_variations():
@@ -36,17 +40,15 @@ def display_individual_variations():
     st.write(
         "Even within a demographically similar group, we found substantial individual variations in glucose regulation patterns.")
     graph_layout = select_chart_type(key="individual_variations_graph_layout")
-    col1, col2 = st.columns(2)
-    with col1:  # plot
-        st.markdown("<p style='text-align: center; font-weight: bold; margin: 0;'>A person with almost flat lines</p>",
-                    unsafe_allow_html=True)
-        fig = plot_cluster_confidence_intervals_for_df(flatline_stats_df, fix_y=6, plot_type=graph_layout)
-        st.plotly_chart(fig, use_container_width=True)
-    with col2:
-        st.markdown(
-            "<p style='text-align: center; font-weight: bold; margin: 0;'>A person with more variation between the days</p>",
-            unsafe_allow_html=True)
-        fig = plot_cluster_confidence_intervals_for_df(different_days_stats_df, fix_y=6, plot_type=graph_layout)
-        st.plotly_chart(fig, use_container_width=True)
+    cols = st.columns(len(individual_charts))
+    for col, (title, dataset) in zip(cols, individual_charts.items()):
+        with col:  # plot
+            st.markdown(f"<p style='text-align: center; font-weight: bold; margin: 0;'>{title}</p>",
+                        unsafe_allow_html=True)
+            fig = plot_cluster_confidence_intervals_for_df(store.get(dataset), fix_y=6, plot_type=graph_layout)
+            st.plotly_chart(fig, use_container_width=True)
 
     st.caption(daily_ts_graph_description_text)
+
+    st.divider()
+    display_subgroup_comparison()
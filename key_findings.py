@@ -1,32 +1,20 @@
+import math
 import random
 
-import pandas as pd
+import numpy as np
 import streamlit as st
 import plotly.graph_objects as go
 
 from constants import expected_colour, unexpected_colour
+from data_store import store, query_tau_range, demographic_factors
+from theme import chart_template, styled_metric
 
 format_with_arrow = lambda number: f"{'↑' if number > 0 else '↓' if number < 0 else ''} {abs(number):.2f} τ"
 
-granger_causality_df = pd.read_csv("data/granger_causality.csv", index_col=0)
 predict_glucose_columns = {
     'Insulin': 'IOB->IG',
     'Carbs': 'COB->IG',
 }
-pattern_associations_df = pd.read_csv("data/demographic_associations.csv")
-# key = display name, value = dataframe column names
-demographic_factors = {
-    "Age": "Age",
-    "Duration of T1D": "Duration of T1D",
-    "A1C": "A1C",
-    "Avg. Carbs": "Avg. Carbs",
-    "Avg. Insulin": "Avg. Insulin",
-    "Avg. Basal Insulin": "Avg. Basal Insulin",
-    "Pumping since": "Pumping since",
-    "CGM since": "CGM since",
-    "AID since": "AID since"
-}
-pattern_frequency_df = pd.read_csv("data/pattern_frequency.csv", index_col=0)
 # key = display name, value = dataframe timeframe
 temporal_units = {
     "Hours of the day": "Hours of the day",
@@ -34,6 +22,22 @@ temporal_units = {
     "Days of the week": "Days of the week",
     "Months of the year": "Months of the year",
 }
+# key = display name, value = granger lag in hours
+lags = {
+    '1 hour': 1,
+    '2 hours': 2,
+    '3 hours': 3,
+    '4 hours': 4,
+    '5 hours': 5,
+    '6 hours': 6,
+}
+# key = display name, value = granger no_derivatives
+derivatives = {
+    'Original values': 0,
+    'Speed': 1,
+    'Acceleration': 2,
+    'Change of Acceleration': 3
+}
 patterns_by_number = {
     1: ':one:   More **insulin** :syringe:...',
     2: ':two:   Higher **blood glucose** :drop_of_blood: ...',
@@ -58,6 +62,18 @@ unexpected_reasons = {
     ':three:   Eating more **carbs** :green_apple:...': " did not need more **insulin**."
 }
 
+# key = finding, value = summary
+main_findings = {
+    "1. Discovered unexpected temporal patterns in insulin needs":
+        "Current models cannot fully explain the observed unexpected patterns, highlighting the need for further research into underlying physiological mechanisms.",
+    "2. Unexpected patterns are common":
+        "Unexpected patterns occur just as frequently as expected ones, suggesting they are a fundamental part of glucose regulation, not anomalies. This challenges conventional glucose regulation models.",
+    "3. Unexpected patterns are not associated with demographics":
+        "Unexpected patterns appear across all demographic groups with no strong associations to demographics, emphasising the need for personalised rather than group-based approaches.",
+    "4. Glucose cannot easily be predicted from insulin or carbs":
+        "The causal relationship between insulin, carbohydrates and glucose levels varies widely between individuals and situations. This variability makes reliable glucose prediction difficult without information about what drives these unexpected patterns, highlighting the need to include more causal factors.",
+}
+
 
 def create_pattern_plot(df, selected_patterns):
     # filter data by selected patterns, 1, 2, 3
@@ -80,7 +96,7 @@ def create_pattern_plot(df, selected_patterns):
 
         # Calculate mean values when multiple patterns are selected
         grouped_data = (
-            pattern_data.groupby('timeframe').agg({'mean': ['mean', 'std']}).round(2).reindex(order).reset_index())
+            pattern_data.groupby('timeframe', observed=True).agg({'mean': ['mean', 'std']}).round(2).reindex(order).reset_index())
 
         fig.add_trace(go.Bar(
             name=f'{pattern_type} Pattern: ' + ', '.join([str(x) for x in selected_patterns]),
@@ -110,6 +126,7 @@ def create_pattern_plot(df, selected_patterns):
             zeroline=False,
             showgrid=False,
         ),
+        template=chart_template,
         barmode='group',
         margin=dict(l=150, r=20, t=20, b=40),
         showlegend=False,
@@ -125,27 +142,20 @@ def create_pattern_plot(df, selected_patterns):
 
 
 def display_explore_predictability():
-    lags = {
-        '1 hour': 1,
-        '2 hours': 2,
-        '3 hours': 3,
-    }
-    derivatives = {
-        'Original values': 0,
-        'Speed': 1,
-        'Acceleration': 2,
-        'Change of Acceleration': 3
-    }
     variates = list(predict_glucose_columns.keys())
+    total_people = len(tested_people())
     help_for_col_name = {
-        variates[0]: f'Shows for how many people of the 28 we can predict blood glucose from {variates[0]}',
-        variates[1]: f'Shows for how many people of the 28 we can predict blood glucose from {variates[1]}',
+        variates[0]: f'Shows for how many people of the {total_people} we can predict blood glucose from {variates[0]}',
+        variates[1]: f'Shows for how many people of the {total_people} we can predict blood glucose from {variates[1]}',
     }
     with st.expander("Explore for how many people we can predict blood glucose from insulin or carbs"):
-        total_people = 28  # we removed the id from the data for privacy
+        tested_lags = available_lags()
+        if not tested_lags:
+            st.info("No predictability results yet. Run `python granger_cache.py` to test the per person series.")
+            return
         selected_lag = st.segmented_control(
-            "Select how many hours back in time to check for effects:", list(lags.keys()),
-            default=list(lags.keys())[0]
+            "Select how many hours back in time to check for effects:", list(tested_lags.keys()),
+            default=list(tested_lags.keys())[0]
         )
         selected_derivative = st.segmented_control(
             "Select aspects of the data to use to predict blood glucose:", list(derivatives.keys()),
@@ -154,44 +164,14 @@ def display_explore_predictability():
         if not selected_lag or not selected_derivative:
             st.error("Please select at least one option each")
         else:
-            # filter lag
-            lags_value = lags[selected_lag]
-            g_filtered = granger_causality_df[granger_causality_df["lag"] == lags_value]
-
-            # filter derivative
-            derivative_value = derivatives[selected_derivative]
-            g_filtered = g_filtered[g_filtered["no_derivatives"] == derivative_value]
-
-            # st.write(g_filtered)
-
-
-            all_predictable_ids = set()
-            one_cluster_only_ids = {}
-            both_clusters_ids = {}
-            # calculate ids
-            for i, col_name in enumerate(variates):
-                rel_name = predict_glucose_columns[col_name]
-                # DataFrame showing whether each ID-cluster combination has any True values
-                has_true_by_id_cluster = g_filtered.groupby(['id', 'Cluster'])[rel_name].any().reset_index()
-                # Count how many clusters have True for each ID
-                trues_per_id = has_true_by_id_cluster[has_true_by_id_cluster[rel_name] == True].groupby(
-                    'id').size()
-
-                # keep trac of ids with trues
-                ids_with_any_true = trues_per_id.index.tolist()
-                all_predictable_ids.update(ids_with_any_true)
-
-                # Filter for IDs that have exactly 1 cluster with True (not both)
-                unique_ids_one_cluster_only = trues_per_id[trues_per_id == 1]
-                unique_ids_both_clusters = trues_per_id[trues_per_id == 2]
-                one_cluster_only_ids[col_name] = unique_ids_one_cluster_only
-                both_clusters_ids[col_name] = unique_ids_both_clusters
+            all_predictable_ids, one_cluster_only_ids, both_clusters_ids = predictable_ids(
+                tested_lags[selected_lag], derivatives[selected_derivative])
 
             with st.container(border=True):
                 final_cols = st.columns(2)
                 with final_cols[0]:
                     st.metric("Unique people who show predictability from Insulin or Carbs",
-                              value=f"{people_string(len(all_predictable_ids))} of 28")
+                              value=f"{people_string(len(all_predictable_ids))} of {total_people}")
                 with final_cols[1]:
                     create_icon_array(indices_group1=all_predictable_ids, indices_group2=[], color_group1="#212121")
 
@@ -204,14 +184,62 @@ def display_explore_predictability():
                                     help=help_for_col_name[col_name])
                         col1, col2 = st.columns(2)
                         with col1:
-                            st.metric("Some days", value=f"{one_cluster_only_ids[col_name].count()}")
+                            styled_metric('some-days', f"predict-{col_name}", "Some days",
+                                          value=f"{len(one_cluster_only_ids[col_name])}")
                         with col2:
-                            st.metric("Most days", value=f"{both_clusters_ids[col_name].count()}")
+                            styled_metric('most-days', f"predict-{col_name}", "Most days",
+                                          value=f"{len(both_clusters_ids[col_name])}")
                         create_icon_array(indices_group1=one_cluster_only_ids[col_name],
                                           indices_group2=both_clusters_ids[col_name])
 
             st.caption("Note: Granger causality was used to determine forecastability")
 
+
+def available_lags():
+    """Entries of lags the granger table has results for, granger_cache.py adds further lags to the updated table"""
+    tested = {key[0] for key in store.get('granger_bitmasks').keys() if key != 'ids'}
+    return {name: lag for name, lag in lags.items() if lag in tested}
+
+
+def tested_people():
+    """Sorted ids of the people in the granger table"""
+    return store.get('granger_bitmasks')['ids']
+
+
+def icon_grid_shape(n_people, min_columns=7):
+    """(rows, columns) of the icon array of n_people, 4 x 7 for the 28 people of the study"""
+    columns = min(n_people, max(min_columns, math.ceil(math.sqrt(n_people))))
+    return (math.ceil(n_people / columns), columns) if columns else (0, 0)
+
+
+def predictable_ids(lag, no_derivatives):
+    """
+    Ids of people whose glucose can be predicted from insulin or carbs for the given granger lag and derivative.
+    Returns the set of all predictable ids and, per variate in predict_glucose_columns, the ids predictable in one
+    cluster only and the ids predictable in both clusters.
+    """
+    # person x cluster masks of significant granger tests for the selected lag and derivative
+    granger_bitmasks = store.get('granger_bitmasks')
+    ids = granger_bitmasks['ids']
+    masks = granger_bitmasks.get((lag, no_derivatives), {})
+
+    all_predictable_ids = set()
+    one_cluster_only_ids = {}
+    both_clusters_ids = {}
+    # calculate ids
+    for col_name, rel_name in predict_glucose_columns.items():
+        # Count how many clusters have True for each ID
+        trues_per_id = masks[rel_name].sum(axis=1) if rel_name in masks else np.zeros(len(ids), dtype=int)
+
+        # keep trac of ids with trues
+        all_predictable_ids.update(ids[trues_per_id > 0].tolist())
+
+        # IDs that have exactly 1 cluster with True (not both) and IDs with True in both clusters
+        one_cluster_only_ids[col_name] = ids[trues_per_id == 1].tolist()
+        both_clusters_ids[col_name] = ids[trues_per_id == 2].tolist()
+    return all_predictable_ids, one_cluster_only_ids, both_clusters_ids
+
+
 def people_string(n: int):
     if n == 0:
         return "No one"
@@ -222,7 +250,20 @@ def people_string(n: int):
 def create_icon_array(indices_group1, indices_group2,
                       color_group1="#7CBDDA",
                       color_group2="#0A6C95",
-                      inactive_color="#F0F0F0"):
+                      inactive_color="#F0F0F0",
+                      ids=None):
+    st.markdown(icon_array_html(indices_group1, indices_group2, color_group1, color_group2, inactive_color, ids),
+                unsafe_allow_html=True)
+
+
+def icon_array_html(indices_group1, indices_group2,
+                    color_group1="#7CBDDA",
+                    color_group2="#0A6C95",
+                    inactive_color="#F0F0F0",
+                    ids=None):
+    """One icon per person of ids (default every person in the granger table), coloured by group"""
+    ids = tested_people().tolist() if ids is None else list(ids)
+    n_rows, n_columns = icon_grid_shape(len(ids))
     # SVG person silhouette
     unique_id = random.randint(10, 1000)
     person_svg = """
@@ -236,7 +277,7 @@ def create_icon_array(indices_group1, indices_group2,
         <style>
         .icon-grid-{unique_id} {{
             display: grid;
-            grid-template-columns: repeat(7, 1fr);
+            grid-template-columns: repeat({n_columns}, 1fr);
             gap: 8px;
             margin-bottom: 8px;
         }}
@@ -255,15 +296,11 @@ def create_icon_array(indices_group1, indices_group2,
         </style>
         """
 
-    # 4 rows of 7 icons each
-    for row in range(4):
+    # n_rows rows of n_columns icons each, the last row may be shorter
+    for row in range(n_rows):
         html += f'<div class="icon-grid-{unique_id}">'
-        for col in range(7):
-            # Calculate position (0-27)
-            position = row * 7 + col
-
-            # Convert to 1-based indexing
-            index = position + 1
+        for col in range(min(n_columns, len(ids) - row * n_columns)):
+            index = ids[row * n_columns + col]
 
             # Determine which group this index belongs to
             if index in indices_group1:
@@ -275,31 +312,18 @@ def create_icon_array(indices_group1, indices_group2,
 
             html += f'<div class="icon-{unique_id} {icon_class}">{person_svg}</div>'
         html += '</div>'
-
-    st.markdown(html, unsafe_allow_html=True)
+    return html
 
 
 def display_main_findings():
     # st.header(key_findings)
-    st.subheader("1. Discovered unexpected temporal patterns in insulin needs", divider=True)
-    st.markdown(
-        "Current models cannot fully explain the observed unexpected patterns, highlighting the need for further research into underlying physiological mechanisms.")
-
-    st.subheader("2. Unexpected patterns are common", divider=True)
-    st.markdown(
-        "Unexpected patterns occur just as frequently as expected ones, suggesting they are a fundamental part of glucose regulation, not anomalies. This challenges conventional glucose regulation models.")
-    display_exploration_pattern_frequency()
-
-    st.subheader("3. Unexpected patterns are not associated with demographics", divider=True)
-    st.markdown(
-        "Unexpected patterns appear across all demographic groups with no strong associations to demographics, emphasising the need for personalised rather than group-based approaches.")
-    display_explore_correlations()
-
-    st.subheader("4. Glucose cannot easily be predicted from insulin or carbs",
-                 divider=True)
-    st.markdown(
-        "The causal relationship between insulin, carbohydrates and glucose levels varies widely between individuals and situations. This variability makes reliable glucose prediction difficult without information about what drives these unexpected patterns, highlighting the need to include more causal factors.")
-    display_explore_predictability()
+    explorations = [None, display_exploration_pattern_frequency, display_explore_correlations,
+                    display_explore_predictability]
+    for (finding, summary), explore in zip(main_findings.items(), explorations):
+        st.subheader(finding, divider=True)
+        st.markdown(summary)
+        if explore is not None:
+            explore()
 
 
 def display_explore_correlations():
@@ -326,21 +350,14 @@ def display_explore_correlations():
         lower_tau = taus[0]
         upper_tau = taus[1]
 
-        filtered_assoc_df = pattern_associations_df[
-            pattern_associations_df['pattern_number'] == selectable_patterns[selected_pattern]]
-        filtered_assoc_df = filtered_assoc_df[filtered_assoc_df['timeframe'] == temporal_units[temporal_unit]]
-        # this is only 1 row left and per expected and unexpected
-        expected_df = filtered_assoc_df[filtered_assoc_df['pattern_type'] == 'Expected'][demographics]
-        expected_demographics = [col for col in demographics
-                                 if (abs(expected_df[col].values[0]) >= lower_tau) and
-                                 (abs(expected_df[col].values[0]) <= upper_tau)]
-        expected_df = expected_df[expected_demographics]
-
-        unexpected_df = filtered_assoc_df[filtered_assoc_df['pattern_type'] == 'Unexpected'][demographics]
-        unexpected_demographics = [col for col in demographics
-                                   if (abs(unexpected_df[col].values[0]) >= lower_tau) and
-                                   (abs(unexpected_df[col].values[0]) <= upper_tau)]
-        unexpected_df = unexpected_df[unexpected_demographics]
+        pattern_number = selectable_patterns[selected_pattern]
+        timeframe = temporal_units[temporal_unit]
+        expected_taus = associations_in_tau_range(pattern_number, timeframe, 'Expected', demographics, lower_tau,
+                                                  upper_tau)
+        expected_demographics = list(expected_taus.keys())
+        unexpected_taus = associations_in_tau_range(pattern_number, timeframe, 'Unexpected', demographics, lower_tau,
+                                                    upper_tau)
+        unexpected_demographics = list(unexpected_taus.keys())
 
         # Expected
         with st.container(key="expected_patterns_associations"):
@@ -352,7 +369,7 @@ def display_explore_correlations():
                 cols = create_cols_for_associations(expected_demographics)
                 for i, dem in enumerate(expected_demographics):
                     with cols[i]:
-                        st.metric(label=demographic_factors[dem], value=format_with_arrow(expected_df[dem].iloc[0]))
+                        st.metric(label=demographic_factors[dem], value=format_with_arrow(expected_taus[dem]))
 
         # Unexpected
         with st.container(key="unexpected_patterns_associations"):
@@ -364,11 +381,21 @@ def display_explore_correlations():
                 cols = create_cols_for_associations(unexpected_demographics)
                 for i, dem in enumerate(unexpected_demographics):
                     with cols[i]:
-                        st.metric(label=demographic_factors[dem], value=format_with_arrow(unexpected_df[dem].iloc[0]))
+                        st.metric(label=demographic_factors[dem], value=format_with_arrow(unexpected_taus[dem]))
 
         st.caption("Note: Only associations where τ ≥ 0.36 achieved statistical power ≥80%")
 
 
+def associations_in_tau_range(pattern_number, timeframe, pattern_type, demographics, lower_tau, upper_tau):
+    """
+    Taus of the selected demographics whose absolute association strength lies within [lower_tau, upper_tau], in
+    the order of demographics
+    """
+    tau_index = store.get('association_table')[(pattern_number, timeframe, pattern_type)]
+    in_range = set(query_tau_range(tau_index, lower_tau, upper_tau))
+    return {dem: tau_index.taus[dem] for dem in demographics if dem in in_range}
+
+
 def display_expected_reason(selected_pattern):
     reason = expected_reasons[selected_pattern]
     result = selected_pattern.replace("...", "")
@@ -397,7 +424,7 @@ def display_exploration_pattern_frequency():
 
         if show_graph:
             # plot
-            fig = create_pattern_plot(pattern_frequency_df, [selectable_patterns[selected_pattern]])
+            fig = create_pattern_plot(store.get('pattern_frequency'), [selectable_patterns[selected_pattern]])
             st.plotly_chart(fig, use_container_width=True)
             # else:
             #     st.warning("Please select at least one pattern to display.")
@@ -412,6 +439,7 @@ def display_exploration_pattern_frequency():
                 label_visibility="visible"  # Hides the empty label completely
             )
 
+            pattern_frequency_df = store.get('pattern_frequency')
             filtered_df = pattern_frequency_df[
                 pattern_frequency_df['pattern_number'] == selectable_patterns[selected_pattern]]
             filtered_df = filtered_df[filtered_df['timeframe'] == temporal_units[temporal_unit]]
@@ -421,9 +449,13 @@ def display_exploration_pattern_frequency():
             # Display key metrics
             st.write("")  # add space
             col1, col2, col3 = st.columns(3)
-            col1.metric("Total People", "29")
-            col2.metric("People with Expected Patterns", str(avg_expected))
-            col3.metric("People with Unexpected Patterns", str(avg_unexpected))
+            with col1:
+                styled_metric('plain', "total-people", "Total People", "29")
+            with col2:
+                styled_metric('expected', "pattern-frequency", "People with Expected Patterns", str(avg_expected))
+            with col3:
+                styled_metric('unexpected', "pattern-frequency", "People with Unexpected Patterns",
+                              str(avg_unexpected))
 
 
 def pattern_selector(key=""):
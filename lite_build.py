@@ -0,0 +1,587 @@
+import argparse
+import gzip
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import textwrap
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.element_tree import Block, Widget
+
+from batch_report import associations_page
+from constants import key_findings, explore_patterns, individual_variations, why_this_matters, \
+    additional_information
+from data_store import store
+from explore_patterns import patterns, pattern_charts
+from inividual_variations import individual_charts
+from key_findings import main_findings, temporal_units, \
+    selectable_patterns, predictable_ids, available_lags, derivatives, predict_glucose_columns, people_string, \
+    tested_people
+from plot_cluster_interval import plot_cluster_confidence_intervals_for_df
+from stats_api import accepts_gzip
+from streamlit_app import content_title, authors, callout
+
+default_lite_dir = 'lite'
+# lists the files a build wrote, one per line, only these are removed by the next build into the same directory
+build_marker = '.lite-build'
+default_port = 8503
+# seconds a tab may take to render headless
+tab_timeout = 60
+# chart values are rounded to this many decimals, the scaled readings span about 0-7
+lite_decimals = 1
+# stats frames with more rows than this are averaged into this many buckets before plotting
+lite_max_points = 24
+# plotly.js partial bundle with the scatter and bar traces of the lite charts, the full bundle is about 4.7MB
+plotly_basic_url = "https://cdn.plot.ly/plotly-basic-{version}.min.js"
+plotly_cache_dir = os.path.join('.cache', 'plotly')
+# pages are revalidated after a few minutes, assets carry a content hash in their name and never change
+page_cache_control = 'public, max-age=600'
+asset_cache_control = 'public, max-age=31536000, immutable'
+compressed_suffixes = ('.html', '.js', '.css', '.json', '.svg')
+content_types = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+}
+emoji_shortcodes = {
+    ':one:': '1️⃣',
+    ':two:': '2️⃣',
+    ':three:': '3️⃣',
+    ':syringe:': '💉',
+    ':drop_of_blood:': '🩸',
+    ':green_apple:': '🍏',
+}
+
+page_template = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title} · {content_title}</title>
+<style>
+body {{ font-family: system-ui, sans-serif; margin: 0 auto; max-width: 900px; padding: 0 1rem 2rem; color: #31333f; line-height: 1.5; }}
+nav {{ display: flex; gap: .25rem; overflow-x: auto; border-bottom: 1px solid #ddd; margin: 1rem 0; }}
+nav a {{ padding: .4rem .6rem; white-space: nowrap; text-decoration: none; color: inherit; }}
+nav a.active {{ border-bottom: 2px solid #46bdc6; font-weight: bold; }}
+h1 {{ font-size: 1.6rem; margin-bottom: .2rem; }}
+h2 {{ font-size: 1.25rem; border-bottom: 1px solid #ddd; }}
+.table-wrap {{ overflow-x: auto; }}
+table {{ border-collapse: collapse; font-size: .9rem; }}
+td, th {{ border: 1px solid #ddd; padding: 3px 8px; text-align: right; }}
+.metrics {{ display: flex; flex-wrap: wrap; gap: 1rem; }}
+.metric .value {{ display: block; font-size: 1.6rem; }}
+.metric .label, .caption {{ font-size: .85rem; color: #808495; }}
+.chart {{ min-height: 500px; }}
+.powered {{ font-weight: bold; }}
+details {{ margin: .5rem 0; border: 1px solid #ddd; border-radius: .4rem; padding: .4rem .8rem; }}
+summary {{ cursor: pointer; }}
+</style>
+</head>
+<body>
+<h1>{content_title}</h1>
+<p class="caption"><em>{authors}</em></p>
+<p><strong>{callout}</strong></p>
+<nav>{nav}</nav>
+{body}
+{scripts}
+</body>
+</html>
+"""
+
+chart_script = """<script src="{plotly_bundle}"></script>
+<script>
+document.querySelectorAll('script[type="application/json"][data-chart]').forEach(function (data) {{
+  var figure = JSON.parse(data.textContent);
+  Plotly.newPlot(data.dataset.chart, figure.data, figure.layout, {{responsive: true, displayModeBar: false}});
+}});
+</script>"""
+
+
+def inline_markdown(text):
+    """Bold text and emoji shortcodes of a single line of markdown, inline html is kept"""
+    # a "<" that does not start a tag is text, e.g. "A1C <48"
+    text = re.sub(r'<(?![a-zA-Z/!])', '&lt;', text)
+    text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text)
+    for shortcode, emoji in emoji_shortcodes.items():
+        text = text.replace(shortcode, emoji)
+    return text
+
+
+def markdown_html(text):
+    """
+    Html of the markdown used in the app's texts: headings, paragraphs and nested bullet lists indented by two
+    spaces per level
+    """
+    parts = []
+    paragraph = []
+    open_lists = 0
+
+    def flush_paragraph():
+        if paragraph:
+            text = inline_markdown(' '.join(paragraph))
+            # inline html of block elements, e.g. the centred chart titles, is not put in a paragraph
+            parts.append(text if re.match(r'<(p|div|h[1-6]|ul|ol|table|details)\b', text) else f"<p>{text}</p>")
+            paragraph.clear()
+
+    def close_lists(depth):
+        nonlocal open_lists
+        while open_lists > depth:
+            parts.append("</li></ul>")
+            open_lists -= 1
+
+    for line in textwrap.dedent(text).strip('\n').splitlines():
+        stripped = line.strip()
+        heading = re.match(r'(#{1,6})\s+(.*)', stripped)
+        item = re.match(r'( *)- (.*)', line)
+        if not stripped or heading:
+            flush_paragraph()
+            close_lists(0)
+            if heading:
+                level = len(heading.group(1))
+                parts.append(f"<h{level}>{inline_markdown(heading.group(2))}</h{level}>")
+        elif item:
+            flush_paragraph()
+            depth = len(item.group(1)) // 2
+            if depth + 1 > open_lists:
+                parts.append("<ul>")
+                open_lists += 1
+            else:
+                close_lists(depth + 1)
+                parts.append("</li>")
+            parts.append(f"<li>{inline_markdown(item.group(2))}")
+        else:
+            close_lists(0)
+            paragraph.append(stripped)
+    flush_paragraph()
+    close_lists(0)
+    return "".join(parts)
+
+
+def decimate(df, max_points=lite_max_points):
+    """Averages the rows of a stats frame into max_points buckets of consecutive rows when it has more rows"""
+    if len(df) <= max_points:
+        return df
+    buckets = np.arange(len(df)) * max_points // len(df)
+    decimated = df.groupby(buckets).mean()
+    decimated.index = df.index[np.searchsorted(buckets, decimated.index)]
+    return decimated
+
+
+def compact_values(values, decimals):
+    """Rounded list of numbers, integral values as ints and NaN as None so the json stays short"""
+    array = np.asarray(values)
+    if array.dtype.kind not in 'iuf':
+        return array.tolist()
+    rounded = np.round(array.astype(np.float64), decimals).tolist()
+    return [None if value != value else int(value) if value.is_integer() else value for value in rounded]
+
+
+def figure_json(fig, decimals=lite_decimals):
+    """Plotly figure json without the default template and with rounded data arrays"""
+    for trace in fig.data:
+        for axis in ['x', 'y']:
+            if getattr(trace, axis, None) is not None:
+                trace[axis] = compact_values(trace[axis], decimals)
+    figure = fig.to_dict()
+    figure['layout'].pop('template', None)
+    # "</" would end the script element the json is embedded in
+    return json.dumps(figure, separators=(',', ':')).replace('</', '<\\/')
+
+
+class LitePage:
+    """Body of one lite page, numbering the charts it embeds"""
+
+    def __init__(self, decimals=lite_decimals, max_points=lite_max_points):
+        self.parts = []
+        self.charts = 0
+        self.decimals = decimals
+        self.max_points = max_points
+
+    def add(self, content):
+        self.parts.append(content)
+
+    def add_markdown(self, text):
+        self.add(markdown_html(text))
+
+    def add_metrics(self, metrics):
+        """metrics as (label, value, help) tuples"""
+        items = ""
+        for label, value, help_text in metrics:
+            title = f' title="{html.escape(help_text)}"' if help_text else ""
+            items += (f'<div class="metric"{title}><span class="label">{html.escape(label)}</span>'
+                      f'<span class="value">{value}</span></div>')
+        self.add(f'<div class="metrics">{items}</div>')
+
+    def add_table(self, header, rows):
+        head = "".join(f"<th>{cell}</th>" for cell in header)
+        body = "".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in rows)
+        self.add(f'<div class="table-wrap"><table><tr>{head}</tr>{body}</table></div>')
+
+    def add_stats_chart(self, dataset, fix_y):
+        df = decimate(store.get(dataset), self.max_points)
+        fig = plot_cluster_confidence_intervals_for_df(df, fix_y=fix_y)
+        self.charts += 1
+        chart_id = f"chart-{self.charts}"
+        self.add(f'<div class="chart" id="{chart_id}"></div>'
+                 f'<script type="application/json" data-chart="{chart_id}">{figure_json(fig, self.decimals)}</script>')
+
+    def add_app_elements(self, nodes, charts=()):
+        """
+        Adds the elements of a tab rendered by tab_app: texts, metrics, expanders, links and dataframes. Widgets,
+        rows of columns holding widgets and tabs are interactive and left out, every plotly chart is replaced by a
+        lite chart of the next (dataset, fix_y) of charts.
+        """
+        charts = iter(charts)
+        for node in nodes:
+            if isinstance(node, Widget):
+                continue
+            if isinstance(node, Block):
+                columns = list(node.children.values())
+                leaves = [leaf for column in columns for leaf in getattr(column, 'children', {}).values()]
+                if node.type == 'tab_container' or any(isinstance(leaf, Widget) for leaf in leaves):
+                    continue
+                if node.type == 'expander':
+                    self.add(f"<details><summary>{inline_markdown(html.escape(node.label))}</summary>")
+                    self.add_app_elements(node.children.values(), charts)
+                    self.add("</details>")
+                elif leaves and all(leaf.type == 'metric' for leaf in leaves):
+                    self.add_metrics([app_metric(leaf) for leaf in leaves])
+                else:
+                    self.add_app_elements(columns, charts)
+            elif node.type == 'markdown' and node.value.strip():
+                self.add_markdown(node.value)
+            elif node.type == 'caption':
+                self.add(f'<p class="caption">{inline_markdown(node.value)}</p>')
+            elif node.type in ('title', 'header', 'subheader'):
+                self.add(f"<h2>{inline_markdown(html.escape(node.value, quote=False))}</h2>")
+            elif node.type == 'metric':
+                self.add_metrics([app_metric(node)])
+            elif node.type == 'page_link':
+                self.add(f'<p><a href="{html.escape(node.proto.page)}">{node.proto.icon} '
+                         f'{html.escape(node.proto.label)}</a></p>')
+            elif node.type == 'arrow_data_frame':
+                self.add_table([html.escape(str(column)) for column in node.value.columns],
+                               [[html.escape(str(cell)) for cell in row] for row in node.value.itertuples(False)])
+            elif node.type == 'plotly_chart':
+                chart = next(charts, None)
+                if chart is not None:
+                    self.add_stats_chart(*chart)
+
+    def html(self):
+        return "\n".join(self.parts)
+
+
+def render_tab(module_name, function_name):
+    """Script of tab_app, imports inside so that AppTest can run it on its own"""
+    import importlib
+    getattr(importlib.import_module(module_name), function_name)()
+
+
+def tab_app(module_name, function_name):
+    """
+    A tab of the app rendered headless by streamlit's AppTest, so the lite pages show the tab's own texts. Its
+    elements are in app.main, widgets can be set and the tab run again.
+    """
+    app = AppTest.from_function(render_tab, args=(module_name, function_name), default_timeout=tab_timeout).run()
+    if app.exception:
+        raise RuntimeError(f"{module_name}.{function_name} failed: {app.exception[0].message}")
+    return app
+
+
+def app_metric(node):
+    """(label, value, help) of a metric of tab_app, the delta in small print after the value"""
+    value, delta = node.value, node.proto.delta
+    if delta:
+        value += f" <small>{'↓' if delta.startswith('-') else '↑'} {html.escape(delta)}</small>"
+    return node.label, value, node.proto.help
+
+
+def key_findings_page(page):
+    explorations = [None, pattern_frequency_section, associations_section, predictability_section]
+    for (finding, summary), explore in zip(main_findings.items(), explorations):
+        page.add(f"<h2>{html.escape(finding)}</h2>")
+        page.add_markdown(summary)
+        if explore is not None:
+            explore(page)
+
+
+def pattern_frequency_section(page):
+    frequency_df = store.get('pattern_frequency')
+    rows = []
+    for name, pattern_number in selectable_patterns.items():
+        for temporal_unit, timeframe in temporal_units.items():
+            selected = frequency_df[(frequency_df['pattern_number'] == pattern_number)
+                                    & (frequency_df['timeframe'] == timeframe)]
+            counts = [selected[selected['pattern_type'] == pattern_type]['mean'].iloc[0]
+                      for pattern_type in ['Expected', 'Unexpected']]
+            rows.append([inline_markdown(name.replace("...", "")), temporal_unit] + counts)
+    page.add('<p class="caption">How many of the 29 people had which expected pattern (patterns with known reasons) '
+             'and unexpected patterns (patterns with unknown reasons)</p>')
+    page.add_table(["Pattern", "Compared across", "People with Expected Patterns",
+                    "People with Unexpected Patterns"], rows)
+
+
+def associations_section(page):
+    for name, pattern_number in selectable_patterns.items():
+        for temporal_unit, timeframe in temporal_units.items():
+            title, body = associations_page(pattern_number, temporal_unit, timeframe)
+            page.add(f"<details><summary>{inline_markdown(name.replace('...', ''))} · {html.escape(temporal_unit)}"
+                     f"</summary>{body}</details>")
+
+
+def predictability_section(page):
+    rows = []
+    for lag_name, lag in available_lags().items():
+        for derivative_name, no_derivatives in derivatives.items():
+            all_predictable_ids, one_cluster_only_ids, both_clusters_ids = predictable_ids(lag, no_derivatives)
+            row = [lag_name, derivative_name, f"{people_string(len(all_predictable_ids))} of {len(tested_people())}"]
+            for col_name in predict_glucose_columns.keys():
+                row += [len(one_cluster_only_ids[col_name]), len(both_clusters_ids[col_name])]
+            rows.append(row)
+    header = ["Hours back", "Aspects of the data", "Predictable from Insulin or Carbs"]
+    for col_name in predict_glucose_columns.keys():
+        header += [f"{col_name}: some days", f"{col_name}: most days"]
+    page.add_table(header, rows)
+    page.add('<p class="caption">Note: Granger causality was used to determine forecastability</p>')
+
+
+def explore_patterns_page(page):
+    app = tab_app('explore_patterns', 'display_explore_patterns')
+    # the tab shows one pattern at a time, the lite page every pattern with a chart
+    pattern_keys = {name: key for key, name in patterns.items()}
+    for name in app.selectbox[0].options:
+        if pattern_keys.get(name) not in pattern_charts:
+            continue
+        app.selectbox[0].select(name).run()
+        page.add(f"<h2>{html.escape(name)}</h2>")
+        page.add_app_elements([node for node in app.main.children.values() if node.type == 'flex_container'],
+                              [pattern_charts[pattern_keys[name]]])
+    page.add_app_elements([node for node in app.main.children.values() if node.type != 'flex_container'])
+
+
+def individual_variations_page(page):
+    app = tab_app('inividual_variations', 'display_individual_variations')
+    page.add_app_elements(app.main.children.values(), [(dataset, 6) for dataset in individual_charts.values()])
+
+
+def why_this_matters_page(page):
+    page.add_app_elements(tab_app('why_this_matters', 'display_why_this_matters').main.children.values())
+
+
+def additional_information_page(page):
+    page.add_app_elements(tab_app('additional_information', 'display_additional_information').main.children.values())
+
+
+# key = tab title of the app, value = (file name, page function)
+lite_pages = {
+    key_findings: ('index.html', key_findings_page),
+    explore_patterns: ('explore-patterns.html', explore_patterns_page),
+    individual_variations: ('individual-variations.html', individual_variations_page),
+    why_this_matters: ('why-this-matters.html', why_this_matters_page),
+    additional_information: ('additional-information.html', additional_information_page),
+}
+
+
+def write_file(out_dir, file_name, content):
+    """Writes content and, for text files, a gzip -9 copy next to it. Returns (raw bytes, gzip bytes)"""
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    with open(os.path.join(out_dir, file_name), 'wb') as f:
+        f.write(data)
+    if not file_name.endswith(compressed_suffixes):
+        return len(data), None
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    with open(os.path.join(out_dir, file_name + '.gz'), 'wb') as f:
+        f.write(compressed)
+    return len(data), len(compressed)
+
+
+def headers_file(file_names):
+    """Cache rules in the _headers format of Netlify and Cloudflare Pages"""
+    rules = []
+    for file_name in file_names:
+        cache_control = page_cache_control if file_name.endswith('.html') else asset_cache_control
+        rules.append(f"/{file_name}\n  Cache-Control: {cache_control}\n")
+        if file_name == 'index.html':
+            rules.append(f"/\n  Cache-Control: {cache_control}\n")
+    return "".join(rules)
+
+
+def remove_previous_build(out_dir):
+    """
+    Removes the files of a previous lite build in out_dir as listed in its build marker. Raises ValueError when
+    out_dir is not empty and not a lite build.
+    """
+    marker = os.path.join(out_dir, build_marker)
+    if not os.path.isfile(marker):
+        if os.listdir(out_dir):
+            raise ValueError(f"{out_dir} is not empty and not a lite build, refusing to overwrite it")
+        return
+    with open(marker, encoding='utf-8') as f:
+        file_names = f.read().split()
+    for file_name in file_names + [build_marker]:
+        # the marker only names flat files of the build
+        path = os.path.join(out_dir, os.path.basename(file_name))
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def plotly_basic_js(version=None):
+    """
+    plotly.js basic bundle (scatter, bar and pie traces) of the installed plotly's plotly.js version, downloaded once
+    into .cache/plotly. Raises ValueError when it is not cached and cannot be downloaded.
+    """
+    version = version or get_plotlyjs_version()
+    path = os.path.join(plotly_cache_dir, f"plotly-basic-{version}.min.js")
+    if not os.path.exists(path):
+        url = plotly_basic_url.format(version=version)
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                plotly_js = response.read()
+        except OSError as e:
+            raise ValueError(f"Could not download {url} ({e}), save it as {path} or build with --full-plotly") from e
+        os.makedirs(plotly_cache_dir, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(plotly_js)
+        os.replace(path + '.tmp', path)
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def build_lite(out_dir=default_lite_dir, decimals=lite_decimals, max_points=lite_max_points, full_plotly=False):
+    """
+    Writes the lite site to out_dir, replacing a previous build there, returns {file name: (raw bytes, gzip bytes)}.
+    Charts use the plotly.js basic bundle unless full_plotly.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    remove_previous_build(out_dir)
+    sizes = {}
+
+    plotly_js = get_plotlyjs() if full_plotly else plotly_basic_js()
+    plotly_bundle = f"plotly-{hashlib.sha256(plotly_js.encode()).hexdigest()[:12]}.min.js"
+    sizes[plotly_bundle] = write_file(out_dir, plotly_bundle, plotly_js)
+
+    for title, (file_name, render) in lite_pages.items():
+        page = LitePage(decimals, max_points)
+        render(page)
+        nav = "".join(f'<a href="{other_file}"{" class=active" if other_file == file_name else ""}>'
+                      f'{html.escape(other_title)}</a>' for other_title, (other_file, _) in lite_pages.items())
+        scripts = chart_script.format(plotly_bundle=plotly_bundle) if page.charts else ""
+        sizes[file_name] = write_file(out_dir, file_name, page_template.format(
+            title=html.escape(title), content_title=html.escape(content_title), authors=html.escape(authors),
+            callout=html.escape(callout), nav=nav, body=page.html(), scripts=scripts))
+
+    with open(os.path.join(out_dir, '_headers'), 'w', encoding='utf-8') as f:
+        f.write(headers_file(sizes.keys()))
+    written = [name for file_name, (_, compressed) in sizes.items()
+               for name in ([file_name, file_name + '.gz'] if compressed else [file_name])] + ['_headers']
+    with open(os.path.join(out_dir, build_marker), 'w', encoding='utf-8') as f:
+        f.write("\n".join(written) + "\n")
+    return sizes
+
+
+class LiteRequestHandler(BaseHTTPRequestHandler):
+    """Serves the built lite site: precompressed files when the client accepts gzip, cache headers, ETags"""
+    protocol_version = "HTTP/1.1"  # keep-alive connections
+    disable_nagle_algorithm = True  # headers and body are written separately
+    lite_dir = default_lite_dir
+
+    def do_GET(self):
+        self.send_file(head_only=False)
+
+    def do_HEAD(self):
+        self.send_file(head_only=True)
+
+    def send_file(self, head_only):
+        file_name = self.path.split('?', 1)[0].lstrip('/') or 'index.html'
+        path = os.path.join(self.lite_dir, file_name)
+        extension = os.path.splitext(file_name)[1]
+        # only the flat files of the build are served, no directories or paths outside it
+        if '/' in file_name or '\\' in file_name or extension not in content_types or not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding', '')) and os.path.isfile(path + '.gz')
+        if use_gzip:
+            path += '.gz'
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        cache_control = page_cache_control if extension == '.html' else asset_cache_control
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_types[extension])
+        self.send_header('Content-Length', str(stat.st_size))
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if not head_only:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(lite_dir=default_lite_dir, host="127.0.0.1", port=default_port):
+    LiteRequestHandler.lite_dir = lite_dir
+    return ThreadingHTTPServer((host, port), LiteRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-rendered static lite version of every tab of the app for "
+                                                 "low-bandwidth mobile viewers.")
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build", help="render the lite site")
+    build_parser.add_argument("--out-dir", default=default_lite_dir)
+    build_parser.add_argument("--decimals", type=int, default=lite_decimals, help="decimals of chart values")
+    build_parser.add_argument("--max-points", type=int, default=lite_max_points,
+                              help="maximum points per chart line")
+    build_parser.add_argument("--full-plotly", action="store_true",
+                              help="embed the full plotly.js bundle instead of the basic one, needs no download")
+    serve_parser = subparsers.add_parser("serve", help="serve a built lite site with cache headers")
+    serve_parser.add_argument("--lite-dir", default=default_lite_dir)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=default_port)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = create_server(args.lite_dir, args.host, args.port)
+        print(f"Serving {args.lite_dir} on http://{args.host}:{args.port}")
+        server.serve_forever()
+    else:
+        out_dir = getattr(args, 'out_dir', default_lite_dir)
+        start = time.perf_counter()
+        try:
+            sizes = build_lite(out_dir, getattr(args, 'decimals', lite_decimals),
+                               getattr(args, 'max_points', lite_max_points), getattr(args, 'full_plotly', False))
+        except ValueError as e:
+            parser.error(str(e))
+        for file_name, (raw, compressed) in sizes.items():
+            print(f"{file_name:40} {raw / 1024:8.1f} KiB {compressed / 1024 if compressed else raw / 1024:8.1f} KiB "
+                  f"gzip")
+        print(f"Built {len(sizes)} files in {out_dir} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from data_store import store, stats, variates, clusters, hours, min_hours_per_day
+from day_distance import nearest_centroid, distances
+
+seconds_per_hour = 3600
+seconds_per_day = 24 * seconds_per_hour
+# key = unexpected pattern number (see key_findings.patterns_by_number), value = (stats dataset whose two clusters
+# are the centroids, cluster that shows the unexpected pattern)
+unexpected_pattern_clusters = {
+    1: ('iob_higher_cob_not_stats', '0'),  # more insulin while carbs are similar
+    2: ('night_high_2_stats', '1'),  # higher glucose during night
+    3: ('different_days_stats', '1'),  # more carbs without needing more insulin
+}
+
+Reading = namedtuple('Reading', ['timestamp', 'iob', 'cob', 'bg'])
+DayResult = namedtuple('DayResult', ['person_id', 'day', 'observed_hours', 'clusters', 'unexpected_patterns'])
+
+
+def load_centroids():
+    """Cluster means as array [pattern, cluster, hour, variate] in the order of unexpected_pattern_clusters"""
+    mean_idx = stats.index('mean')
+    centroids = [np.transpose(store.get(dataset + '_array')[:, mean_idx], (0, 2, 1))
+                 for dataset, _ in unexpected_pattern_clusters.values()]
+    return np.stack(centroids)
+
+
+class DayAccumulator:
+    """
+    Running hourly sums and counts of one person's readings for the current day. Adding a reading is O(1); when a
+    reading of a later day arrives the completed day's hourly means are returned and the accumulator is reset.
+    Readings are expected in the scaled units of the stats files and in time order, timestamps are UTC epoch seconds.
+    """
+
+    def __init__(self):
+        self.day = None
+        self.sums = np.zeros((len(hours), len(variates)))
+        self.counts = np.zeros(len(hours), dtype=np.int64)
+
+    def add(self, timestamp, iob, cob, bg):
+        day = int(timestamp // seconds_per_day)
+        completed = None
+        if day != self.day:
+            if self.day is not None:
+                completed = self.complete()
+            self.day = day
+        hour = int(timestamp % seconds_per_day // seconds_per_hour)
+        row = self.sums[hour]
+        row[0] += iob
+        row[1] += cob
+        row[2] += bg
+        self.counts[hour] += 1
+        return completed
+
+    def complete(self):
+        """Hourly means [hour, variate] of the current day, NaN for hours without readings, and resets"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sums / self.counts[:, None]
+        completed = (self.day, means)
+        self.sums = np.zeros_like(self.sums)
+        self.counts = np.zeros_like(self.counts)
+        return completed
+
+
+def assign_clusters(day_means, centroids, distance='euclidean'):
+    """Index of the nearest centroid per pattern, hours without readings are skipped"""
+    return [nearest_centroid(day_means[None], pattern_centroids, distance)[0][0] for pattern_centroids in centroids]
+
+
+def classify_day(person_id, day, day_means, centroids, distance='euclidean'):
+    observed_hours = int((~np.isnan(day_means[:, 0])).sum())
+    if observed_hours < min_hours_per_day:
+        return DayResult(person_id, day, observed_hours, {}, [])
+    nearest = assign_clusters(day_means, centroids, distance)
+    assigned = {pattern: clusters[idx] for pattern, idx in zip(unexpected_pattern_clusters.keys(), nearest)}
+    flagged = [pattern for pattern, (_, unexpected_cluster) in unexpected_pattern_clusters.items()
+               if assigned[pattern] == unexpected_cluster]
+    return DayResult(person_id, day, observed_hours, assigned, flagged)
+
+
+async def process_stream(person_id, readings, centroids, on_day, distance='euclidean'):
+    """Consumes an async iterable of Reading batches of one person and calls on_day for every completed day"""
+    accumulator = DayAccumulator()
+    n_readings = 0
+    async for batch in readings:
+        for reading in batch:
+            completed = accumulator.add(*reading)
+            if completed is not None:
+                on_day(classify_day(person_id, completed[0], completed[1], centroids, distance))
+        n_readings += len(batch)
+    if accumulator.day is not None:
+        day, day_means = accumulator.complete()
+        on_day(classify_day(person_id, day, day_means, centroids, distance))
+    return n_readings
+
+
+async def simulate_readings(seed, centroids, days, interval_minutes=5, start_day=20000, batch_minutes=60,
+                            delay=0.0):
+    """
+    Local stand-in for a live CGM/pump feed. Each simulated day follows a randomly chosen cluster centroid plus
+    noise; readings are yielded in batches of batch_minutes, sleeping delay seconds between batches.
+    """
+    rng = np.random.default_rng(seed)
+    readings_per_day = 24 * 60 // interval_minutes
+    per_batch = batch_minutes // interval_minutes
+    offsets = np.arange(readings_per_day) * interval_minutes * 60
+    reading_hours = offsets // seconds_per_hour
+    flat_centroids = centroids.reshape(-1, len(hours), len(variates))
+    for day in range(start_day, start_day + days):
+        profile = flat_centroids[rng.integers(len(flat_centroids))][reading_hours]
+        values = np.clip(profile + rng.normal(0, 0.3, profile.shape), 0, None)
+        timestamps = day * seconds_per_day + offsets
+        day_readings = [Reading(t, iob, cob, bg) for t, (iob, cob, bg) in zip(timestamps.tolist(), values.tolist())]
+        for start in range(0, readings_per_day, per_batch):
+            yield day_readings[start:start + per_batch]
+            await asyncio.sleep(delay)
+
+
+async def run_simulation(n_people, days, on_day, delay=0.0, distance='euclidean'):
+    """Streams simulated readings of n_people concurrently, returns the total number of readings processed"""
+    centroids = load_centroids()
+    tasks = [process_stream(person_id, simulate_readings(person_id, centroids, days, delay=delay), centroids, on_day,
+                            distance)
+             for person_id in range(n_people)]
+    return sum(await asyncio.gather(*tasks))
+
+
+def benchmark(n_people=500, days=7, distance='euclidean'):
+    results = []
+    start = time.perf_counter()
+    n_readings = asyncio.run(run_simulation(n_people, days, results.append, distance=distance))
+    seconds = time.perf_counter() - start
+    flagged = {pattern: sum(pattern in result.unexpected_patterns for result in results)
+               for pattern in unexpected_pattern_clusters.keys()}
+    return n_readings / seconds, len(results), flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online detection of unexpected patterns on live CGM streams.")
+    parser.add_argument("--distance", choices=list(distances.keys()), default='euclidean',
+                        help="distance used to assign days to the nearest cluster centroid")
+    subparsers = parser.add_subparsers(dest="command")
+    simulate_parser = subparsers.add_parser("simulate", help="print the day classifications of a simulated feed")
+    simulate_parser.add_argument("--people", type=int, default=3)
+    simulate_parser.add_argument("--days", type=int, default=3)
+    simulate_parser.add_argument("--delay", type=float, default=0.0,
+                                 help="seconds between hourly batches of readings")
+    benchmark_parser = subparsers.add_parser("benchmark", help="measure readings/second over many people")
+    benchmark_parser.add_argument("--people", type=int, default=500)
+    benchmark_parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        rate, n_days, flagged = benchmark(args.people, args.days, args.distance)
+        print(f"{rate:,.0f} readings/s, {n_days} days classified, unexpected pattern days: {flagged}")
+    else:
+        people = getattr(args, 'people', 3)
+        days = getattr(args, 'days', 3)
+        delay = getattr(args, 'delay', 0.0)
+        asyncio.run(run_simulation(people, days, print, delay=delay, distance=args.distance))
+
+
+if __name__ == "__main__":
+    main()
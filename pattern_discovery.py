@@ -0,0 +1,189 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from person_series import default_series_dir, person_ids, load_person, resample, series_variates
+
+candidates_file = os.path.join('data', 'pattern_candidates.csv')
+# the matrix profile is computed on means of this many minutes, this keeps years of 5 minute readings feasible
+default_resolution_minutes = 30
+default_window_hours = 4
+default_top_k = 5
+# trend of a variate within a subsequence relative to the person's standard deviation of that variate
+trend_threshold = 0.25
+# std below which a subsequence is treated as flat
+flat_std = 1e-8
+# key = first hour, value = part of day
+times_of_day = {0: 'Night', 6: 'Morning', 12: 'Afternoon', 18: 'Evening'}
+candidate_columns = ['kind', 'time_of_day', 'iob', 'cob', 'bg', 'people', 'occurrences', 'mean_distance',
+                     'resembles']
+
+
+def sliding_dot_product(query, series):
+    """Dot products of query with every subsequence of series, via FFT in O(n log n)"""
+    m, n = len(query), len(series)
+    size = 1 << int(np.ceil(np.log2(n + m)))
+    product = np.fft.irfft(np.fft.rfft(series, size) * np.fft.rfft(query[::-1], size), size)
+    return product[m - 1:n]
+
+
+def rolling_mean_std(series, m):
+    """Mean and std of every subsequence of length m, series [reading, variate]"""
+    cumsum = np.vstack([np.zeros(series.shape[1]), np.cumsum(series, axis=0)])
+    cumsum_sq = np.vstack([np.zeros(series.shape[1]), np.cumsum(series ** 2, axis=0)])
+    mean = (cumsum[m:] - cumsum[:-m]) / m
+    var = (cumsum_sq[m:] - cumsum_sq[:-m]) / m - mean ** 2
+    return mean, np.sqrt(np.clip(var, 0, None))
+
+
+def matrix_profile(series, m):
+    """
+    Multivariate matrix profile (STOMP) of series [reading, variate]: for every subsequence of length m the mean over
+    the variates of the z-normalised euclidean distance to its nearest non-trivial neighbour, and that neighbour's
+    index. The first row of dot products comes from an FFT, every further row is an O(n) vectorised update.
+    Subsequences containing NaN readings get an infinite profile and are never neighbours.
+    """
+    n, n_variates = series.shape
+    length = n - m + 1
+    if length < 2:
+        return np.full(max(length, 0), np.inf), np.zeros(max(length, 0), dtype=np.int64)
+    missing = np.isnan(series).any(axis=1)
+    valid = np.convolve(missing, np.ones(m), mode='valid') == 0
+    filled = np.nan_to_num(series).astype(np.float64)
+    mean, std = rolling_mean_std(filled, m)
+    flat = std < flat_std
+    safe_std = np.where(flat, 1.0, std)
+    exclusion = max(1, m // 2)
+
+    first_row = np.stack([sliding_dot_product(filled[:m, v], filled[:, v]) for v in range(n_variates)])
+    qt = first_row.copy()
+    profile = np.full(length, np.inf)
+    index = np.zeros(length, dtype=np.int64)
+    for i in range(length):
+        if i > 0:
+            qt[:, 1:] = (qt[:, :-1] - filled[i - 1][:, None] * filled[:length - 1].T
+                         + filled[i + m - 1][:, None] * filled[m:m + length - 1].T)
+            qt[:, 0] = first_row[:, i]
+        if not valid[i]:
+            continue
+        corr = (qt - m * mean[i][:, None] * mean.T) / (m * safe_std[i][:, None] * safe_std.T)
+        # two flat subsequences have the same shape, a flat and a varying one are uncorrelated
+        corr = np.where(flat[i][:, None] & flat.T, 1.0, np.where(flat[i][:, None] | flat.T, 0.0, corr))
+        distance = np.sqrt(np.clip(2 * m * (1 - corr), 0, None)).mean(axis=0)
+        distance[max(0, i - exclusion):i + exclusion + 1] = np.inf
+        distance[~valid] = np.inf
+        nearest = int(distance.argmin())
+        profile[i] = distance[nearest]
+        index[i] = nearest
+    return profile, index
+
+
+def top_k(profile, m, k, largest=False):
+    """Indexes of the k smallest (motifs) or largest (discords) finite profile values, skipping trivial matches"""
+    values = np.where(np.isfinite(profile), profile, np.nan)
+    values = -values if largest else values.copy()
+    found = []
+    while len(found) < k and not np.isnan(values).all():
+        i = int(np.nanargmin(values))
+        found.append(i)
+        values[max(0, i - m):i + m] = np.nan
+    return found
+
+
+def trend(segment, scale):
+    change = np.nanmean(segment[-max(1, len(segment) // 3):]) - np.nanmean(segment[:max(1, len(segment) // 3)])
+    if change > trend_threshold * scale:
+        return '↑'
+    if change < -trend_threshold * scale:
+        return '↓'
+    return '→'
+
+
+def time_of_day(timestamp):
+    hour = int(timestamp % 86400 // 3600)
+    return times_of_day[max(start for start in times_of_day.keys() if start <= hour)]
+
+
+def resembles(iob, cob, bg):
+    """Unexpected patterns (see key_findings.patterns_by_number) a signature looks like"""
+    matches = []
+    if iob == '↑' and cob != '↑':
+        matches.append('1')  # more insulin not due to more carbs
+    if bg == '↑' and cob != '↑':
+        matches.append('2')  # higher glucose not due to more carbs
+    if cob == '↑' and iob != '↑':
+        matches.append('3')  # more carbs without more insulin
+    return ','.join(matches)
+
+
+def discover_person(series_dir, person_id, resolution_minutes=default_resolution_minutes,
+                    window_hours=default_window_hours, k=default_top_k):
+    """Motifs and discords of one person as a list of records with their signature"""
+    timestamps, values = load_person(series_dir, person_id)
+    bin_timestamps, binned = resample(timestamps, values, resolution_minutes)
+    m = window_hours * 60 // resolution_minutes
+    profile, index = matrix_profile(binned, m)
+    scale = np.nanstd(binned, axis=0)
+    records = []
+    for kind, starts in [('motif', top_k(profile, m, k)), ('discord', top_k(profile, m, k, largest=True))]:
+        for start in starts:
+            segment = binned[start:start + m]
+            signature = {variate: trend(segment[:, v], scale[v]) for v, variate in enumerate(series_variates)}
+            records.append({'person_id': person_id, 'kind': kind, 'start': int(bin_timestamps[start]),
+                            'neighbour': int(bin_timestamps[index[start]]), 'distance': float(profile[start]),
+                            'time_of_day': time_of_day(bin_timestamps[start]), **signature})
+    return records
+
+
+def rank_candidates(records):
+    """Groups motifs and discords of all people by signature, ranked by the number of people showing them"""
+    df = pd.DataFrame(records)
+    if df.empty:
+        return pd.DataFrame(columns=candidate_columns)
+    candidates = (df.groupby(['kind', 'time_of_day', 'iob', 'cob', 'bg'])
+                  .agg(people=('person_id', 'nunique'), occurrences=('person_id', 'size'),
+                       mean_distance=('distance', 'mean'))
+                  .reset_index())
+    candidates['mean_distance'] = candidates['mean_distance'].round(2)
+    candidates['resembles'] = [resembles(*row) for row in candidates[['iob', 'cob', 'bg']].itertuples(index=False)]
+    return candidates.sort_values(['kind', 'people', 'occurrences'], ascending=[False, False, False])[
+        candidate_columns].reset_index(drop=True)
+
+
+def discover(series_dir=default_series_dir, workers=None, **discover_args):
+    """Runs the discovery for every person in parallel worker processes and ranks the candidates"""
+    ids = person_ids(series_dir)
+    workers = workers or os.cpu_count() or 1
+    records = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(discover_person, series_dir, person_id, **discover_args) for person_id in ids]
+        for future in futures:
+            records.extend(future.result())
+    return rank_candidates(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discover recurring motifs and anomalous discords in every "
+                                                 "person's IOB/COB/BG series with a multivariate matrix profile.")
+    parser.add_argument("--series-dir", default=default_series_dir)
+    parser.add_argument("--out", default=candidates_file)
+    parser.add_argument("--resolution", type=int, default=default_resolution_minutes, help="minutes per bin")
+    parser.add_argument("--window", type=int, default=default_window_hours, help="pattern length in hours")
+    parser.add_argument("--top-k", type=int, default=default_top_k, help="motifs and discords per person")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    candidates = discover(args.series_dir, args.workers, resolution_minutes=args.resolution,
+                          window_hours=args.window, k=args.top_k)
+    candidates.to_csv(args.out)
+    print(f"Wrote {len(candidates)} candidate patterns of {len(person_ids(args.series_dir))} people to {args.out} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+# per person raw series are stored as <series_dir>/<person id>/<name>.npy and opened memory-mapped so that years of
+# 5 minute readings of many people are only paged in when used
+default_series_dir = 'series'
+timestamps_file = 'timestamps'  # int64 UTC epoch seconds [reading]
+values_file = 'values'  # float [reading, variate]
+day_clusters_file = 'day_clusters'  # int64 [day, (UTC day number since epoch, cluster index)]
+series_variates = ['iob', 'cob', 'bg']
+
+
+def person_dir(series_dir, person_id):
+    return os.path.join(series_dir, str(person_id))
+
+
+def person_ids(series_dir=default_series_dir):
+    """Ids of all people with series in series_dir, numeric ids sorted numerically"""
+    if not os.path.isdir(series_dir):
+        return []
+    ids = [name for name in os.listdir(series_dir)
+           if os.path.isfile(os.path.join(series_dir, name, values_file + '.npy'))]
+    return sorted(ids, key=lambda name: (not name.isdigit(), int(name) if name.isdigit() else 0, name))
+
+
+def save_array(series_dir, person_id, name, array):
+    os.makedirs(person_dir(series_dir, person_id), exist_ok=True)
+    np.save(os.path.join(person_dir(series_dir, person_id), name + '.npy'), array)
+
+
+def load_array(series_dir, person_id, name):
+    return np.load(os.path.join(person_dir(series_dir, person_id), name + '.npy'), mmap_mode='r')
+
+
+def has_array(series_dir, person_id, name):
+    return os.path.isfile(os.path.join(person_dir(series_dir, person_id), name + '.npy'))
+
+
+def save_person(series_dir, person_id, timestamps, values):
+    """Writes one person's readings: timestamps [reading] and values [reading, variate] ordered as series_variates"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values)
+    if values.shape != (len(timestamps), len(series_variates)):
+        raise ValueError(f"Expected values of shape {(len(timestamps), len(series_variates))} but got {values.shape}")
+    save_array(series_dir, person_id, timestamps_file, timestamps)
+    save_array(series_dir, person_id, values_file, values)
+
+
+def load_person(series_dir, person_id):
+    """Memory-mapped (timestamps, values) of one person"""
+    return load_array(series_dir, person_id, timestamps_file), load_array(series_dir, person_id, values_file)
+
+
+def save_day_clusters(series_dir, person_id, day_numbers, labels):
+    """Writes the cluster index of each of a person's days, days are UTC day numbers as from daily_profiles"""
+    save_array(series_dir, person_id, day_clusters_file,
+               np.column_stack([np.asarray(day_numbers, dtype=np.int64), np.asarray(labels, dtype=np.int64)]))
+
+
+def load_day_clusters(series_dir, person_id):
+    """(day numbers, cluster labels) of one person or None when the days were not clustered"""
+    if not has_array(series_dir, person_id, day_clusters_file):
+        return None
+    day_clusters = load_array(series_dir, person_id, day_clusters_file)
+    return day_clusters[:, 0], day_clusters[:, 1]
+
+
+def resample(timestamps, values, resolution_minutes):
+    """
+    Means of the readings in regular bins of resolution_minutes starting at the first reading, bins without readings
+    are NaN. Returns (bin start timestamps, binned values).
+    """
+    bin_seconds = resolution_minutes * 60
+    start = timestamps[0] - timestamps[0] % bin_seconds
+    bins = (np.asarray(timestamps) - start) // bin_seconds
+    n_bins = int(bins[-1]) + 1
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    sums = np.stack([np.bincount(bins, weights=np.where(valid[:, v], values[:, v], 0), minlength=n_bins)
+                     for v in range(values.shape[1])], axis=1)
+    counts = np.stack([np.bincount(bins, weights=valid[:, v], minlength=n_bins)
+                       for v in range(values.shape[1])], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        binned = sums / counts
+    return start + np.arange(n_bins) * bin_seconds, binned
+
+
+def daily_profiles(timestamps, values):
+    """
+    Hourly means of every UTC day with readings. Returns (day numbers since epoch, profiles [day, hour, variate]),
+    hours without readings are NaN.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    day_numbers, day_idx = np.unique(timestamps // 86400, return_inverse=True)
+    cells = day_idx * 24 + timestamps % 86400 // 3600
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    n_cells = len(day_numbers) * 24
+    sums = np.stack([np.bincount(cells, weights=np.where(valid[:, v], values[:, v], 0), minlength=n_cells)
+                     for v in range(values.shape[1])], axis=1)
+    counts = np.stack([np.bincount(cells, weights=valid[:, v], minlength=n_cells)
+                       for v in range(values.shape[1])], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profiles = sums / counts
+    return day_numbers, profiles.reshape(len(day_numbers), 24, values.shape[1])
@@ -1,11 +1,20 @@
+import gzip
+
+import numpy as np
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import streamlit as st
 
 from constants import variate_colours, cluster_colours
+from data_store import store, stats_datasets
+from theme import chart_template, variate_fills, cluster_fills
 
 daily_ts_graph_description_text = "The graphs shows daily time series of scaled, hourly mean readings and 95% confidence intervals for " \
                                   "insulin, carbohydrates and blood glucose seperated into two clusters based on euclidian distance."
+chart_types = ["Cluster-based", "Variate-based"]
+# chart values are rounded to this many decimals and sent as base64 float32 typed arrays
+chart_decimals = 2
+chart_dtype = np.float32
 
 
 def colored_text(text, color_key):
@@ -20,7 +29,7 @@ def select_chart_type(key: str):
     with col_radio:
         graph_layout = st.radio(
             "Select visualisation type",
-            ["Cluster-based", "Variate-based"],
+            chart_types,
             index=0,
             horizontal=True,
             key=key,
@@ -30,14 +39,76 @@ def select_chart_type(key: str):
 
 
 def plot_cluster_confidence_intervals_for_df(df, fix_y=0, plot_type="Cluster-based"):
-    # Get counts for each cluster from the data
-    df = df.round(2)
     if plot_type == "Cluster-based":
         return display_clusters_separately(df, fix_y=fix_y)
     else:
         return display_variates_separately(df, fix_y)
 
 
+def chart_values(df, column):
+    """Column of a stats frame as a precision trimmed float32 array"""
+    return np.round(df[column].to_numpy(dtype=np.float64), chart_decimals).astype(chart_dtype)
+
+
+def hour_axis(df):
+    """
+    x of all traces of a stats frame: x0 and dx for regularly spaced hours so no x array is sent at all, otherwise
+    one array shared by every trace. Hours 0, 1, 2, ... are plotly's defaults and need no attributes.
+    """
+    x_data = df.index.to_numpy()
+    steps = np.diff(x_data)
+    if len(x_data) < 2 or not np.allclose(steps, steps[0]):
+        return dict(x=x_data)
+    x = {}
+    if x_data[0] != 0:
+        x['x0'] = x_data[0].item()
+    if steps[0] != 1:
+        x['dx'] = steps[0].item()
+    return x
+
+
+def add_interval_traces(fig, df, cluster, base_col, name, color, fill, showlegend, row):
+    """
+    Confidence interval as a filled band between a lower and an upper line plus the mean line. The band fills to
+    the previous trace instead of drawing a closed polygon, so no reversed copy of x and the bounds is needed.
+    """
+    x = hour_axis(df)
+    # the bounds only carry what is needed to draw the band, every attribute is repeated in the payload per trace
+    band = dict(mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip')
+    fig.add_trace(go.Scatter(**x, y=chart_values(df, (cluster, 'ci96_lo', base_col)), **band), row=row, col=1)
+    fig.add_trace(
+        go.Scatter(
+            name=f'{name} CI',
+            **x,
+            y=chart_values(df, (cluster, 'ci96_hi', base_col)),
+            fill='tonexty',
+            fillcolor=fill,
+            **band,
+        ),
+        row=row, col=1
+    )
+
+    # Add mean line
+    fig.add_trace(
+        go.Scatter(
+            name=name,
+            **x,
+            y=chart_values(df, (cluster, 'mean', base_col)),
+            mode='lines+markers',
+            line=dict(color=color, width=2),
+            marker=dict(size=6),
+            showlegend=showlegend,
+        ),
+        row=row, col=1
+    )
+
+
+def figure_bytes(fig):
+    """Bytes of the figure json sent to the browser, raw and gzip compressed"""
+    payload = fig.to_json().encode('utf-8')
+    return len(payload), len(gzip.compress(payload))
+
+
 def display_clusters_separately(df, fix_y):
     cluster_counts = {
         0: df[('0', 'count', 'xtrain iob mean')].iloc[0],
@@ -64,42 +135,11 @@ def display_clusters_separately(df, fix_y):
 
         for metric_key, metric_name in metric_names.items():
             base_col = f'xtrain {metric_key} mean'
-            color = colors[metric_key]
-
-            # Add confidence interval as a filled area
-            x_data = df.index.tolist()
-            ci_hi = df[(str(cluster_idx), 'ci96_hi', base_col)]
-            ci_lo = df[(str(cluster_idx), 'ci96_lo', base_col)]
-
-            fig.add_trace(
-                go.Scatter(
-                    name=f'{metric_name} CI',
-                    x=x_data + x_data[::-1],
-                    y=ci_hi.tolist() + ci_lo.tolist()[::-1],
-                    fill='toself',
-                    fillcolor=f'rgba{tuple(list(int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)) + [0.2])}',
-                    line=dict(color='rgba(255,255,255,0)'),
-                    showlegend=False,
-                    hoverinfo='skip',
-                ),
-                row=row, col=1
-            )
-
-            # Add mean line
-            fig.add_trace(
-                go.Scatter(
-                    name=metric_name,
-                    x=x_data,
-                    y=df[(str(cluster_idx), 'mean', base_col)],
-                    mode='lines+markers',
-                    line=dict(color=color, width=2),
-                    marker=dict(size=6),
-                    showlegend=False if cluster_idx == 1 else True,
-                ),
-                row=row, col=1
-            )
+            add_interval_traces(fig, df, str(cluster_idx), base_col, metric_name, colors[metric_key],
+                                variate_fills[metric_key], showlegend=False if cluster_idx == 1 else True, row=row)
     # Update layout
     fig.update_layout(
+        template=chart_template,
         height=500,
         showlegend=True,
         legend=dict(
@@ -119,6 +159,7 @@ def display_clusters_separately(df, fix_y):
             title_text=title,
             title_font=dict(color=title_color),
             range=[0, fix_y] if fix_y > 0 else None,
+            hoverformat=f'.{chart_decimals}f',
             row=i,
             col=1)
         fig.update_xaxes(
@@ -156,42 +197,11 @@ def display_variates_separately(df, fix_y):
 
         for cluster_key, cluster_name in cluster_names.items():
             base_col = f'xtrain {metric_key} mean'
-            color = colors[cluster_key]
-
-            # Add confidence interval as a filled area
-            x_data = df.index.tolist()
-            ci_hi = df[(str(cluster_key), 'ci96_hi', base_col)]
-            ci_lo = df[(str(cluster_key), 'ci96_lo', base_col)]
-
-            fig.add_trace(
-                go.Scatter(
-                    name=f'{cluster_name} CI',
-                    x=x_data + x_data[::-1],
-                    y=ci_hi.tolist() + ci_lo.tolist()[::-1],
-                    fill='toself',
-                    fillcolor=f'rgba{tuple(list(int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)) + [0.2])}',
-                    line=dict(color='rgba(255,255,255,0)'),
-                    showlegend=False,
-                    hoverinfo='skip',
-                ),
-                row=row, col=1
-            )
-
-            # Add mean line
-            fig.add_trace(
-                go.Scatter(
-                    name=cluster_name,
-                    x=x_data,
-                    y=df[(str(cluster_key), 'mean', base_col)],
-                    mode='lines+markers',
-                    line=dict(color=color, width=2),
-                    marker=dict(size=6),
-                    showlegend=True if i == 1 else False,
-                ),
-                row=row, col=1
-            )
+            add_interval_traces(fig, df, str(cluster_key), base_col, cluster_name, colors[cluster_key],
+                                cluster_fills[cluster_key], showlegend=True if i == 1 else False, row=row)
     # Update layout
     fig.update_layout(
+        template=chart_template,
         height=500,
         showlegend=True,
         legend=dict(
@@ -210,6 +220,7 @@ def display_variates_separately(df, fix_y):
             title_text=metric_name,
             title_font=dict(color=title_color),
             range=[0, fix_y] if fix_y > 0 else None,
+            hoverformat=f'.{chart_decimals}f',
             row=i,
             col=1)
         fig.update_xaxes(
@@ -219,3 +230,17 @@ def display_variates_separately(df, fix_y):
             row=i, col=1
         )
     return fig
+
+
+def main():
+    """Prints the bytes sent per chart of every stats dataset"""
+    print(f"{'dataset':28} {'chart':14} {'json bytes':>10} {'gzip bytes':>10}")
+    for dataset in stats_datasets:
+        for plot_type in chart_types:
+            raw, compressed = figure_bytes(plot_cluster_confidence_intervals_for_df(store.get(dataset), fix_y=7,
+                                                                                    plot_type=plot_type))
+            print(f"{dataset:28} {plot_type:14} {raw:10} {compressed:10}")
+
+
+if __name__ == "__main__":
+    main()
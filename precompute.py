@@ -0,0 +1,361 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+
+from bootstrap_ci import ci_methods, stats_frame
+from cluster_stats import person_sufficient_stats, stats_frame_from_sufficient_stats
+from data_store import data_dir, dataset_files, optional_dataset_files, optional_array_files, derivative_orders, \
+    hours, variates, sufficient_stats, pattern_numbers, pattern_types, timeframes, demographic_factors
+from day_clustering import cluster_all
+from feature_store import build_all, load_features, feature_days_file, feature_file
+from granger_cache import update_table
+from pattern_discovery import discover
+from person_series import default_series_dir, person_ids, person_dir, load_day_clusters, timestamps_file, \
+    values_file, day_clusters_file
+from temporal_cube import build_cube, save_cube
+
+manifest_file = os.path.join('.cache', 'precompute', 'manifest.json')
+# built files go here unless the pipeline is explicitly allowed to overwrite the shipped files in data_dir
+build_dir = os.path.join('.cache', 'precompute', 'data')
+# raw per person inputs, read from the config's data dir, every other dataset is built into its out dir
+raw_datasets = ['person_demographics', 'person_pattern_frequency']
+# key = stats dataset, value = unexpected pattern number (see live_stream.unexpected_pattern_clusters) of the people
+# whose clustered days make up its cluster stats, None for every person. flatline_stats and different_days_stats are
+# not rebuilt, they back the single person charts of the Individual Variations tab and which person they show is not
+# recorded.
+stats_dataset_people = {
+    'meal_rise_stats': None,
+    'night_high_1_stats': 2,
+    'night_high_2_stats': 2,
+    'iob_higher_cob_not_stats': 1,
+}
+rebuilt_stats_datasets = list(stats_dataset_people.keys())
+# timeframe of the per person pattern flags that select the people of a stats dataset
+selection_timeframe = 'Clusters'
+
+Config = namedtuple('Config', ['series_dir', 'data_dir', 'out_dir', 'lags', 'ci_method'], defaults=['normal'])
+Stage = namedtuple('Stage', ['depends', 'inputs', 'outputs', 'build'])
+
+
+def data_file(config, name):
+    """Path of a dataset, raw datasets in the config's data dir and built ones in its out dir"""
+    files = {**dataset_files, **optional_dataset_files}
+    directory = config.data_dir if name in raw_datasets else config.out_dir
+    return os.path.join(directory, files[name][0] if name in files else optional_array_files[name])
+
+
+def series_files(config, names):
+    return [os.path.join(person_dir(config.series_dir, person_id), name + '.npy')
+            for person_id in person_ids(config.series_dir) for name in names]
+
+
+def feature_names():
+    return [feature_days_file] + [feature_file(n) for n in derivative_orders]
+
+
+def build_features(config, workers):
+    build_all(config.series_dir, workers)
+
+
+def build_day_clusters(config, workers):
+    cluster_all(config.series_dir, workers=workers)
+
+
+def build_granger(config, workers):
+    update_table(config.series_dir, config.lags, derivative_orders, data_file(config, 'granger_causality'), workers,
+                 study_file=None)
+
+
+def build_temporal_cube(config, workers):
+    save_cube(build_cube(config.series_dir, workers), os.path.join(config.out_dir, 'temporal_cube.npz'))
+
+
+def build_pattern_candidates(config, workers):
+    discover(config.series_dir, workers).to_csv(data_file(config, 'pattern_candidates'))
+
+
+def clustered_days(series_dir, person_id):
+    """Hourly day profiles [day, hour, variate] of one person and their cluster labels [day], -1 for unclustered days"""
+    day_numbers, profiles = load_features(series_dir, person_id, 0)
+    day_clusters = load_day_clusters(series_dir, person_id)
+    labels = np.full(len(day_numbers), -1)
+    if day_clusters is not None:
+        labels = (pd.Series(np.asarray(day_clusters[1]), index=np.asarray(day_clusters[0]))
+                  .reindex(np.asarray(day_numbers)).fillna(-1).to_numpy(dtype=np.int64))
+    return np.asarray(profiles), labels
+
+
+def person_sufficient_stats_of(series_dir, person_id, datasets):
+    """Sufficient stats {dataset: {stat: [cluster, hour, variate]}} of one person's clustered days for datasets"""
+    person_stats = person_sufficient_stats(*clustered_days(series_dir, person_id))
+    return {dataset: person_stats if dataset in datasets else {stat: np.zeros_like(values)
+                                                               for stat, values in person_stats.items()}
+            for dataset in rebuilt_stats_datasets}
+
+
+def pattern_people(config):
+    """{unexpected pattern number: set of ids of the people with the pattern}"""
+    frequency_df = pd.read_csv(data_file(config, 'person_pattern_frequency'))
+    flagged = frequency_df[(frequency_df['pattern_type'] == 'Unexpected')
+                           & (frequency_df['timeframe'] == selection_timeframe) & (frequency_df['has_pattern'] == 1)]
+    return {number: set(flagged.loc[flagged['pattern_number'] == number, 'id'].astype(str))
+            for number in pattern_numbers}
+
+
+def dataset_person_ids(config):
+    """{stats dataset: ids of the people whose clustered days make up its cluster stats}"""
+    ids = person_ids(config.series_dir)
+    people = pattern_people(config)
+    return {dataset: [person_id for person_id in ids if number is None or person_id in people[number]]
+            for dataset, number in stats_dataset_people.items()}
+
+
+def build_sufficient_stats(config, workers):
+    ids = person_ids(config.series_dir)
+    dataset_people = dataset_person_ids(config)
+    datasets = [[dataset for dataset in rebuilt_stats_datasets if person_id in dataset_people[dataset]]
+                for person_id in ids]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        per_person = list(executor.map(person_sufficient_stats_of, [config.series_dir] * len(ids), ids, datasets))
+    arrays = {'ids': np.array([int(person_id) for person_id in ids])}
+    for dataset in rebuilt_stats_datasets:
+        for stat in sufficient_stats:
+            arrays[f'{dataset}/{stat}'] = np.stack([person[dataset][stat] for person in per_person])
+    np.savez_compressed(data_file(config, 'person_sufficient_stats'), **arrays)
+
+
+def build_cluster_stats(config, workers):
+    """
+    Normal intervals come from the summed per person sufficient statistics, bootstrap intervals (see bootstrap_ci)
+    from the clustered days of the dataset's people
+    """
+    if config.ci_method == 'normal':
+        with np.load(data_file(config, 'person_sufficient_stats')) as arrays:
+            for dataset in rebuilt_stats_datasets:
+                stats_frame_from_sufficient_stats(*(arrays[f'{dataset}/{stat}'].sum(axis=0)
+                                                    for stat in sufficient_stats)).to_csv(data_file(config, dataset))
+        return
+    for dataset, ids in dataset_person_ids(config).items():
+        people = [clustered_days(config.series_dir, person_id) for person_id in ids]
+        days = np.concatenate([days for days, _ in people]) if people else np.empty((0, len(hours), len(variates)))
+        labels = np.concatenate([labels for _, labels in people]) if people else np.empty(0, dtype=np.int64)
+        stats_frame(days, labels, config.ci_method, workers=workers).to_csv(data_file(config, dataset))
+
+
+def pattern_keys():
+    """Every (pattern number, pattern type, timeframe), combinations without per person rows count no people"""
+    return pd.MultiIndex.from_product([pattern_numbers, pattern_types, timeframes],
+                                      names=['pattern_number', 'pattern_type', 'timeframe'])
+
+
+def build_pattern_frequency(config, workers):
+    frequency_df = pd.read_csv(data_file(config, 'person_pattern_frequency'))
+    people = frequency_df.groupby(['pattern_number', 'pattern_type', 'timeframe'])['has_pattern'].sum()
+    people.reindex(pattern_keys(), fill_value=0).rename('mean').reset_index().to_csv(
+        data_file(config, 'pattern_frequency'))
+
+
+def kendall_tau_b(x, y):
+    """
+    Kendall's tau-b of values x and binary flags y [person] in O(n log n), people with missing x are left out. 0 when
+    x or y do not vary.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y).astype(bool)
+    keep = ~np.isnan(x)
+    x, y = x[keep], y[keep]
+    x_without, x_with = np.sort(x[~y]), x[y]
+    # concordant minus discordant pairs, only pairs of one person with and one without the flag are not tied in y
+    score = (np.searchsorted(x_without, x_with, 'left')
+             - (len(x_without) - np.searchsorted(x_without, x_with, 'right'))).sum()
+    pairs = len(x) * (len(x) - 1) / 2
+    _, tie_counts = np.unique(x, return_counts=True)
+    x_ties = (tie_counts * (tie_counts - 1) / 2).sum()
+    y_ties = len(x_with) * (len(x_with) - 1) / 2 + len(x_without) * (len(x_without) - 1) / 2
+    denominator = np.sqrt((pairs - x_ties) * (pairs - y_ties))
+    return float(score / denominator) if denominator > 0 else 0.0
+
+
+def build_demographic_associations(config, workers):
+    frequency_df = pd.read_csv(data_file(config, 'person_pattern_frequency'))
+    demographics_df = pd.read_csv(data_file(config, 'person_demographics')).set_index('id')
+    flags = frequency_df.set_index(['pattern_number', 'pattern_type', 'timeframe', 'id'])['has_pattern'].sort_index()
+    rows = []
+    for pattern_number, pattern_type, timeframe in pattern_keys():
+        row = {'timeframe': timeframe, 'pattern_type': pattern_type, 'pattern_number': pattern_number}
+        if (pattern_number, pattern_type, timeframe) in flags.index:
+            has_pattern = flags.loc[(pattern_number, pattern_type, timeframe)]
+            people = demographics_df.reindex(has_pattern.index)
+            for factor in demographic_factors.values():
+                row[factor] = round(kendall_tau_b(people[factor], has_pattern), 2)
+        else:
+            row.update({factor: 0.0 for factor in demographic_factors.values()})
+        rows.append(row)
+    pd.DataFrame(rows).to_csv(data_file(config, 'pattern_associations'), index=False)
+
+
+# key = stage name, value = Stage(stages it needs first, function of the config to its input files, function of the
+# config to its output files, function of (config, workers) building the outputs). Stages are listed in dependency
+# order; inputs that are outputs of other stages must list those stages in depends.
+stages = {
+    'features': Stage([], lambda config: series_files(config, [timestamps_file, values_file]),
+                      lambda config: series_files(config, feature_names()), build_features),
+    'day_clusters': Stage(['features'], lambda config: series_files(config, feature_names()[:2]),
+                          lambda config: series_files(config, [day_clusters_file]), build_day_clusters),
+    'pattern_candidates': Stage([], lambda config: series_files(config, [timestamps_file, values_file]),
+                                lambda config: [data_file(config, 'pattern_candidates')], build_pattern_candidates),
+    'granger': Stage(['day_clusters'], lambda config: series_files(config, feature_names() + [day_clusters_file]),
+                     lambda config: [data_file(config, 'granger_causality')], build_granger),
+    'temporal_cube': Stage(['day_clusters'],
+                           lambda config: series_files(config, feature_names()[:2] + [day_clusters_file]),
+                           lambda config: [os.path.join(config.out_dir, 'temporal_cube.npz')],
+                           build_temporal_cube),
+    'sufficient_stats': Stage(['day_clusters'],
+                              lambda config: (series_files(config, feature_names()[:2] + [day_clusters_file])
+                                              + [data_file(config, 'person_pattern_frequency')]),
+                              lambda config: [data_file(config, 'person_sufficient_stats')], build_sufficient_stats),
+    # the sufficient stats are rewritten whenever the clustered days or pattern flags change, so they also stand in
+    # for the days that bootstrap intervals are computed from
+    'cluster_stats': Stage(['sufficient_stats'], lambda config: [data_file(config, 'person_sufficient_stats')],
+                           lambda config: [data_file(config, dataset) for dataset in rebuilt_stats_datasets],
+                           build_cluster_stats),
+    'pattern_frequency': Stage([], lambda config: [data_file(config, 'person_pattern_frequency')],
+                               lambda config: [data_file(config, 'pattern_frequency')], build_pattern_frequency),
+    'demographic_associations': Stage([], lambda config: [data_file(config, 'person_pattern_frequency'),
+                                                          data_file(config, 'person_demographics')],
+                                      lambda config: [data_file(config, 'pattern_associations')],
+                                      build_demographic_associations),
+}
+
+
+def input_hash(name, config):
+    """Hash of the stage's parameters and the path, size and mtime of each of its input files"""
+    stamps = [name, list(config)]
+    for path in stages[name].inputs(config):
+        stat = os.stat(path) if os.path.exists(path) else None
+        stamps.append([path, stat.st_size, stat.st_mtime_ns] if stat else [path, None, None])
+    return hashlib.sha256(json.dumps(stamps).encode()).hexdigest()
+
+
+def run_stage(name, config, workers):
+    """Builds one stage in a worker process, returns its wall time in seconds"""
+    start = time.perf_counter()
+    stages[name].build(config, workers)
+    return time.perf_counter() - start
+
+
+def load_manifest(path=manifest_file):
+    if not os.path.exists(path):
+        return {'stages': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=manifest_file):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, path)
+
+
+def is_up_to_date(name, config, stage_hash, previous):
+    return (previous.get('status') in ('built', 'skipped') and previous.get('input_hash') == stage_hash
+            and all(os.path.exists(path) for path in stages[name].outputs(config)))
+
+
+def run_pipeline(config, workers=None, manifest_path=manifest_file, force=False, allow_data_dir=False):
+    """
+    Builds every stage whose inputs changed since the last run, independent stages concurrently in worker processes
+    that share the workers: a stage waits while the running stages use all of them. A stage is hashed once the
+    stages it depends on are done, so a stage whose inputs were rebuilt identically in size and mtime is still
+    skipped. Failed stages block the stages that depend on them.
+    Returns the manifest, {stage: {status, input_hash, seconds, workers, error}} with the total wall time. Raises
+    ValueError when the out dir is the app's data dir unless allow_data_dir, the build overwrites the shipped files.
+    """
+    if not allow_data_dir and os.path.abspath(config.out_dir) == os.path.abspath(data_dir):
+        raise ValueError(f"Refusing to overwrite the files in {data_dir}, see --into-data-dir")
+    os.makedirs(config.out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    previous = load_manifest(manifest_path)['stages']
+    results = {}
+    pending = list(stages.keys())
+    queued = []
+    running = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(workers, len(stages))) as executor:
+        while pending or queued or running:
+            ready = [name for name in pending if all(dependency in results for dependency in stages[name].depends)]
+            for name in ready:
+                pending.remove(name)
+                if any(results[dependency]['status'] in ('failed', 'blocked') for dependency in stages[name].depends):
+                    results[name] = {'status': 'blocked'}
+                    continue
+                stage_hash = input_hash(name, config)
+                if not force and is_up_to_date(name, config, stage_hash, previous.get(name, {})):
+                    results[name] = {'status': 'skipped', 'input_hash': stage_hash, 'seconds': 0.0}
+                else:
+                    queued.append((name, stage_hash))
+            # running stages keep their workers until they finish, the queued stages share the ones left
+            free = workers - sum(stage_workers for _, _, stage_workers in running.values())
+            while queued and free > 0:
+                stage_workers = max(1, free // len(queued))
+                name, stage_hash = queued.pop(0)
+                running[executor.submit(run_stage, name, config, stage_workers)] = (name, stage_hash, stage_workers)
+                free -= stage_workers
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, stage_hash, stage_workers = running.pop(future)
+                try:
+                    results[name] = {'status': 'built', 'input_hash': stage_hash, 'seconds': round(future.result(), 3),
+                                     'workers': stage_workers}
+                except Exception as e:
+                    results[name] = {'status': 'failed', 'workers': stage_workers, 'error': f"{type(e).__name__}: {e}"}
+    manifest = {'stages': {name: results[name] for name in stages.keys()}, 'workers': workers,
+                'seconds': round(time.perf_counter() - start, 3), 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    save_manifest(manifest, manifest_path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build every data artefact from the per person series, "
+                                                 "demographics and pattern flags as a graph of stages, skipping "
+                                                 "stages whose inputs did not change.")
+    parser.add_argument("--series-dir", default=default_series_dir)
+    parser.add_argument("--data-dir", default=data_dir,
+                        help="directory of the raw person_demographics.csv and person_pattern_frequency.csv")
+    parser.add_argument("--out-dir", default=build_dir, help="directory of the built data files")
+    parser.add_argument("--into-data-dir", action="store_true",
+                        help="build into --data-dir, overwriting the shipped data files")
+    parser.add_argument("--lags", type=int, nargs='+', default=[1, 2, 3], help="granger lags in hours")
+    parser.add_argument("--ci-method", choices=list(ci_methods.keys()), default='normal',
+                        help="confidence intervals of the cluster stats files")
+    parser.add_argument("--manifest", default=manifest_file)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild every stage")
+    args = parser.parse_args()
+
+    out_dir = args.data_dir if args.into_data_dir else args.out_dir
+    try:
+        config = Config(args.series_dir, args.data_dir, out_dir, tuple(args.lags), args.ci_method)
+        manifest = run_pipeline(config, args.workers, args.manifest, args.force, allow_data_dir=args.into_data_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    for name, result in manifest['stages'].items():
+        print(f"{name:26} {result['status']:8} {result.get('seconds', 0.0):8.1f}s  {result.get('error', '')}")
+    print(f"Finished in {manifest['seconds']:.1f}s, manifest written to {args.manifest}")
+    if any(result['status'] in ('failed', 'blocked') for result in manifest['stages'].values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
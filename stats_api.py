@@ -0,0 +1,201 @@
+import argparse
+import gzip
+import hashlib
+import http.client
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from data_store import store, stats_datasets, clusters, stats, variates
+from key_findings import predictable_ids, available_lags, derivatives, predict_glucose_columns
+
+api_prefix = "/api"
+default_port = 8502
+cache_control = 'public, max-age=300, must-revalidate'
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip: listed, or covered by *, with a q-value above 0"""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = [part.strip() for part in coding.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def cluster_stats_response(dataset):
+    """Stats per cluster as {cluster: {stat: {variate: [24 hourly values]}}}"""
+    values = store.get(dataset + '_array')
+    return {
+        'dataset': dataset,
+        'hours': store.get(dataset).index.tolist(),
+        'clusters': {cluster: {stat: {variate: values[c, s, v].tolist()
+                                      for v, variate in enumerate(variates)}
+                               for s, stat in enumerate(stats)}
+                     for c, cluster in enumerate(clusters)},
+    }
+
+
+def pattern_frequency_response():
+    df = store.get('pattern_frequency')
+    return [{'pattern_number': int(row.pattern_number), 'pattern_type': str(row.pattern_type),
+             'timeframe': str(row.timeframe), 'mean': float(row.mean)} for row in df.itertuples(index=False)]
+
+
+def predictability_response():
+    results = []
+    for lag in available_lags().values():
+        for no_derivatives in derivatives.values():
+            all_predictable_ids, one_cluster_only_ids, both_clusters_ids = predictable_ids(lag, no_derivatives)
+            results.append({
+                'lag': lag,
+                'no_derivatives': no_derivatives,
+                'predictable_people': len(all_predictable_ids),
+                'variates': {col_name: {'some_days': len(one_cluster_only_ids[col_name]),
+                                        'most_days': len(both_clusters_ids[col_name])}
+                             for col_name in predict_glucose_columns.keys()},
+            })
+    return results
+
+
+def associations_response():
+    return [{'pattern_number': pattern_number, 'timeframe': timeframe, 'pattern_type': pattern_type,
+             'taus': tau_index.taus}
+            for (pattern_number, timeframe, pattern_type), tau_index in store.get('association_table').items()]
+
+
+def build_responses():
+    """Precomputes every response once. Key = path, value = (json bytes, gzipped json bytes, etag)"""
+    payloads = {
+        'clusters': stats_datasets,
+        'pattern-frequency': pattern_frequency_response(),
+        'predictability': predictability_response(),
+        'associations': associations_response(),
+    }
+    for dataset in stats_datasets:
+        payloads['clusters/' + dataset] = cluster_stats_response(dataset)
+    payloads[''] = sorted(api_prefix + '/' + name for name in payloads.keys() if name)
+
+    responses = {}
+    for name, payload in payloads.items():
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        path = api_prefix + ('/' + name if name else '')
+        responses[path] = (body, gzip.compress(body, compresslevel=9), etag)
+    return responses
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive connections
+    disable_nagle_algorithm = True  # headers and body are written separately
+    api_responses = {}
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/') or api_prefix
+        response = self.api_responses.get(path)
+        if response is None:
+            self.send_body(404, b'{"error":"not found"}', 'application/json')
+            return
+        body, gzipped_body, etag = response
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        self.send_body(200, gzipped_body if use_gzip else body, 'application/json', etag=etag, gzipped=use_gzip)
+
+    def send_body(self, status, body, content_type, etag=None, gzipped=False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(host="127.0.0.1", port=default_port):
+    StatsRequestHandler.api_responses = build_responses()
+    return ThreadingHTTPServer((host, port), StatsRequestHandler)
+
+
+def benchmark(n_requests=20000, concurrency=16, path=api_prefix + '/clusters/meal_rise_stats', revalidate=False):
+    """Requests/second of the api on a local server with keep-alive connections"""
+    server = create_server(port=0)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    etag = StatsRequestHandler.api_responses[path][2]
+    per_thread = n_requests // concurrency
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        headers = {'Accept-Encoding': 'gzip'}
+        if revalidate:
+            headers['If-None-Match'] = etag
+        for _ in range(per_thread):
+            connection.request('GET', path, headers=headers)
+            connection.getresponse().read()
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+    return per_thread * concurrency / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only JSON API of the pattern statistics shown in the app.")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="run the api server")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=default_port)
+    benchmark_parser = subparsers.add_parser("benchmark", help="measure requests/second on a local server")
+    benchmark_parser.add_argument("--requests", type=int, default=20000)
+    benchmark_parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        for revalidate in [False, True]:
+            rate = benchmark(args.requests, args.concurrency, revalidate=revalidate)
+            print(f"{'304 revalidation' if revalidate else '200 gzip'}: {rate:,.0f} requests/s")
+    else:
+        host = getattr(args, 'host', '127.0.0.1')
+        port = getattr(args, 'port', default_port)
+        server = create_server(host, port)
+        print(f"Serving pattern statistics on http://{host}:{port}{api_prefix}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
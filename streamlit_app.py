@@ -1,12 +1,12 @@
 import streamlit as st
-from streamlit.components.v1 import html
 
 from additional_information import display_additional_information
-from constants import expected_colour, unexpected_colour, key_findings, explore_patterns, individual_variations, \
-    why_this_matters, additional_information
+from constants import key_findings, explore_patterns, individual_variations, why_this_matters, additional_information
+from data_store import store, validate_all
 from explore_patterns import display_explore_patterns
 from inividual_variations import display_individual_variations
 from key_findings import display_main_findings
+from theme import css_file, page_style
 from why_this_matters import display_why_this_matters
 
 UNI_BRISTOL_LOGO_WIDE = "images/uni_bristol_logo.png"
@@ -15,34 +15,17 @@ QR_CODE = "images/qr_code.png"
 
 # other content
 content_title = "Beyond Expected Patterns in Type 1 Diabetes"
+authors = "Isabella Degen | Kate Robson Brown | Henry W. J. Reeve | Zahraa S. Abdallah"
+callout = "AI as a research tool to improve our understanding of complex biological systems."
 
 # Get the config values
 secondary_bg_color = st.get_option("theme.secondaryBackgroundColor")
 text_colour = st.get_option("theme.textColor")
 
-# Inject the CSS variable into the root
-css_variables = f"""
-<style>
-:root {{
-    --secondary-bg-color: {secondary_bg_color};
-    --text-colour: {text_colour};
-    --expected-colour: {expected_colour};
-    --unexpected-colour: {unexpected_colour};
-}}
-</style>
-"""
-
 
 def local_css(file_name):
-    st.markdown(css_variables, unsafe_allow_html=True)
-    with open(file_name) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-
-
-def load_custom_js(file_name):
-    with open(file_name, 'r') as file:
-        js_content = file.read()
-        html(f"<script>{js_content}</script>", height=0)
+    # the css variables and stylesheet are rendered once per process and again only when the file changes
+    st.markdown(page_style(secondary_bg_color, text_colour, file_name), unsafe_allow_html=True)
 
 
 def main():
@@ -53,9 +36,15 @@ def main():
         layout="wide",
     )
 
-    # Load css and js
-    local_css("style/style.css")
-    load_custom_js("scripts/style_metrics.js")
+    # Data files are validated when first loaded, later reruns only compare the files' mtime and size
+    data_errors = validate_all(store)
+    if data_errors:
+        for error in data_errors.values():
+            st.error(f"Invalid data file: {error}")
+        st.stop()
+
+    # Load css, metrics are styled by the keys of their containers
+    local_css(css_file)
 
     # Sidebar
     st.logo(
@@ -97,9 +86,9 @@ def main():
 def display_header():
     # Main body content
     st.title(content_title)
-    st.caption("*Isabella Degen | Kate Robson Brown | Henry W. J. Reeve | Zahraa S. Abdallah*")
+    st.caption(f"*{authors}*")
     with st.container(border=False, key='main-callout'):
-        st.markdown("""##### AI as a research tool to improve our understanding of complex biological systems.""")
+        st.markdown(f"""##### {callout}""")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import functools
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from cluster_stats import stats_frame_from_sufficient_stats
+from data_store import store, sufficient_stats, timeframes, pattern_types, demographic_factors
+from explore_patterns import patterns, pattern_charts
+from key_findings import predictable_ids, available_lags, derivatives, predict_glucose_columns, \
+    temporal_units, people_string, create_icon_array, tested_people
+from plot_cluster_interval import plot_cluster_confidence_intervals_for_df, select_chart_type, \
+    daily_ts_graph_description_text
+from theme import styled_metric
+
+# subgroups kept in memory, least recently used ones are recomputed when needed again
+subgroup_cache_size = 64
+# datasets the subgroup results are derived from, results are cached per generation of these in the store
+subgroup_datasets = ['person_demographics', 'person_sufficient_stats', 'person_pattern_frequency']
+
+
+def filter_signature(filters):
+    """Hashable, order independent key of demographic filters {column: (lower, upper)}"""
+    return tuple(sorted((column, float(lower), float(upper)) for column, (lower, upper) in filters.items()))
+
+
+def subgroup_ids(signature):
+    """Ids of the people whose demographics lie within every (column, lower, upper) range of the signature"""
+    demographics_df = store.get('person_demographics')
+    mask = np.ones(len(demographics_df), dtype=bool)
+    for column, lower, upper in signature:
+        values = demographics_df[column].to_numpy(dtype=np.float64)
+        mask &= (values >= lower) & (values <= upper)
+    return demographics_df['id'].to_numpy()[mask]
+
+
+def tested_subgroup_ids(ids):
+    """Ids of the subgroup that are in the granger table, in the order of the table"""
+    in_group = set(np.asarray(ids).tolist())
+    return [person for person in tested_people().tolist() if person in in_group]
+
+
+def subgroup_results(signature):
+    """
+    Cluster stats per stats dataset and pattern frequencies of a subgroup, aggregated from the per person sufficient
+    statistics with one vectorised sum over the selected people. Cached until the store reloads the per person data.
+    """
+    return _subgroup_results(signature, store.generation(*subgroup_datasets))
+
+
+@functools.lru_cache(maxsize=subgroup_cache_size)
+def _subgroup_results(signature, generation):
+    ids = subgroup_ids(signature)
+    arrays = store.get('person_sufficient_stats')
+    selected = np.isin(arrays['ids'], ids)
+    datasets = sorted({key.rsplit('/', 1)[0] for key in arrays.keys() if key != 'ids'})
+    stats_frames = {dataset: stats_frame_from_sufficient_stats(
+        *(arrays[f'{dataset}/{stat}'][selected].sum(axis=0) for stat in sufficient_stats))
+        for dataset in datasets}
+
+    frequency_df = store.get('person_pattern_frequency')
+    pattern_frequency = None
+    if frequency_df is not None:
+        in_group = frequency_df[frequency_df['id'].isin(ids)]
+        pattern_frequency = (in_group.groupby(['pattern_number', 'pattern_type', 'timeframe'], observed=True)
+                             ['has_pattern'].sum().rename('mean').reset_index())
+    return ids, stats_frames, pattern_frequency
+
+
+def display_subgroup_comparison():
+    st.subheader("Compare subgroups of people")
+    demographics_df = store.get('person_demographics')
+    if demographics_df is None or store.get('person_sufficient_stats') is None:
+        st.caption("Subgroup comparison needs the per person demographics and sufficient statistics "
+                   "(data/person_demographics.csv and data/person_sufficient_stats.npz).")
+        return
+
+    present = {name: column for name, column in demographic_factors.items() if column in demographics_df.columns}
+    # a range filter needs at least two different values
+    available = {name: column for name, column in present.items() if demographics_df[column].nunique() > 1}
+    constant = [name for name in present.keys() if name not in available]
+    if constant:
+        st.caption(f"Everyone has the same value for {', '.join(constant)}, so they cannot define a subgroup")
+    selected_factors = st.multiselect("Define a subgroup by:", list(available.keys()), key="subgroup_factors")
+    filters = {}
+    cols = st.columns(3)
+    for i, name in enumerate(selected_factors):
+        column = available[name]
+        lowest = float(demographics_df[column].min())
+        highest = float(demographics_df[column].max())
+        with cols[i % 3]:
+            filters[column] = st.slider(name, lowest, highest, (lowest, highest), key=f"subgroup_{column}")
+
+    ids, stats_frames, pattern_frequency = subgroup_results(filter_signature(filters))
+    st.metric("People in subgroup", f"{len(ids)} of {len(demographics_df)}")
+    missing = demographics_df[list(filters.keys())].isna().any(axis=1).sum()
+    if missing:
+        st.caption(f"{people_string(int(missing))} with a missing value for a selected factor "
+                   f"{'is' if missing == 1 else 'are'} left out")
+    if len(ids) == 0:
+        st.warning("No one matches these filters")
+        return
+
+    clusters_tab, frequency_tab, predictability_tab = st.tabs(["Clusters", "Pattern frequency", "Predictability"])
+    with clusters_tab:
+        chart_patterns = {patterns[key]: dataset for key, (dataset, _) in pattern_charts.items()
+                          if dataset in stats_frames}
+        if not chart_patterns:
+            st.caption("No cluster statistics for the patterns")
+        else:
+            selected_pattern = st.selectbox("Select pattern:", list(chart_patterns.keys()), key="subgroup_pattern")
+            graph_layout = select_chart_type(key="subgroup_graph_layout")
+            fig = plot_cluster_confidence_intervals_for_df(stats_frames[chart_patterns[selected_pattern]],
+                                                           plot_type=graph_layout)
+            st.plotly_chart(fig, use_container_width=True)
+            st.caption(daily_ts_graph_description_text)
+    with frequency_tab:
+        if pattern_frequency is None:
+            st.caption("No per person pattern frequencies (data/person_pattern_frequency.csv)")
+        else:
+            table = pattern_frequency.pivot_table(index=['pattern_number', 'timeframe'], columns='pattern_type',
+                                                  values='mean', observed=True)
+            table = table.reindex(columns=pattern_types)
+            table = table.reindex(pd.MultiIndex.from_product([sorted(pattern_frequency['pattern_number'].unique()),
+                                                              timeframes]))
+            table.index.names = ['Pattern', 'Compared across']
+            table = table.rename(index={timeframe: name for name, timeframe in temporal_units.items()}, level=1)
+            st.caption(f"Number of people of the {len(ids)} in the subgroup with expected and unexpected patterns")
+            st.dataframe(table.rename(columns=lambda t: f"People with {t} Patterns"), use_container_width=True)
+    with predictability_tab:
+        tested_lags = available_lags()
+        if not tested_lags:
+            st.info("No predictability results yet. Run `python granger_cache.py` to test the per person series.")
+            return
+        selected_lag = st.selectbox("Hours back in time:", list(tested_lags.keys()), key="subgroup_lag")
+        selected_derivative = st.selectbox("Aspects of the data:", list(derivatives.keys()),
+                                           key="subgroup_derivative")
+        all_ids, one_cluster_only_ids, both_clusters_ids = predictable_ids(tested_lags[selected_lag],
+                                                                           derivatives[selected_derivative])
+        tested_ids = tested_subgroup_ids(ids)
+        in_group = set(tested_ids)
+        st.metric("Unique people who show predictability from Insulin or Carbs",
+                  value=f"{people_string(len(all_ids & in_group))} of {len(tested_ids)}")
+        cols = st.columns(len(predict_glucose_columns))
+        for i, col_name in enumerate(predict_glucose_columns.keys()):
+            with cols[i]:
+                one = [person for person in one_cluster_only_ids[col_name] if person in in_group]
+                both = [person for person in both_clusters_ids[col_name] if person in in_group]
+                st.markdown("People for which we can predict glucose from **" + col_name + "**")
+                col1, col2 = st.columns(2)
+                with col1:
+                    styled_metric('some-days', f"subgroup-{col_name}", "Some days", value=f"{len(one)}")
+                with col2:
+                    styled_metric('most-days', f"subgroup-{col_name}", "Most days", value=f"{len(both)}")
+                create_icon_array(indices_group1=one, indices_group2=both, ids=tested_ids)
@@ -0,0 +1,254 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_store import data_dir, optional_dataset_files, demographic_factors
+from person_series import default_series_dir, person_dir, timestamps_file, values_file, series_variates
+
+# synthetic cohorts are kept apart from the study's data, series in synthetic/series and the person files in
+# synthetic/data, writing the person files into data/ has to be asked for explicitly
+synthetic_dir = 'synthetic'
+synthetic_series_dir = os.path.join(synthetic_dir, 'series')
+synthetic_data_dir = os.path.join(synthetic_dir, 'data')
+# synthetic ids start above the ids of the study's people (1 to 28)
+synthetic_first_id = 1001
+seconds_per_day = 86400
+# events are spread over kernels of this many hours, tails cross midnight into the next day
+kernel_hours = 6
+# days are generated and written in chunks of this many days so that long durations stay within memory
+default_chunk_days = 366
+# key = unexpected pattern number (see key_findings.patterns_by_number), value = (share of people with the pattern,
+# description of what is injected on their pattern days)
+injected_patterns = {
+    1: (0.3, 'boluses 60% larger for the same carbs'),
+    2: (0.3, 'glucose raised from midnight to 6am'),
+    3: (0.3, 'carbs 60% larger for the same boluses'),
+}
+# key = meal, value = (mean hour, standard deviation in hours, probability of the meal on a day)
+meals = {
+    'breakfast': (7.5, 0.75, 0.9),
+    'lunch': (12.5, 0.75, 0.95),
+    'dinner': (18.5, 1.0, 1.0),
+    'snack': (16.0, 2.5, 0.4),
+}
+# conversion of the scaled units of the series to the units of the demographics
+carb_grams_per_unit = 40
+insulin_units_per_unit = 4
+# daily basal insulin per unit of the basal iob level
+basal_units_per_day = 4
+
+
+def kernels(interval_minutes):
+    """Responses [sample since event] of cob to carbs, iob to a bolus and glucose to carbs and to a bolus"""
+    t = np.arange(kernel_hours * 60 // interval_minutes) * interval_minutes / 60
+    cob = np.clip(1 - t / 3, 0, None)  # carbs absorbed linearly over 3 hours
+    iob = (1 + t / 0.9) * np.exp(-t / 0.9)  # exponential insulin action curve
+    bg_carbs = t / 0.75 * np.exp(1 - t / 0.75)  # glucose rise peaking 45 minutes after a meal
+    bg_insulin = 0.9 * t / 1.5 * np.exp(1 - t / 1.5)  # insulin effect peaking after 90 minutes
+    return cob, iob, bg_carbs, bg_insulin
+
+
+def person_parameters(rng):
+    """Demographics and the generator parameters derived from them"""
+    age = rng.uniform(18, 70)
+    duration = rng.uniform(1, age - 5)
+    return {
+        'Age': round(age),
+        'Duration of T1D': round(duration),
+        'A1C': round(rng.normal(7.0, 0.8), 1),
+        'Pumping since': round(rng.uniform(0, duration)),
+        'CGM since': round(rng.uniform(0, min(duration, 15))),
+        'AID since': round(rng.uniform(0, min(duration, 8))),
+        'meal_size': rng.uniform(0.6, 1.4),
+        'carb_ratio': rng.uniform(0.8, 1.2),
+        'basal': rng.uniform(0.8, 1.6),
+        'baseline': rng.uniform(2.3, 3.0),
+        'dawn': rng.uniform(0, 0.5),
+        'patterns': [number for number, (share, _) in injected_patterns.items() if rng.random() < share],
+        'pattern_day_share': rng.uniform(0.2, 0.5),
+    }
+
+
+def day_events(rng, params, n_days, samples_per_day):
+    """
+    Meals of n_days days as (event samples since the first day, carbs, boluses) [day, meal] and the day masks of
+    the injected patterns {pattern number: [day]}
+    """
+    hours = np.stack([rng.normal(mean, sd, n_days) for mean, sd, _ in meals.values()], axis=1)
+    eaten = np.stack([rng.random(n_days) < probability for _, _, probability in meals.values()], axis=1)
+    samples = (np.clip(hours, 0, 23.9) * samples_per_day / 24).astype(np.int64)
+    samples += np.arange(n_days)[:, None] * samples_per_day
+    carbs = eaten * params['meal_size'] * rng.lognormal(0, 0.3, eaten.shape)
+    boluses = carbs * params['carb_ratio'] * rng.lognormal(0, 0.15, eaten.shape)
+    pattern_days = {number: (rng.random(n_days) < params['pattern_day_share']) & (number in params['patterns'])
+                    for number in injected_patterns.keys()}
+    boluses[pattern_days[1]] *= 1.6
+    carbs[pattern_days[3]] *= 1.6
+    return samples, carbs, boluses, pattern_days
+
+
+def sensor_gaps(rng, n_days, samples_per_day, gap_probability=0.05):
+    """Readings [day, sample of the day] kept after sensor gaps of 1 to 8 hours that end at midnight at the latest"""
+    starts = rng.integers(0, samples_per_day, n_days)
+    lengths = (rng.uniform(1, 8, n_days) * samples_per_day / 24).astype(np.int64)
+    sample = np.arange(samples_per_day)
+    in_gap = (sample >= starts[:, None]) & (sample < (starts + lengths)[:, None])
+    return ~(in_gap & (rng.random(n_days) < gap_probability)[:, None])
+
+
+def responses(event_samples, amounts, kernel, first_sample, n_samples):
+    """Sum of amount * kernel shifted to every event, over samples [first_sample, first_sample + n_samples)"""
+    positions = (event_samples.ravel() - first_sample)[:, None] + np.arange(len(kernel))
+    weights = amounts.ravel()[:, None] * kernel
+    inside = (positions >= 0) & (positions < n_samples)
+    return np.bincount(positions[inside], weights=weights[inside], minlength=n_samples)
+
+
+def generate_chunk(rng, params, events, first_day, n_days, samples_per_day, interval_minutes):
+    """Values [day, sample, variate] of days [first_day, first_day + n_days) of a person's events"""
+    event_samples, carbs, boluses, pattern_days = events
+    cob_kernel, iob_kernel, bg_carbs_kernel, bg_insulin_kernel = kernels(interval_minutes)
+    first_sample = first_day * samples_per_day
+    n_samples = n_days * samples_per_day
+    hour = np.tile(np.arange(samples_per_day) * 24 / samples_per_day, n_days)
+
+    cob = responses(event_samples, carbs, cob_kernel, first_sample, n_samples)
+    iob = params['basal'] + responses(event_samples, boluses, iob_kernel, first_sample, n_samples)
+    # slow drift of glucose, hourly noise interpolated to the readings
+    hourly_noise = rng.normal(0, 0.2, n_days * 24 + 1)
+    drift = np.interp(np.arange(n_samples) * 24 / samples_per_day, np.arange(len(hourly_noise)), hourly_noise)
+    bg = (params['baseline'] + params['dawn'] * np.exp(-((hour - 6) / 1.5) ** 2) + drift
+          + responses(event_samples, carbs, bg_carbs_kernel, first_sample, n_samples)
+          - responses(event_samples, boluses, bg_insulin_kernel, first_sample, n_samples))
+    night_high = np.repeat(pattern_days[2][first_day:first_day + n_days], samples_per_day) & (hour < 6)
+    bg = bg + 0.8 * night_high * np.sin(np.pi * hour / 6)
+    bg = np.clip(bg + rng.normal(0, 0.05, n_samples), 0.3, None)
+    return np.stack([iob, cob, bg], axis=1).reshape(n_days, samples_per_day, len(series_variates))
+
+
+def generate_person(series_dir, person_id, n_days, start_day=19000, seed=0, interval_minutes=5,
+                    chunk_days=default_chunk_days):
+    """
+    Writes the series of one synthetic person in the person_series format, generated and written chunk_days days
+    at a time into preallocated memory-mapped files. Deterministic for (seed, person id, chunk_days) whatever the
+    number of workers. Returns (demographics row, person pattern frequency rows, number of readings).
+    """
+    rng = np.random.default_rng([seed, int(person_id)])
+    params = person_parameters(rng)
+    samples_per_day = 24 * 60 // interval_minutes
+    events = day_events(rng, params, n_days, samples_per_day)
+    kept = sensor_gaps(rng, n_days, samples_per_day)
+    n_readings = int(kept.sum())
+
+    os.makedirs(person_dir(series_dir, person_id), exist_ok=True)
+    timestamps_out = np.lib.format.open_memmap(os.path.join(person_dir(series_dir, person_id),
+                                                            timestamps_file + '.npy'),
+                                               mode='w+', dtype=np.int64, shape=(n_readings,))
+    values_out = np.lib.format.open_memmap(os.path.join(person_dir(series_dir, person_id), values_file + '.npy'),
+                                           mode='w+', dtype=np.float64, shape=(n_readings, len(series_variates)))
+    offsets = np.arange(samples_per_day) * interval_minutes * 60
+    written = 0
+    for first_day in range(0, n_days, chunk_days):
+        n_chunk = min(chunk_days, n_days - first_day)
+        values = generate_chunk(rng, params, events, first_day, n_chunk, samples_per_day, interval_minutes)
+        chunk_kept = kept[first_day:first_day + n_chunk]
+        days = start_day + first_day + np.arange(n_chunk)
+        timestamps = days[:, None] * seconds_per_day + offsets
+        n_chunk_readings = int(chunk_kept.sum())
+        timestamps_out[written:written + n_chunk_readings] = timestamps[chunk_kept]
+        values_out[written:written + n_chunk_readings] = values[chunk_kept]
+        written += n_chunk_readings
+    timestamps_out.flush()
+    values_out.flush()
+    del timestamps_out, values_out
+
+    _, carbs, boluses, pattern_days = events
+    demographics = {'id': int(person_id), **{factor: params[factor] for factor in demographic_factors.keys()
+                                             if factor in params},
+                    'Avg. Carbs': round(float(carbs.sum(axis=1).mean()) * carb_grams_per_unit),
+                    'Avg. Insulin': round(float(boluses.sum(axis=1).mean() + params['basal'] * basal_units_per_day)
+                                          * insulin_units_per_unit, 1),
+                    'Avg. Basal Insulin': round(params['basal'] * basal_units_per_day * insulin_units_per_unit, 1)}
+    pattern_rows = [{'id': int(person_id), 'pattern_number': number, 'pattern_type': 'Unexpected',
+                     'timeframe': 'Clusters', 'has_pattern': int(bool(pattern_days[number].any()))}
+                    for number in injected_patterns.keys()]
+    return demographics, pattern_rows, n_readings
+
+
+def _generate_person(args):
+    return generate_person(*args)
+
+
+def generate_cohort(n_people, n_days, series_dir=synthetic_series_dir, out_dir=synthetic_data_dir, min_days=None,
+                    first_id=synthetic_first_id, start_day=19000, seed=0, interval_minutes=5,
+                    chunk_days=default_chunk_days, workers=None, allow_data_dir=False):
+    """
+    Writes a synthetic cohort: every person's series to series_dir and person_demographics.csv and
+    person_pattern_frequency.csv (the injected unexpected patterns) to out_dir. Durations are drawn uniformly from
+    [min_days, n_days]. Returns the total number of readings. Raises ValueError when out_dir is the app's data dir
+    unless allow_data_dir, the app would otherwise show the synthetic people as study participants.
+    """
+    if not allow_data_dir and os.path.abspath(out_dir) == os.path.abspath(data_dir):
+        raise ValueError(f"Refusing to write synthetic person files into {data_dir}, see --into-data-dir")
+    rng = np.random.default_rng(seed)
+    durations = rng.integers(min_days or n_days, n_days + 1, n_people)
+    ids = [str(person_id) for person_id in range(first_id, first_id + n_people)]
+    tasks = [(series_dir, person_id, int(days), start_day, seed, interval_minutes, chunk_days)
+             for person_id, days in zip(ids, durations)]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_generate_person, tasks, chunksize=max(1, n_people // (workers * 8))))
+
+    os.makedirs(out_dir, exist_ok=True)
+    demographics = pd.DataFrame([demographics for demographics, _, _ in results],
+                                columns=['id'] + list(demographic_factors.keys()))
+    demographics.to_csv(os.path.join(out_dir, optional_dataset_files['person_demographics'][0]), index=False)
+    pattern_rows = [row for _, rows, _ in results for row in rows]
+    pd.DataFrame(pattern_rows).to_csv(os.path.join(out_dir, optional_dataset_files['person_pattern_frequency'][0]),
+                                      index=False)
+    return sum(n_readings for _, _, n_readings in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic cohort of IOB/COB/BG series with "
+                                                 "meals, basal insulin, sensor gaps and injected unexpected patterns, "
+                                                 "in the formats of the per person series and data files.")
+    parser.add_argument("--people", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365, help="(maximum) number of days per person")
+    parser.add_argument("--min-days", type=int, default=None,
+                        help="durations are drawn uniformly between this and --days, all --days when omitted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-id", type=int, default=synthetic_first_id,
+                        help="id of the first person, above the study's ids by default")
+    parser.add_argument("--start-day", type=int, default=19000, help="first UTC day number since epoch")
+    parser.add_argument("--interval-minutes", type=int, default=5)
+    parser.add_argument("--chunk-days", type=int, default=default_chunk_days)
+    parser.add_argument("--series-dir", default=synthetic_series_dir)
+    parser.add_argument("--out-dir", default=synthetic_data_dir,
+                        help="directory of person_demographics.csv and person_pattern_frequency.csv")
+    parser.add_argument("--into-data-dir", action="store_true",
+                        help=f"write the series to {default_series_dir} and the person files to {data_dir} so the "
+                             f"app and the offline steps use the synthetic cohort")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    series_dir, out_dir = (default_series_dir, data_dir) if args.into_data_dir else (args.series_dir, args.out_dir)
+    start = time.perf_counter()
+    try:
+        n_readings = generate_cohort(args.people, args.days, series_dir, out_dir, args.min_days, args.first_id,
+                                     args.start_day, args.seed, args.interval_minutes, args.chunk_days, args.workers,
+                                     allow_data_dir=args.into_data_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    seconds = time.perf_counter() - start
+    person_years = n_readings * args.interval_minutes / (60 * 24 * 365)
+    print(f"Wrote {n_readings:,} readings ({person_years:,.1f} person-years) of {args.people} people in "
+          f"{seconds:.1f}s, {person_years / seconds:,.1f} person-years/s")
+
+
+if __name__ == "__main__":
+    main()
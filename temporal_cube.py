@@ -0,0 +1,160 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from feature_store import load_features
+from person_series import default_series_dir, person_ids, load_day_clusters, series_variates
+
+# a build output like the granger and bootstrap caches, data/ only holds the files the app reads
+cube_file = os.path.join('.cache', 'temporal_cube', 'temporal_cube.npz')
+weekday_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+month_names = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+               'November', 'December']
+
+
+def weekday_codes(day_numbers):
+    """Monday = 0 of UTC day numbers since epoch, 1970-01-01 was a Thursday"""
+    return (day_numbers + 3) % 7
+
+
+def month_codes(day_numbers):
+    """January = 0 of UTC day numbers since epoch, integer civil calendar arithmetic without datetime objects"""
+    z = day_numbers + 719468
+    day_of_era = z - (z // 146097) * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_from_march = (5 * day_of_year + 2) // 153
+    return np.where(month_from_march < 10, month_from_march + 2, month_from_march - 10)
+
+
+# key = timeframe (see key_findings.temporal_units), value = (code labels, function of (day numbers, hours, day
+# cluster labels) per hourly reading to integer codes, negative codes are left out). A new temporal unit only needs
+# an entry here.
+calendar_codes = {
+    'Hours of the day': ([f"{hour:02d}:00" for hour in range(24)], lambda days, hours, day_clusters: hours),
+    'Clusters': (['Cluster 1', 'Cluster 2'], lambda days, hours, day_clusters: day_clusters),
+    'Days of the week': (weekday_names, lambda days, hours, day_clusters: weekday_codes(days)),
+    'Months of the year': (month_names, lambda days, hours, day_clusters: month_codes(days)),
+    'Weekend vs weekday': (['Weekday', 'Weekend'],
+                           lambda days, hours, day_clusters: (weekday_codes(days) >= 5).astype(np.int64)),
+}
+
+
+def person_rollup(day_numbers, profiles, day_clusters, timeframes=tuple(calendar_codes.keys())):
+    """
+    Sparse rollups of one person's hourly profiles [day, hour, variate] per timeframe as {timeframe: (codes with
+    readings, sums [code, variate], counts [code, variate])}. Each rollup is one bincount per variate over the
+    calendar codes of all hours.
+    """
+    n_days, n_hours, n_variates = profiles.shape
+    days = np.repeat(np.asarray(day_numbers, dtype=np.int64), n_hours)
+    hours = np.tile(np.arange(n_hours), n_days)
+    cells_clusters = np.repeat(np.asarray(day_clusters, dtype=np.int64), n_hours)
+    values = np.asarray(profiles, dtype=np.float64).reshape(-1, n_variates)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0)
+
+    rollups = {}
+    for timeframe in timeframes:
+        labels, to_codes = calendar_codes[timeframe]
+        codes = np.asarray(to_codes(days, hours, cells_clusters))
+        valid = codes >= 0
+        sums = np.stack([np.bincount(codes[valid], weights=filled[valid, v], minlength=len(labels))
+                         for v in range(n_variates)], axis=1)
+        counts = np.stack([np.bincount(codes[valid], weights=present[valid, v], minlength=len(labels))
+                           for v in range(n_variates)], axis=1)
+        observed = counts.sum(axis=1) > 0
+        rollups[timeframe] = (np.flatnonzero(observed), sums[observed], counts[observed].astype(np.int64))
+    return rollups
+
+
+def build_person(series_dir, person_id):
+    day_numbers, profiles = load_features(series_dir, person_id, 0)
+    day_clusters = load_day_clusters(series_dir, person_id)
+    labels = np.full(len(day_numbers), -1)
+    if day_clusters is not None:
+        labels = (pd.Series(np.asarray(day_clusters[1]), index=np.asarray(day_clusters[0]))
+                  .reindex(np.asarray(day_numbers)).fillna(-1).to_numpy(dtype=np.int64))
+    return person_rollup(day_numbers, profiles, labels)
+
+
+def build_cube(series_dir=default_series_dir, workers=None):
+    """
+    Temporal rollup cube of every person as sparse arrays: 'ids' and per timeframe '<timeframe>/person' (index into
+    ids), '<timeframe>/code', '<timeframe>/sum' and '<timeframe>/count' [entry, variate]. Only (person, code) pairs
+    with readings are stored.
+    """
+    ids = person_ids(series_dir)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rollups = list(executor.map(build_person, [series_dir] * len(ids), ids))
+    cube = {'ids': np.array(ids)}
+    for timeframe in calendar_codes.keys():
+        parts = [rollup[timeframe] for rollup in rollups]
+        cube[f'{timeframe}/person'] = np.repeat(np.arange(len(ids)), [len(codes) for codes, _, _ in parts])
+        cube[f'{timeframe}/code'] = np.concatenate([codes for codes, _, _ in parts]) if parts else np.empty(0, int)
+        cube[f'{timeframe}/sum'] = (np.concatenate([sums for _, sums, _ in parts]) if parts
+                                    else np.empty((0, len(series_variates))))
+        cube[f'{timeframe}/count'] = (np.concatenate([counts for _, _, counts in parts]) if parts
+                                      else np.empty((0, len(series_variates)), dtype=np.int64))
+    return cube
+
+
+def save_cube(cube, path=cube_file):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, **cube)
+
+
+def load_cube(path=cube_file):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def person_means(cube, timeframe):
+    """Mean hourly readings per person and code as a frame indexed (person id, code label), observed codes only"""
+    labels, _ = calendar_codes[timeframe]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = cube[f'{timeframe}/sum'] / cube[f'{timeframe}/count']
+    index = pd.MultiIndex.from_arrays([cube['ids'][cube[f'{timeframe}/person']],
+                                       np.asarray(labels)[cube[f'{timeframe}/code']]], names=['id', timeframe])
+    return pd.DataFrame(means, index=index, columns=series_variates)
+
+
+def cohort_means(cube, timeframe, ids=None):
+    """Mean hourly readings per code over all hours of the selected people (all when ids is None)"""
+    labels, _ = calendar_codes[timeframe]
+    selected = np.ones(len(cube[f'{timeframe}/code']), dtype=bool) if ids is None else \
+        np.isin(cube['ids'][cube[f'{timeframe}/person']], ids)
+    codes = cube[f'{timeframe}/code'][selected]
+    sums = np.stack([np.bincount(codes, weights=cube[f'{timeframe}/sum'][selected, v], minlength=len(labels))
+                     for v in range(len(series_variates))], axis=1)
+    counts = np.stack([np.bincount(codes, weights=cube[f'{timeframe}/count'][selected, v], minlength=len(labels))
+                       for v in range(len(series_variates))], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame(sums / counts, index=pd.Index(labels, name=timeframe), columns=series_variates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the sparse temporal rollup cube of every person's hourly "
+                                                 "readings by hour, cluster, weekday, month and weekend.")
+    parser.add_argument("--series-dir", default=default_series_dir)
+    parser.add_argument("--out", default=cube_file)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cube = build_cube(args.series_dir, args.workers)
+    save_cube(cube, args.out)
+    n_people = len(cube['ids'])
+    for timeframe, (labels, _) in calendar_codes.items():
+        entries = len(cube[f'{timeframe}/code'])
+        print(f"{timeframe:20} {entries:6} of {n_people * len(labels):6} (person, code) cells stored")
+    print(f"Wrote {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import os
+
+# the modules read data/ and write .cache/ relative to the working directory, as when the app is started
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
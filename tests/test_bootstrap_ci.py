@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from bootstrap_ci import (bca_interval, bootstrap_distribution, bootstrap_means, confidence, normal_interval,
+                          percentile_interval, stats_frame)
+from cluster_stats import person_sufficient_stats, stats_frame_from_sufficient_stats
+from data_store import clusters, hours, sufficient_stats, variates
+
+
+def naive_bca(values, boot):
+    """BCa interval of the mean of one cell with an explicit jackknife loop"""
+    values = values[~np.isnan(values)]
+    theta = values.mean()
+    n_resamples = len(boot)
+    proportion = (np.sum(boot < theta) + 0.5 * np.sum(boot == theta)) / n_resamples
+    z0 = stats.norm.ppf(np.clip(proportion, 1 / (n_resamples + 1), n_resamples / (n_resamples + 1)))
+    jackknife = np.array([np.delete(values, i).mean() for i in range(len(values))])
+    deviation = jackknife.mean() - jackknife
+    acceleration = np.sum(deviation ** 3) / (6 * np.sum(deviation ** 2) ** 1.5)
+    bounds = []
+    for alpha in [(1 - confidence) / 2, (1 + confidence) / 2]:
+        z_alpha = stats.norm.ppf(alpha)
+        adjusted = stats.norm.cdf(z0 + (z0 + z_alpha) / (1 - acceleration * (z0 + z_alpha)))
+        bounds.append(np.sort(boot)[int(np.round(adjusted * (n_resamples - 1)))])
+    return bounds
+
+
+@pytest.fixture
+def member_days():
+    rng = np.random.default_rng(0)
+    # skewed cells, where bca and percentile intervals differ
+    return rng.lognormal(0, [0.2, 0.8, 1.2], size=(40, 3))
+
+
+def test_bootstrap_means_match_resampled_means(member_days):
+    seed_sequence = np.random.SeedSequence(7)
+    means = bootstrap_means(member_days, seed_sequence, 50)
+    index_matrix = np.random.default_rng(seed_sequence).integers(0, len(member_days), size=(50, len(member_days)))
+    np.testing.assert_allclose(means, member_days[index_matrix].mean(axis=1))
+
+
+def test_bootstrap_means_skip_nan_days(member_days):
+    member_days = member_days.copy()
+    member_days[::5, 1] = np.nan
+    seed_sequence = np.random.SeedSequence(7)
+    means = bootstrap_means(member_days, seed_sequence, 50)
+    index_matrix = np.random.default_rng(seed_sequence).integers(0, len(member_days), size=(50, len(member_days)))
+    np.testing.assert_allclose(means, np.nanmean(member_days[index_matrix], axis=1))
+
+
+def test_bootstrap_distribution_does_not_depend_on_the_workers(member_days):
+    serial = bootstrap_distribution(member_days, n_resamples=600, seed=3)
+    with ProcessPoolExecutor(2) as executor:
+        parallel = bootstrap_distribution(member_days, n_resamples=600, seed=3, executor=executor)
+    assert serial.shape == (600, 3)
+    np.testing.assert_array_equal(serial, parallel)
+
+
+def test_normal_interval_matches_scipy(member_days):
+    lo, hi = normal_interval(member_days)
+    sem = stats.sem(member_days, axis=0)
+    z = stats.norm.ppf(0.5 + confidence / 2)
+    np.testing.assert_allclose(lo, member_days.mean(axis=0) - z * sem)
+    np.testing.assert_allclose(hi, member_days.mean(axis=0) + z * sem)
+
+
+def test_percentile_interval_matches_numpy(member_days):
+    boot = bootstrap_distribution(member_days, n_resamples=1000, seed=1)
+    lo, hi = percentile_interval(boot)
+    np.testing.assert_allclose(lo, np.percentile(boot, 2.5, axis=0))
+    np.testing.assert_allclose(hi, np.percentile(boot, 97.5, axis=0))
+
+
+def test_bca_interval_matches_naive_bca(member_days):
+    member_days = member_days.copy()
+    member_days[::4, 2] = np.nan
+    boot = bootstrap_distribution(member_days, n_resamples=1000, seed=1)
+    lo, hi = bca_interval(member_days, boot)
+    for cell in range(member_days.shape[1]):
+        np.testing.assert_allclose([lo[cell], hi[cell]], naive_bca(member_days[:, cell], boot[:, cell]))
+
+
+def test_bca_interval_agrees_with_scipy(member_days):
+    boot = bootstrap_distribution(member_days, n_resamples=20000, seed=2)
+    lo, hi = bca_interval(member_days, boot)
+    for cell in range(member_days.shape[1]):
+        reference = stats.bootstrap((member_days[:, cell],), np.mean, n_resamples=20000, method='BCa',
+                                    confidence_level=confidence, random_state=np.random.default_rng(2))
+        width = reference.confidence_interval.high - reference.confidence_interval.low
+        assert lo[cell] == pytest.approx(reference.confidence_interval.low, abs=0.05 * width)
+        assert hi[cell] == pytest.approx(reference.confidence_interval.high, abs=0.05 * width)
+
+
+def test_bca_interval_shifts_towards_the_skew(member_days):
+    boot = bootstrap_distribution(member_days, n_resamples=4000, seed=1)
+    bca_lo, bca_hi = bca_interval(member_days, boot)
+    percentile_lo, percentile_hi = percentile_interval(boot)
+    assert bca_lo[2] > percentile_lo[2] and bca_hi[2] > percentile_hi[2]
+
+
+def test_constant_cells_have_a_zero_width_interval():
+    member_days = np.full((10, 2), 3.0)
+    boot = bootstrap_distribution(member_days, n_resamples=100)
+    lo, hi = bca_interval(member_days, boot)
+    np.testing.assert_array_equal(lo, 3.0)
+    np.testing.assert_array_equal(hi, 3.0)
+
+
+def test_normal_stats_frame_matches_the_sufficient_stats_frame():
+    rng = np.random.default_rng(4)
+    days = rng.normal(5, 2, (50, len(hours), len(variates)))
+    days[rng.random(days.shape) < 0.1] = np.nan
+    labels = rng.integers(0, len(clusters), len(days))
+    summed = person_sufficient_stats(days, labels)
+    expected = stats_frame_from_sufficient_stats(*[summed[stat] for stat in sufficient_stats])
+    pd.testing.assert_frame_equal(stats_frame(days, labels, 'normal'), expected)
+    # bootstrap frames count the non-missing days of every cell too
+    percentile = stats_frame(days, labels, 'percentile', n_resamples=200, workers=1, use_cache=False)
+    pd.testing.assert_frame_equal(percentile.xs('count', axis=1, level=1), expected.xs('count', axis=1, level=1))
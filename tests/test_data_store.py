@@ -0,0 +1,312 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_store
+from data_store import DataStore, DataValidationError, build_association_table, build_granger_bitmasks, \
+    build_stats_array, clusters, create_store, data_dir, dataset_files, dataset_validators, granger_relations, nbytes, \
+    optional_array_files, optional_dataset_files, query_tau_range, stats, stats_datasets, updated_dataset_files, \
+    validate_all, variates
+
+
+def array_store(budget, sizes, pinned=()):
+    """Store of zero float arrays with the given sizes in bytes"""
+    new_store = DataStore(memory_budget_bytes=budget)
+    for name, size in sizes.items():
+        new_store.register(name, lambda size=size: np.zeros(size // 8), pinned=name in pinned)
+    return new_store
+
+
+def resident(data_store):
+    return data_store.memory_report()['loaded'].to_dict()
+
+
+def test_values_are_loaded_once_and_read_only():
+    new_store = array_store(None, {'a': 80})
+    value = new_store.get('a')
+    assert new_store.get('a') is value
+    assert not value.flags.writeable
+    report = new_store.memory_report()
+    assert (report.loc['a', 'loads'], report.loc['a', 'hits'], report.loc['a', 'bytes']) == (1, 2, 80)
+
+
+def test_least_recently_used_values_are_evicted_over_the_budget():
+    new_store = array_store(200, {'a': 80, 'b': 80, 'c': 80})
+    for name in ['a', 'b', 'a', 'c']:
+        new_store.get(name)
+    assert resident(new_store) == {'a': True, 'b': False, 'c': True}
+    assert new_store.evictions == 1
+    assert new_store.total_bytes() == 160
+
+    # evicted values are reloaded on demand
+    assert len(new_store.get('b')) == 10
+    assert resident(new_store) == {'a': False, 'b': True, 'c': True}
+    assert new_store.memory_report().loc['b', 'loads'] == 2
+
+
+def test_pinned_values_and_the_requested_value_are_never_evicted():
+    new_store = array_store(100, {'a': 80, 'b': 80, 'c': 80}, pinned=['a'])
+    new_store.get('a')
+    new_store.get('b')
+    assert resident(new_store) == {'a': True, 'b': True, 'c': False}
+    new_store.get('c')
+    assert resident(new_store) == {'a': True, 'b': False, 'c': True}
+
+
+def test_without_a_budget_nothing_is_evicted():
+    new_store = array_store(None, {'a': 80, 'b': 80})
+    new_store.get('a')
+    new_store.get('b')
+    assert new_store.evictions == 0
+    new_store.clear()
+    assert resident(new_store) == {'a': False, 'b': False}
+    assert new_store.total_bytes() == 0
+
+
+def test_generation_counts_the_loads():
+    new_store = array_store(100, {'a': 80, 'b': 80})
+    assert new_store.generation('a') == (1,)
+    assert new_store.generation('a') == (1,)
+    new_store.get('b')
+    # a was evicted for b, the generation loads it again
+    assert new_store.generation('a') == (2,)
+    assert new_store.generation('a', 'b') == (2, 2)
+
+
+def test_nbytes_of_nested_values():
+    df = pd.DataFrame({'x': np.zeros(10), 'y': ['a'] * 10})
+    array = np.zeros(5, dtype=np.int32)
+    assert nbytes(array) == 20
+    assert nbytes(df) == df.memory_usage(deep=True).sum()
+    assert nbytes({'df': df, 'arrays': [array, (array,)]}) == nbytes(df) + 40
+
+
+def test_compact_downcasts_floats_and_encodes_categoricals():
+    df = pd.DataFrame({'mean': [0.5, 1.5], 'timeframe': ['Clusters', 'Clusters'], 'other': ['a', 'b']})
+    compact = DataStore(downcast_floats=True)._compact(df.copy())
+    assert compact['mean'].dtype == np.float32
+    assert isinstance(compact['timeframe'].dtype, pd.CategoricalDtype)
+    assert not isinstance(compact['other'].dtype, pd.CategoricalDtype)
+    plain = DataStore(encode_categoricals=False)._compact(df.copy())
+    assert plain['mean'].dtype == np.float64
+    assert not isinstance(plain['timeframe'].dtype, pd.CategoricalDtype)
+
+
+@pytest.mark.parametrize('dataset', stats_datasets)
+def test_stats_array_matches_the_stats_frame(dataset):
+    df = create_store().get(dataset)
+    values = build_stats_array(df)
+    assert values.shape == (len(clusters), len(stats), len(variates), len(df.index))
+    for c, cluster in enumerate(clusters):
+        for s, stat in enumerate(stats):
+            for v, variate in enumerate(variates):
+                np.testing.assert_array_equal(values[c, s, v], df[(cluster, stat, f'xtrain {variate} mean')])
+
+
+def test_granger_bitmasks_match_the_table():
+    df = create_store().get('granger_causality')
+    bitmasks = build_granger_bitmasks(df)
+    ids = bitmasks['ids']
+    np.testing.assert_array_equal(ids, np.sort(df['id'].unique()))
+    for (lag, no_derivatives), group in df.groupby(['lag', 'no_derivatives']):
+        masks = bitmasks[(lag, no_derivatives)]
+        person = np.searchsorted(ids, group['id'])
+        for relation in granger_relations:
+            np.testing.assert_array_equal(masks[relation][person, group['Cluster']], group[relation])
+            assert masks[relation].sum() == group[relation].sum()
+
+
+def test_association_table_matches_the_frame():
+    df = create_store().get('pattern_associations')
+    table = build_association_table(df)
+    assert len(table) == len(df)
+    for _, row in df.iterrows():
+        tau_index = table[(row['pattern_number'], row['timeframe'], row['pattern_type'])]
+        taus = row.drop(['pattern_number', 'timeframe', 'pattern_type']).astype(float)
+        assert tau_index.taus == taus.to_dict()
+        assert sorted(tau_index.demographics) == sorted(taus.index)
+        assert (np.diff(tau_index.abs_taus) >= 0).all()
+
+
+def test_query_tau_range_bounds_are_inclusive():
+    df = pd.DataFrame({'pattern_number': [1], 'timeframe': ['Clusters'], 'pattern_type': ['Expected'],
+                       'Age': [0.2], 'A1C': [-0.5], 'Avg. Carbs': [0.35], 'Avg. Insulin': [0.0]})
+    tau_index = build_association_table(df)[(1, 'Clusters', 'Expected')]
+    assert list(query_tau_range(tau_index, 0.2, 0.5)) == ['Age', 'Avg. Carbs', 'A1C']
+    assert list(query_tau_range(tau_index, 0.21, 0.49)) == ['Avg. Carbs']
+    assert list(query_tau_range(tau_index, 0.0, 0.0)) == ['Avg. Insulin']
+    assert list(query_tau_range(tau_index, 0.6, 1.0)) == []
+    assert tau_index.taus['A1C'] == -0.5
+
+
+@pytest.mark.parametrize('lower, upper', [(0, 1), (0, 0.1), (0.1, 0.3), (0.25, 0.25), (0.3, 1), (0.13, 0.22)])
+def test_query_tau_range_matches_a_filter_of_the_frame(lower, upper):
+    df = create_store().get('pattern_associations')
+    for tau_index in build_association_table(df).values():
+        expected = {demographic for demographic, tau in tau_index.taus.items() if lower <= abs(tau) <= upper}
+        assert set(query_tau_range(tau_index, lower, upper)) == expected
+
+
+def test_store_registers_every_dataset_and_index():
+    names = create_store().names()
+    assert set(dataset_files) <= set(names)
+    assert {name + '_array' for name in stats_datasets} <= set(names)
+    assert {'granger_bitmasks', 'association_table'} <= set(names)
+
+
+def shipped_frame(dataset):
+    file_name, read_args = dataset_files[dataset]
+    return pd.read_csv(os.path.join(data_dir, file_name), **read_args)
+
+
+def set_stat(df, stat, value, cluster='0', variate='iob', hour=3):
+    column = (cluster, stat, f'xtrain {variate} mean')
+    df[column] = df[column].astype(float)
+    df.loc[hour, column] = value
+    return df
+
+
+def test_shipped_data_files_are_valid():
+    assert validate_all(create_store()) == {}
+
+
+# key = test id, value = (dataset, corruption of the shipped frame, expected message)
+corruptions = {
+    'stats missing column': ('meal_rise_stats', lambda df: df.drop(columns=[('1', 'count', 'xtrain bg mean')]),
+                             'missing column'),
+    'stats missing hour': ('meal_rise_stats', lambda df: df.drop(index=23), 'expected hourly rows'),
+    'stats missing value': ('meal_rise_stats', lambda df: set_stat(df, 'mean', np.nan), 'missing value'),
+    'stats lo above mean': ('meal_rise_stats', lambda df: set_stat(df, 'ci96_lo', 1e6), 'ci96_lo > mean'),
+    'stats mean above hi': ('meal_rise_stats', lambda df: set_stat(df, 'ci96_hi', -1e6), 'mean > ci96_hi'),
+    'stats negative count': ('meal_rise_stats', lambda df: set_stat(df, 'count', -1), 'negative count'),
+    'stats fractional count': ('meal_rise_stats', lambda df: set_stat(df, 'count', 2.5), 'non integer count'),
+    'frequency timeframe': ('pattern_frequency', lambda df: df.replace({'timeframe': {'Clusters': 'Years'}}),
+                            'timeframe not in'),
+    'frequency pattern type': ('pattern_frequency', lambda df: df.replace({'pattern_type': {'Expected': 'Odd'}}),
+                               'pattern_type not in'),
+    'frequency pattern number': ('pattern_frequency', lambda df: df.replace({'pattern_number': {3: 4}}),
+                                 'pattern_number not in'),
+    'frequency duplicate': ('pattern_frequency', lambda df: pd.concat([df, df.iloc[:1]]), 'duplicated pattern'),
+    'frequency negative': ('pattern_frequency', lambda df: df.assign(mean=-df['mean']), 'negative frequency'),
+    'frequency missing value': ('pattern_frequency', lambda df: df.assign(mean=np.nan), 'missing value'),
+    'associations tau': ('pattern_associations', lambda df: df.assign(Age=1.5), 'outside [-1, 1]'),
+    'associations no factors': ('pattern_associations', lambda df: df[['pattern_number', 'pattern_type', 'timeframe']],
+                                'no demographic columns'),
+    'granger lag': ('granger_causality', lambda df: df.assign(lag=0), 'lag < 1'),
+    'granger derivatives': ('granger_causality', lambda df: df.assign(no_derivatives=5), 'no_derivatives not in'),
+    'granger cluster': ('granger_causality', lambda df: df.assign(Cluster=2), 'Cluster not in'),
+    'granger float ids': ('granger_causality', lambda df: df.assign(id=df['id'] + 0.5), 'id must be integers'),
+    'granger results': ('granger_causality', lambda df: df.assign(**{'IG->IOB': 1}), 'TRUE/FALSE'),
+    'granger duplicate': ('granger_causality', lambda df: pd.concat([df, df.iloc[:1]]), 'duplicated test'),
+    'granger missing column': ('granger_causality', lambda df: df.drop(columns=['COB->IG']), 'missing column'),
+}
+
+
+@pytest.mark.parametrize('dataset, corrupt, message', corruptions.values(), ids=corruptions.keys())
+def test_validators_reject_corrupted_files(dataset, corrupt, message):
+    validator = dataset_validators[dataset]
+    validator(shipped_frame(dataset), 'shipped.csv')
+    with pytest.raises(DataValidationError, match=r'^corrupted\.csv: .*' + message.replace('[', r'\[')):
+        validator(corrupt(shipped_frame(dataset)), 'corrupted.csv')
+
+
+@pytest.fixture
+def data_copy(tmp_path, monkeypatch):
+    """Copy of data/ that the store reads instead, updated tables are looked for next to it"""
+    shutil.copytree(data_dir, tmp_path / 'data')
+    monkeypatch.setattr(data_store, 'data_dir', str(tmp_path / 'data'))
+    monkeypatch.setitem(updated_dataset_files, 'granger_causality', str(tmp_path / 'granger_causality.csv'))
+    return tmp_path / 'data'
+
+
+def test_unchanged_files_are_validated_once(data_copy):
+    calls = []
+    new_store = DataStore()
+    new_store.register_csv('frequency', 'pattern_frequency.csv', validator=lambda df, name: calls.append(name),
+                           index_col=0)
+    new_store.get('frequency')
+    new_store.evict('frequency')
+    new_store.get('frequency')
+    assert calls == ['pattern_frequency.csv']
+
+    with open(data_copy / 'pattern_frequency.csv', 'a') as f:
+        f.write('\n24,3,Unexpected,Clusters,1\n')
+    new_store.evict('frequency')
+    new_store.get('frequency')
+    assert len(calls) == 2
+
+
+def test_validate_all_reports_every_invalid_file(data_copy):
+    corrupt = shipped_frame('pattern_frequency').assign(mean=-1)
+    corrupt.to_csv(data_copy / dataset_files['pattern_frequency'][0])
+    (data_copy / dataset_files['granger_causality'][0]).write_text('id,lag\n1,0\n')
+    errors = validate_all(create_store())
+    assert set(errors) == {'pattern_frequency', 'granger_causality'}
+    assert 'negative frequency' in errors['pattern_frequency']
+    assert 'missing column' in errors['granger_causality']
+
+
+def test_validate_all_on_every_rerun_neither_reloads_nor_evicts(data_copy):
+    new_store = create_store()
+    new_store.memory_budget_bytes = 20 * 1024
+    assert validate_all(new_store) == {}
+    # the page loads what it renders, later reruns must keep it
+    new_store.get('meal_rise_stats')
+    loads = new_store.memory_report()['loads'].copy()
+    evictions = new_store.evictions
+    for _ in range(3):
+        assert validate_all(new_store) == {}
+    pd.testing.assert_series_equal(new_store.memory_report()['loads'], loads)
+    assert new_store.evictions == evictions
+    assert new_store.memory_report().loc['meal_rise_stats', 'loaded']
+
+    # a changed file is validated again
+    corrupt = shipped_frame('pattern_frequency').assign(mean=-1)
+    corrupt.to_csv(data_copy / dataset_files['pattern_frequency'][0])
+    assert set(validate_all(new_store)) == {'pattern_frequency'}
+
+
+def test_updated_granger_table_replaces_the_study_table(data_copy):
+    new_store = create_store()
+    study = new_store.get('granger_causality')
+    assert validate_all(new_store) == {}
+    assert 4 not in study['lag'].unique()
+
+    # the app process picks up a table written by granger_cache.py with further lags on its next rerun
+    updated = pd.concat([study, study[study['lag'] == 3].assign(lag=4)], ignore_index=True)
+    updated.to_csv(updated_dataset_files['granger_causality'])
+    assert new_store.needs_validation('granger_causality')
+    assert validate_all(new_store) == {}
+    assert new_store.get('granger_causality')['lag'].max() == 4
+    assert (4, 3) in new_store.get('granger_bitmasks')
+    assert new_store.file_path('granger_causality')[0] == updated_dataset_files['granger_causality']
+
+
+def test_invalidate_evicts_derived_values():
+    new_store = array_store(None, {'a': 80, 'b': 80})
+    new_store.register('a_index', lambda: new_store.get('a') + 1, depends=['a'])
+    new_store.get('a_index')
+    new_store.get('b')
+    new_store.invalidate('a')
+    assert resident(new_store) == {'a': False, 'b': True, 'a_index': False}
+
+
+def test_unreadable_files_are_validation_errors(data_copy):
+    # a stats file whose header rows have different lengths and a truncated npz file
+    stats_file = data_copy / dataset_files['meal_rise_stats'][0]
+    lines = stats_file.read_text().splitlines()
+    stats_file.write_text('\n'.join([lines[0][:40]] + lines[1:]))
+    (data_copy / optional_array_files['person_sufficient_stats']).write_bytes(b'PK\x03\x04 truncated')
+    errors = validate_all(create_store())
+    assert set(errors) == {'meal_rise_stats', 'person_sufficient_stats'}
+    assert errors['meal_rise_stats'].startswith(dataset_files['meal_rise_stats'][0] + ': cannot be read')
+    assert errors['person_sufficient_stats'].startswith('person_sufficient_stats.npz: cannot be read')
+
+
+def test_missing_optional_files_load_as_none(data_copy):
+    new_store = create_store()
+    for name in list(optional_dataset_files) + list(optional_array_files):
+        assert new_store.get(name) is None
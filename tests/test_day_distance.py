@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from day_distance import dtw_distance, dtw_nearest, euclidean_nearest, shifted_days
+
+
+def naive_dtw(a, b, window):
+    """Full dtw table without early abandoning, the reference for dtw_distance"""
+    n_hours = len(a)
+    table = np.full((n_hours + 1, n_hours + 1), np.inf)
+    table[0, 0] = 0
+    for i in range(1, n_hours + 1):
+        for j in range(max(1, i - window), min(n_hours, i + window) + 1):
+            cost = np.nansum((a[i - 1] - b[j - 1]) ** 2)
+            table[i, j] = cost + min(table[i - 1, j], table[i, j - 1], table[i - 1, j - 1])
+    return np.sqrt(table[n_hours, n_hours])
+
+
+@pytest.fixture
+def centroids():
+    rng = np.random.default_rng(1)
+    return np.abs(rng.normal(2, 1, (6, 24, 3)).cumsum(axis=1) / np.arange(1, 25)[None, :, None])
+
+
+@pytest.mark.parametrize('window', [0, 1, 2, 4])
+def test_dtw_distance_matches_naive_dtw(centroids, window):
+    days, _ = shifted_days(centroids, 10, max_shift=2, seed=2)
+    for day in days:
+        for centroid in centroids:
+            assert dtw_distance(day, centroid, window) == pytest.approx(naive_dtw(day, centroid, window))
+
+
+def test_dtw_distance_with_zero_window_is_euclidean(centroids):
+    days, _ = shifted_days(centroids, 5, seed=3)
+    _, distances = euclidean_nearest(days, centroids)
+    expected = [min(dtw_distance(day, centroid, 0) for centroid in centroids) for day in days]
+    np.testing.assert_allclose(distances, expected)
+
+
+def test_dtw_distance_skips_nan_hours(centroids):
+    day = centroids[0].copy()
+    day[5] = np.nan
+    assert dtw_distance(day, centroids[0]) == pytest.approx(naive_dtw(day, centroids[0], 2))
+    assert dtw_distance(day, centroids[0]) == 0
+
+
+def test_early_abandoning_only_returns_inf_above_the_limit(centroids):
+    distance = dtw_distance(centroids[0], centroids[1])
+    assert dtw_distance(centroids[0], centroids[1], abandon_above=distance * 1.01) == pytest.approx(distance)
+    assert dtw_distance(centroids[0], centroids[1], abandon_above=distance * 0.5) == np.inf
+
+
+@pytest.mark.parametrize('window', [1, 2, 3])
+def test_pruned_dtw_nearest_matches_naive_dtw(centroids, window):
+    days, _ = shifted_days(centroids, 60, max_shift=window, seed=4)
+    nearest, distances, n_computed = dtw_nearest(days, centroids, window, prune=True)
+    reference = np.array([[naive_dtw(day, centroid, window) for centroid in centroids] for day in days])
+    np.testing.assert_array_equal(nearest, reference.argmin(axis=1))
+    np.testing.assert_allclose(distances, reference.min(axis=1))
+    assert n_computed < len(days) * len(centroids)
+
+
+def test_unpruned_dtw_nearest_computes_every_pair(centroids):
+    days, _ = shifted_days(centroids, 20, seed=5)
+    pruned_nearest, pruned_distances, _ = dtw_nearest(days, centroids, prune=True)
+    nearest, distances, n_computed = dtw_nearest(days, centroids, prune=False)
+    np.testing.assert_array_equal(nearest, pruned_nearest)
+    np.testing.assert_allclose(distances, pruned_distances)
+    assert n_computed == len(days) * len(centroids)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from granger_cache import chi2_sf, granger_causes, lagged_windows, residual_sum_of_squares, significance
+
+
+def ssr_chi2_p_value(windows, cause, effect, lag):
+    """p value of the ssr chi-square test with the least squares fits solved from the normal equations"""
+    y = windows[:, effect, -1]
+    restricted = np.column_stack([np.ones(len(windows)), windows[:, effect, :-1]])
+    unrestricted = np.column_stack([restricted, windows[:, cause, :-1]])
+    rss = [((y - x @ np.linalg.solve(x.T @ x, x.T @ y)) ** 2).sum() for x in [restricted, unrestricted]]
+    return stats.chi2.sf(len(windows) * (rss[0] - rss[1]) / rss[1], lag)
+
+
+def causal_day(n_hours, strength, seed):
+    """One long day [1, hour, variate] where variate 1 follows variate 0 one hour later with the given strength"""
+    rng = np.random.default_rng(seed)
+    cause = rng.normal(size=n_hours)
+    effect = rng.normal(size=n_hours)
+    effect[1:] += strength * cause[:-1]
+    return np.stack([cause, effect], axis=1)[None]
+
+
+@pytest.mark.parametrize('df', range(1, 13))
+def test_chi2_sf_matches_scipy(df):
+    x = np.concatenate([np.linspace(0.01, 5, 50), np.linspace(5, 60, 50)])
+    np.testing.assert_allclose([chi2_sf(value, df) for value in x], stats.chi2.sf(x, df), rtol=1e-9, atol=1e-15)
+
+
+def test_chi2_sf_of_non_positive_values():
+    assert chi2_sf(0, 3) == 1.0
+    assert chi2_sf(-1, 2) == 1.0
+
+
+def test_lagged_windows_do_not_cross_days_and_skip_nan():
+    features = np.arange(2 * 5 * 2, dtype=float).reshape(2, 5, 2)
+    features[1, 1, 0] = np.nan
+    windows = lagged_windows(features, 2)
+    # 3 windows in the first day, only the window after the missing hour in the second
+    assert windows.shape == (4, 2, 3)
+    np.testing.assert_array_equal(windows[0], features[0, 0:3].T)
+    np.testing.assert_array_equal(windows[3], features[1, 2:5].T)
+    assert lagged_windows(features, 5).shape == (0, 2, 6)
+
+
+def test_residual_sum_of_squares_matches_normal_equations():
+    rng = np.random.default_rng(0)
+    x = np.column_stack([np.ones(50), rng.normal(size=(50, 3))])
+    y = x @ [1, 2, -1, 0.5] + rng.normal(size=50)
+    beta = np.linalg.solve(x.T @ x, x.T @ y)
+    assert residual_sum_of_squares(x, y) == pytest.approx(((y - x @ beta) ** 2).sum())
+
+
+@pytest.mark.parametrize('lag', [1, 2, 4])
+@pytest.mark.parametrize('strength', [0.0, 0.1, 0.3, 1.0])
+def test_granger_causes_matches_ssr_chi2_test(lag, strength):
+    windows = lagged_windows(causal_day(200, strength, seed=lag), lag)
+    for cause, effect in [(0, 1), (1, 0)]:
+        expected = ssr_chi2_p_value(windows, cause, effect, lag) < significance
+        assert granger_causes(windows, cause, effect, lag) == expected
+
+
+def test_granger_causes_detects_the_direction():
+    windows = lagged_windows(causal_day(300, 1.0, seed=0), 1)
+    assert granger_causes(windows, 0, 1, 1)
+    assert not granger_causes(windows, 1, 0, 1)
+
+
+def test_granger_causes_needs_more_windows_than_parameters():
+    windows = lagged_windows(causal_day(6, 1.0, seed=0), 2)
+    assert not granger_causes(windows, 0, 1, 2)
+
+
+@pytest.mark.parametrize('lag', [1, 3])
+def test_granger_causes_matches_statsmodels(lag):
+    tsa = pytest.importorskip('statsmodels.tsa.stattools')
+    day = causal_day(150, 0.2, seed=lag)
+    windows = lagged_windows(day, lag)
+    for cause, effect in [(0, 1), (1, 0)]:
+        result = tsa.grangercausalitytests(day[0][:, [effect, cause]], [lag])
+        p_value = result[lag][0]['ssr_chi2test'][1]
+        assert ssr_chi2_p_value(windows, cause, effect, lag) == pytest.approx(p_value)
+        assert granger_causes(windows, cause, effect, lag) == (p_value < significance)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from pattern_discovery import matrix_profile, rolling_mean_std, sliding_dot_product
+
+
+def z_normalised(subsequence):
+    return (subsequence - subsequence.mean()) / subsequence.std()
+
+
+def naive_matrix_profile(series, m):
+    """Distance of every pair of subsequences computed directly, the reference for the STOMP updates"""
+    length = len(series) - m + 1
+    exclusion = max(1, m // 2)
+    profile = np.full(length, np.inf)
+    index = np.zeros(length, dtype=np.int64)
+    for i in range(length):
+        for j in range(length):
+            if abs(i - j) <= exclusion:
+                continue
+            distance = np.mean([np.linalg.norm(z_normalised(series[i:i + m, v]) - z_normalised(series[j:j + m, v]))
+                                for v in range(series.shape[1])])
+            if distance < profile[i]:
+                profile[i], index[i] = distance, j
+    return profile, index
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(80, 3)).cumsum(axis=0)
+
+
+def test_sliding_dot_product_matches_numpy(series):
+    query = series[10:18, 0]
+    expected = [query @ series[j:j + 8, 0] for j in range(len(series) - 7)]
+    np.testing.assert_allclose(sliding_dot_product(query, series[:, 0]), expected)
+
+
+def test_rolling_mean_std_matches_numpy(series):
+    mean, std = rolling_mean_std(series, 6)
+    windows = np.stack([series[j:j + 6] for j in range(len(series) - 5)])
+    np.testing.assert_allclose(mean, windows.mean(axis=1))
+    np.testing.assert_allclose(std, windows.std(axis=1), atol=1e-6)
+
+
+@pytest.mark.parametrize('m', [4, 7, 12])
+def test_matrix_profile_matches_naive(series, m):
+    profile, index = matrix_profile(series, m)
+    expected_profile, expected_index = naive_matrix_profile(series, m)
+    np.testing.assert_allclose(profile, expected_profile, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(index, expected_index)
+
+
+def test_matrix_profile_finds_a_planted_motif():
+    rng = np.random.default_rng(1)
+    series = rng.normal(0, 0.1, size=(120, 2))
+    motif = np.stack([np.sin(np.linspace(0, 3, 10)), np.linspace(0, 2, 10)], axis=1) * 5
+    series[20:30] += motif
+    series[80:90] += motif
+    profile, index = matrix_profile(series, 10)
+    assert profile[20] < np.median(profile) / 2
+    assert index[20] == 80 and index[80] == 20
+
+
+def test_subsequences_with_nan_are_never_neighbours(series):
+    series = series.copy()
+    series[30, 1] = np.nan
+    profile, index = matrix_profile(series, 6)
+    assert np.isinf(profile[25:31]).all()
+    assert np.isfinite(np.delete(profile, range(25, 31))).all()
+    assert not np.isin(index, range(25, 31)).any()
+
+
+def test_series_shorter_than_two_windows():
+    profile, index = matrix_profile(np.zeros((5, 3)), 5)
+    assert np.isinf(profile).all() and len(index) == 1
@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from data_store import data_dir, dataset_files, demographic_factors, stats_datasets, validate_stats
+from precompute import Config, build_demographic_associations, data_file, kendall_tau_b, pattern_keys, \
+    rebuilt_stats_datasets, run_pipeline
+from synthetic_cohort import generate_cohort
+
+
+def scipy_tau_b(x, y):
+    keep = ~np.isnan(x)
+    return stats.kendalltau(x[keep], y[keep], variant='b').statistic
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_kendall_tau_b_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=80)
+    y = rng.random(80) < 0.3 + 0.3 * (x > 0)
+    assert kendall_tau_b(x, y) == pytest.approx(scipy_tau_b(x, y))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_kendall_tau_b_with_ties_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    # integer factors like age or years since diagnosis have many ties
+    x = rng.integers(0, 6, size=60).astype(float)
+    y = rng.random(60) < 0.2 + 0.1 * x
+    assert kendall_tau_b(x, y) == pytest.approx(scipy_tau_b(x, y))
+
+
+def test_kendall_tau_b_leaves_out_missing_values():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 10, size=50).astype(float)
+    x[::7] = np.nan
+    y = rng.random(50) < 0.5
+    assert kendall_tau_b(x, y) == pytest.approx(scipy_tau_b(x, y))
+    assert kendall_tau_b(x, y.astype(int)) == kendall_tau_b(x, y)
+
+
+def test_kendall_tau_b_of_perfect_order():
+    x = np.arange(10.0)
+    assert kendall_tau_b(x, x >= 5) == pytest.approx(scipy_tau_b(x, x >= 5))
+    assert kendall_tau_b(-x, x >= 5) == pytest.approx(-scipy_tau_b(x, x >= 5))
+
+
+@pytest.mark.parametrize('x, y', [([1.0, 2.0, 3.0], [0, 0, 0]), ([2.0, 2.0, 2.0], [0, 1, 1]),
+                                  ([np.nan, 1.0, np.nan], [0, 1, 0]), ([], [])])
+def test_kendall_tau_b_without_variation_is_zero(x, y):
+    assert kendall_tau_b(x, y) == 0.0
+
+
+def test_build_demographic_associations_matches_scipy(tmp_path):
+    rng = np.random.default_rng(0)
+    ids = np.arange(1, 41)
+    demographics = pd.DataFrame({factor: rng.integers(20, 60, size=len(ids)).astype(float)
+                                 for factor in demographic_factors.values()}, index=pd.Index(ids, name='id'))
+    demographics.iloc[::9, 0] = np.nan
+    keys = pattern_keys()[:-1]
+    frequency = pd.DataFrame([(*key, person, int(rng.random() < 0.4)) for key in keys for person in ids],
+                             columns=['pattern_number', 'pattern_type', 'timeframe', 'id', 'has_pattern'])
+    config = Config(str(tmp_path / 'series'), str(tmp_path), str(tmp_path), [1])
+    demographics.to_csv(data_file(config, 'person_demographics'))
+    frequency.to_csv(data_file(config, 'person_pattern_frequency'), index=False)
+
+    build_demographic_associations(config, workers=1)
+
+    associations = pd.read_csv(data_file(config, 'pattern_associations'))
+    factors = list(demographic_factors.values())
+    assert len(associations) == len(pattern_keys())
+    # the combination without per person rows counts no people
+    assert (associations.iloc[-1][factors] == 0).all()
+    for key, (_, row) in zip(keys, associations.iterrows()):
+        assert (row['pattern_number'], row['pattern_type'], row['timeframe']) == key
+        flags = frequency[(frequency[['pattern_number', 'pattern_type', 'timeframe']] == key).all(axis=1)]
+        people = demographics.reindex(flags['id'])
+        for factor in factors:
+            expected = scipy_tau_b(people[factor].to_numpy(), flags['has_pattern'].to_numpy())
+            assert row[factor] == pytest.approx(round(expected, 2))
+
+
+shipped_data_dir = os.path.abspath(data_dir)
+
+
+@pytest.fixture
+def cohort_dir(tmp_path, monkeypatch):
+    """Small synthetic cohort, the stages' caches are written below tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    generate_cohort(6, 40, series_dir=str(tmp_path / 'series'), out_dir=str(tmp_path / 'raw'), workers=1)
+    return tmp_path
+
+
+def pipeline_config(cohort_dir, ci_method='normal'):
+    return Config(str(cohort_dir / 'series'), str(cohort_dir / 'raw'), str(cohort_dir / 'out'), (1, 2), ci_method)
+
+
+@pytest.mark.parametrize('ci_method', ['normal', 'percentile'])
+def test_rebuilt_cluster_stats_match_the_shipped_files(cohort_dir, ci_method):
+    config = pipeline_config(cohort_dir, ci_method)
+    manifest = run_pipeline(config, workers=2, manifest_path=str(cohort_dir / 'manifest.json'))
+    assert {result['status'] for result in manifest['stages'].values()} == {'built'}
+    for dataset in stats_datasets:
+        path = data_file(config, dataset)
+        if dataset not in rebuilt_stats_datasets:
+            # single person charts are not rebuilt from a group of people
+            assert not os.path.exists(path)
+            continue
+        with open(path) as built, open(os.path.join(shipped_data_dir, dataset_files[dataset][0])) as shipped:
+            assert [built.readline().split(',')[0] for _ in range(4)] == \
+                [shipped.readline().split(',')[0] for _ in range(4)]
+        validate_stats(pd.read_csv(path, header=[0, 1, 2], index_col=0), dataset)
+
+
+def test_stages_share_the_workers(cohort_dir):
+    config = pipeline_config(cohort_dir)
+    manifest = run_pipeline(config, workers=1, manifest_path=str(cohort_dir / 'manifest.json'))
+    assert {result['workers'] for result in manifest['stages'].values()} == {1}
+    manifest = run_pipeline(config, workers=3, manifest_path=str(cohort_dir / 'manifest.json'), force=True)
+    assert all(1 <= result['workers'] <= 3 for result in manifest['stages'].values())
+
+
+def test_unchanged_stages_are_skipped_and_the_ci_method_rebuilds_cluster_stats(cohort_dir):
+    manifest_path = str(cohort_dir / 'manifest.json')
+    run_pipeline(pipeline_config(cohort_dir), workers=2, manifest_path=manifest_path)
+    manifest = run_pipeline(pipeline_config(cohort_dir), workers=2, manifest_path=manifest_path)
+    assert {result['status'] for result in manifest['stages'].values()} == {'skipped'}
+    manifest = run_pipeline(pipeline_config(cohort_dir, 'bca'), workers=2, manifest_path=manifest_path)
+    assert manifest['stages']['cluster_stats']['status'] == 'built'
+
+
+def test_building_into_the_data_dir_needs_permission(cohort_dir):
+    config = pipeline_config(cohort_dir)._replace(out_dir=os.path.abspath(data_dir))
+    with pytest.raises(ValueError, match='Refusing'):
+        run_pipeline(config, manifest_path=str(cohort_dir / 'manifest.json'))
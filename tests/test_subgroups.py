@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import key_findings
+import subgroups
+from cluster_stats import person_sufficient_stats, stats_frame_from_sufficient_stats, z_95
+from data_store import DataStore, clusters, hours, variates, stats, sufficient_stats
+from subgroups import _subgroup_results, filter_signature, subgroup_results
+
+
+def cohort_days(n_people=6, n_days=30, seed=0):
+    """Member days [day, hour, variate] with missing readings and cluster labels [day] per person"""
+    rng = np.random.default_rng(seed)
+    people = []
+    for _ in range(n_people):
+        days = rng.normal(5, 2, (n_days, len(hours), len(variates)))
+        days[rng.random(days.shape) < 0.1] = np.nan
+        people.append((days, rng.integers(0, len(clusters), n_days)))
+    return people
+
+
+def summed_stats(people):
+    per_person = [person_sufficient_stats(days, labels) for days, labels in people]
+    return [sum(person[stat] for person in per_person) for stat in sufficient_stats]
+
+
+def test_summed_sufficient_stats_reproduce_the_cohort_stats():
+    people = cohort_days()
+    df = stats_frame_from_sufficient_stats(*summed_stats(people))
+    all_days = np.concatenate([days for days, _ in people])
+    all_labels = np.concatenate([labels for _, labels in people])
+    for c, cluster in enumerate(clusters):
+        member_days = all_days[all_labels == c]
+        count = (~np.isnan(member_days)).sum(axis=0)
+        mean = np.nanmean(member_days, axis=0)
+        half_width = z_95 * np.nanstd(member_days, axis=0, ddof=1) / np.sqrt(count)
+        for v, variate in enumerate(variates):
+            column = f'xtrain {variate} mean'
+            np.testing.assert_array_equal(df[(cluster, 'count', column)], count[:, v])
+            np.testing.assert_allclose(df[(cluster, 'mean', column)], mean[:, v])
+            np.testing.assert_allclose(df[(cluster, 'ci96_lo', column)], mean[:, v] - half_width[:, v])
+            np.testing.assert_allclose(df[(cluster, 'ci96_hi', column)], mean[:, v] + half_width[:, v])
+
+
+def test_stats_frame_has_the_format_of_the_stats_files():
+    df = stats_frame_from_sufficient_stats(*summed_stats(cohort_days(n_people=2)))
+    shipped = pd.read_csv('data/figure-2a-stats-results.csv', header=[0, 1, 2], index_col=0)
+    assert set(df.columns) == set(shipped.columns)
+    assert df.index.tolist() == shipped.index.tolist() == hours
+    assert df.index.name == shipped.index.name
+    assert {stat for _, stat, _ in df.columns} == set(stats)
+
+
+@pytest.fixture
+def person_store(monkeypatch):
+    """Store with the per person datasets of a small cohort in place of the shared store"""
+    people = cohort_days()
+    ids = np.arange(1, len(people) + 1)
+    per_person = [person_sufficient_stats(days, labels) for days, labels in people]
+    arrays = {'ids': ids}
+    arrays.update({f'meal_rise_stats/{stat}': np.stack([person[stat] for person in per_person])
+                   for stat in sufficient_stats})
+    demographics = pd.DataFrame({'id': ids, 'Age': [20, 30, 40, 50, 60, 70], 'A1C': [6, 7, 8, 6, 7, 8]})
+    frequency = pd.DataFrame({'id': ids, 'pattern_number': 1, 'pattern_type': 'Unexpected', 'timeframe': 'Clusters',
+                              'has_pattern': [1, 0, 1, 1, 0, 0]})
+    new_store = DataStore()
+    new_store.register('person_demographics', lambda: demographics)
+    new_store.register('person_sufficient_stats', lambda: arrays)
+    new_store.register('person_pattern_frequency', lambda: frequency)
+    monkeypatch.setattr(subgroups, 'store', new_store)
+    _subgroup_results.cache_clear()
+    yield people
+    _subgroup_results.cache_clear()
+
+
+def test_subgroup_results_sum_the_selected_people(person_store):
+    ids, stats_frames, pattern_frequency = subgroup_results(filter_signature({'Age': (25, 65), 'A1C': (7, 8)}))
+    np.testing.assert_array_equal(ids, [2, 3, 5])
+    expected = stats_frame_from_sufficient_stats(*summed_stats([person_store[i - 1] for i in ids]))
+    pd.testing.assert_frame_equal(stats_frames['meal_rise_stats'], expected)
+    assert pattern_frequency['mean'].tolist() == [1]
+
+
+def test_subgroup_results_are_cached_per_filter_signature(person_store):
+    first = subgroup_results(filter_signature({'Age': (25, 65), 'A1C': (7, 8)}))
+    # the same filters in another order and as ints hit the cache
+    assert subgroup_results(filter_signature({'A1C': (7.0, 8.0), 'Age': (25, 65)})) is first
+    assert _subgroup_results.cache_info().hits == 1
+    subgroup_results(filter_signature({'Age': (25, 66)}))
+    assert _subgroup_results.cache_info().misses == 2
+    assert subgroups.store.memory_report()['loads'].max() == 1
+
+
+def test_reloaded_person_datasets_invalidate_the_cache(person_store):
+    signature = filter_signature({'Age': (25, 65)})
+    first = subgroup_results(signature)
+    subgroups.store.evict('person_sufficient_stats')
+    assert subgroup_results(signature) is not first
+    assert _subgroup_results.cache_info().misses == 2
+    assert subgroup_results(signature) is subgroup_results(signature)
+
+
+def test_icon_array_of_a_subgroup_shows_its_tested_people(monkeypatch):
+    granger_store = DataStore()
+    granger_store.register('granger_bitmasks', lambda: {'ids': np.array([1, 2, 3, 5, 8])})
+    monkeypatch.setattr(key_findings, 'store', granger_store)
+    tested_ids = subgroups.tested_subgroup_ids(np.array([5, 3, 4, 2]))
+    assert tested_ids == [2, 3, 5]
+    html = key_findings.icon_array_html([3], [5], ids=tested_ids)
+    assert html.count('<svg') == len(tested_ids)
+    assert html.count('group1-') == 2 and html.count('group2-') == 2
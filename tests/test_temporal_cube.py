@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_store import data_dir
+from temporal_cube import calendar_codes, cube_file, load_cube, month_codes, month_names, person_rollup, save_cube, \
+    weekday_codes, weekday_names
+
+
+@pytest.fixture
+def day_numbers():
+    # 1800 to 2200, across the century leap rules of 1900, 2000 and 2100 and days before the epoch
+    first, last = pd.Timestamp('1800-01-01'), pd.Timestamp('2200-12-31')
+    return np.arange((first - pd.Timestamp(0)).days, (last - pd.Timestamp(0)).days + 1, dtype=np.int64)
+
+
+def test_weekday_codes_match_pandas(day_numbers):
+    dates = pd.to_datetime(day_numbers, unit='D')
+    np.testing.assert_array_equal(weekday_codes(day_numbers), dates.dayofweek)
+    assert weekday_names[weekday_codes(np.array([0]))[0]] == 'Thursday'
+
+
+def test_month_codes_match_pandas(day_numbers):
+    dates = pd.to_datetime(day_numbers, unit='D')
+    np.testing.assert_array_equal(month_codes(day_numbers), dates.month - 1)
+
+
+@pytest.mark.parametrize('date, month', [('2000-02-29', 'February'), ('1900-03-01', 'March'),
+                                         ('2024-12-31', 'December'), ('1969-12-31', 'December')])
+def test_month_codes_of_single_days(date, month):
+    day_number = (pd.Timestamp(date) - pd.Timestamp(0)).days
+    assert month_names[month_codes(np.array([day_number]))[0]] == month
+
+
+def test_person_rollup_matches_pandas_groupby():
+    rng = np.random.default_rng(0)
+    day_numbers = np.sort(rng.choice(np.arange(19000, 19800), 60, replace=False))
+    profiles = rng.normal(size=(60, 24, 3))
+    profiles[rng.random(profiles.shape) < 0.1] = np.nan
+    day_clusters = rng.integers(-1, 2, size=60)
+
+    frame = pd.DataFrame(profiles.reshape(-1, 3), columns=['iob', 'cob', 'bg'])
+    dates = pd.to_datetime(np.repeat(day_numbers, 24), unit='D')
+    frame['Hours of the day'] = np.tile(np.arange(24), 60)
+    frame['Clusters'] = np.repeat(day_clusters, 24)
+    frame['Days of the week'] = dates.dayofweek
+    frame['Months of the year'] = dates.month - 1
+    frame['Weekend vs weekday'] = (dates.dayofweek >= 5).astype(int)
+
+    rollups = person_rollup(day_numbers, profiles, day_clusters)
+    assert set(rollups) == set(calendar_codes)
+    for timeframe, (codes, sums, counts) in rollups.items():
+        grouped = frame[frame[timeframe] >= 0].groupby(timeframe)[['iob', 'cob', 'bg']]
+        np.testing.assert_array_equal(codes, grouped.sum().index)
+        np.testing.assert_allclose(sums, grouped.sum())
+        np.testing.assert_array_equal(counts, grouped.count())
+
+
+def test_cube_is_saved_outside_the_data_dir(tmp_path, monkeypatch):
+    assert os.path.commonpath([os.path.abspath(cube_file), os.path.abspath(data_dir)]) != os.path.abspath(data_dir)
+    monkeypatch.chdir(tmp_path)
+    cube = {'ids': np.array([1, 2]), 'weekday/sum': np.arange(6.0).reshape(2, 3)}
+    save_cube(cube)
+    assert os.path.exists(tmp_path / cube_file)
+    loaded = load_cube()
+    assert loaded.keys() == cube.keys()
+    np.testing.assert_array_equal(loaded['weekday/sum'], cube['weekday/sum'])
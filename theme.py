@@ -0,0 +1,90 @@
+import functools
+import os
+
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+
+from constants import expected_colour, unexpected_colour, variate_colours, cluster_colours
+
+css_file = os.path.join('style', 'style.css')
+# opacity of the confidence interval bands
+band_alpha = 0.2
+# styles of metrics in style/style.css, see styled_metric
+metric_styles = ['plain', 'expected', 'unexpected', 'some-days', 'most-days']
+# layout and trace parts of the default template that 2d charts use, the rest (3d scenes, maps, polar axes, colour
+# scales) would otherwise be sent with every figure
+template_layout_keys = ['autotypenumbers', 'colorway', 'font', 'hoverlabel', 'hovermode', 'paper_bgcolor',
+                        'plot_bgcolor', 'xaxis', 'yaxis', 'title', 'annotationdefaults', 'shapedefaults']
+template_data_keys = ['bar', 'scatter']
+
+# key = (file path, render function), value = (modification time of the file, rendered content)
+_resources = {}
+
+
+def cached_resource(path, render):
+    """render(content of the text file at path), read and rendered again only when the file's mtime changed"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _resources.get((path, render))
+    if cached is None or cached[0] != mtime:
+        with open(path, encoding='utf-8') as f:
+            cached = (mtime, render(f.read()))
+        _resources[(path, render)] = cached
+    return cached[1]
+
+
+@functools.lru_cache(maxsize=None)
+def hex_to_rgba(hex_colour, alpha=1.0):
+    """'#rrggbb' as a css 'rgba(r, g, b, alpha)' string"""
+    r, g, b = (int(hex_colour.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4))
+    return f'rgba({r}, {g}, {b}, {alpha})'
+
+
+# key = variate/cluster as in variate_colours/cluster_colours, value = rgba fill of its confidence interval band
+variate_fills = {key: hex_to_rgba(colour, band_alpha) for key, colour in variate_colours.items()}
+cluster_fills = {key: hex_to_rgba(colour, band_alpha) for key, colour in cluster_colours.items()}
+
+
+def css_variables(secondary_bg_color, text_colour):
+    return f"""
+:root {{
+    --secondary-bg-color: {secondary_bg_color};
+    --text-colour: {text_colour};
+    --expected-colour: {expected_colour};
+    --unexpected-colour: {unexpected_colour};
+}}
+"""
+
+
+@functools.lru_cache(maxsize=8)
+def _page_style(stylesheet, secondary_bg_color, text_colour):
+    return f"<style>{css_variables(secondary_bg_color, text_colour)}{stylesheet}</style>"
+
+
+def page_style(secondary_bg_color, text_colour, path=css_file):
+    """Style element of the css variables and the stylesheet, re-read only when the stylesheet changed"""
+    return _page_style(cached_resource(path, str), secondary_bg_color, text_colour)
+
+
+def styled_metric(style, key, label, value, **kwargs):
+    """
+    st.metric in a container keyed 'metric-<style>-<key>', styled by style/style.css through the container's
+    st-key class. style is one of metric_styles, key must be unique on the page.
+    """
+    with st.container(key=f"metric-{style}-{key}"):
+        st.metric(label, value, **kwargs)
+
+
+def shared_template():
+    """
+    The default template cut down to what the charts use. Once streamlit is imported that is streamlit's template,
+    whose placeholder colours the app replaces with the colours of the light or dark theme.
+    """
+    default_template = pio.templates[pio.templates.default]
+    layout = {key: value for key, value in default_template.layout.to_plotly_json().items()
+              if key in template_layout_keys}
+    data = {key: value for key, value in default_template.data.to_plotly_json().items() if key in template_data_keys}
+    return go.layout.Template(layout=layout, data=data)
+
+
+chart_template = shared_template()